@@ -53,6 +53,12 @@ def track_message(user_id: int, content: str) -> None:
             pass
 
 
+async def atrack_message(user_id: int, content: str) -> None:
+    if not content:
+        return
+    await storage.arun(track_message, user_id, content)
+
+
 def calculate_abuse_score(user_id: int) -> dict:
     try:
         records = storage.get_abuse_tracking_records(user_id)
@@ -163,12 +169,16 @@ def get_user_message_history(user_id: int, limit: int = 50) -> list:
     return records
 
 
+def _forget_user(user_id: int) -> None:
+    with _LOCK:
+        _message_cache.pop(user_id, None)
+
+
 def clear_user_tracking(user_id: int) -> bool:
     try:
         storage.clear_abuse_tracking_records(user_id)
-        with _LOCK:
-            if user_id in _message_cache:
-                del _message_cache[user_id]
+        # inside a storage transaction the cached messages are only dropped once the delete has committed
+        storage.after_commit(lambda: _forget_user(user_id), storage._domain_for('abuse_tracking'))
         return True
     except Exception:
         return False
@@ -7,9 +7,15 @@ from datetime import datetime, timezone, timedelta
 
 
 class BackupManager:
-    def __init__(self, db_path: Path, backups_dir: Path = None, interval_hours: float = 12.0, retain_days: int = 7, max_backups: int = 14):
-        self.db_path = Path(db_path)
-        self.backups_dir = Path(backups_dir) if backups_dir is not None else (self.db_path.parent / "backups")
+    def __init__(self, db_path, backups_dir: Path = None, interval_hours: float = 12.0, retain_days: int = 7, max_backups: int = 14):
+        # db_path may be a single database or a list of them, every file is backed up each run
+        paths = db_path if isinstance(db_path, (list, tuple)) else [db_path]
+        self.db_paths = [Path(p) for p in paths]
+        # with no files (an in-memory storage backend) there is nothing to back up
+        self.db_path = self.db_paths[0] if self.db_paths else None
+        self.backups_dir = Path(backups_dir) if backups_dir is not None else (
+            (self.db_path.parent if self.db_path else Path("data")) / "backups"
+        )
         self.interval = int(interval_hours * 3600)
         self.retain_days = retain_days
         self.max_backups = max_backups
@@ -44,29 +50,34 @@ class BackupManager:
                 pass
 
     def _make_backup(self):
-        if not self.db_path.exists():
+        existing = [p for p in self.db_paths if p.exists()]
+        if not existing:
             return
         self.backups_dir.mkdir(parents=True, exist_ok=True)
         now = datetime.now(timezone.utc)
         ts = now.strftime("%Y%m%d%H%M%S")
-        dest_name = f"{self.db_path.stem}-{ts}{self.db_path.suffix}"
+        for db_path in existing:
+            self._backup_file(db_path, ts)
+
+        try:
+            self._prune_backups()
+        except Exception:
+            pass
+
+    def _backup_file(self, db_path: Path, ts: str):
+        dest_name = f"{db_path.stem}-{ts}{db_path.suffix}"
         dest_path = self.backups_dir / dest_name
 
         try:
-            with sqlite3.connect(str(self.db_path)) as src_conn:
+            with sqlite3.connect(str(db_path)) as src_conn:
                 with sqlite3.connect(str(dest_path)) as dst_conn:
                     src_conn.backup(dst_conn)
         except Exception:
             try:
-                shutil.copy2(str(self.db_path), str(dest_path))
+                shutil.copy2(str(db_path), str(dest_path))
             except Exception:
                 return
 
-        try:
-            self._prune_backups()
-        except Exception:
-            pass
-
     def _get_latest_backup_mtime(self):
         if not self.backups_dir.exists():
             return None
@@ -101,13 +112,18 @@ class BackupManager:
             except Exception:
                 continue
 
-        files = sorted([p for p in self.backups_dir.iterdir() if p.is_file()], key=lambda x: x.stat().st_mtime)
-        while len(files) > self.max_backups:
-            try:
-                files[0].unlink()
-            except Exception:
-                pass
-            files = sorted([p for p in self.backups_dir.iterdir() if p.is_file()], key=lambda x: x.stat().st_mtime)
+        # max_backups applies to each database separately
+        groups = {}
+        for p in self.backups_dir.iterdir():
+            if p.is_file():
+                groups.setdefault(p.name.rsplit('-', 1)[0], []).append(p)
+        for files in groups.values():
+            files.sort(key=lambda x: x.stat().st_mtime)
+            for p in files[:max(0, len(files) - self.max_backups)]:
+                try:
+                    p.unlink()
+                except Exception:
+                    pass
 
 
 __all__ = ["BackupManager"]
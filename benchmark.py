@@ -0,0 +1,472 @@
+import argparse
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+import storage
+from backup import BackupManager
+from vector_index import VectorIndex, top_k, pack_embedding
+
+
+_BACKEND = 'sqlite'
+
+
+def _use_temp_db(tmpdir: str):
+    if _BACKEND == 'memory':
+        storage.use_backend(storage.MemoryBackend())
+    else:
+        storage.use_backend(storage.SQLiteBackend(tmpdir))
+
+
+_OUTPUT = None
+
+# named PRAGMA profiles, each value overrides the matching storage setting from config.py
+PROFILES = {
+    'default': {},
+    'durable': {'STORAGE_SYNCHRONOUS': 'FULL'},
+    'memory': {'STORAGE_CACHE_SIZE_KB': 65536, 'STORAGE_MMAP_SIZE': 268435456, 'STORAGE_TEMP_STORE': 'MEMORY'},
+    'unsafe': {
+        'STORAGE_SYNCHRONOUS': 'OFF',
+        'STORAGE_CACHE_SIZE_KB': 65536,
+        'STORAGE_MMAP_SIZE': 268435456,
+        'STORAGE_TEMP_STORE': 'MEMORY',
+    },
+}
+_LARGE_KEY_ENTRIES = 100000
+_CHUNK = 50000
+
+
+def _emit(result: dict):
+    line = json.dumps(dict(result, backend=_BACKEND))
+    print(line, flush=True)
+    if _OUTPUT:
+        with open(_OUTPUT, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def _profile(name: str):
+    with _overrides(PROFILES[name]):
+        yield
+
+
+@contextmanager
+def _overrides(overrides: dict):
+    saved = {k: getattr(storage, k) for k in overrides}
+    for k, v in overrides.items():
+        setattr(storage, k, v)
+    try:
+        yield
+    finally:
+        storage.close()
+        for k, v in saved.items():
+            setattr(storage, k, v)
+
+
+def _summary(durations: list) -> dict:
+    durations = sorted(durations)
+    n = len(durations)
+    total = sum(durations)
+    return {
+        'ops': n,
+        'mean_us': round(total / n * 1e6, 2) if n else 0,
+        'p50_us': round(durations[n // 2] * 1e6, 2) if n else 0,
+        'p99_us': round(durations[min(n - 1, int(n * 0.99))] * 1e6, 2) if n else 0,
+        'ops_per_sec': round(n / total, 1) if total else 0,
+    }
+
+
+def _time_op(fn, args_list) -> dict:
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - start)
+    return _summary(durations)
+
+
+def _generate_dataset(size: int, rnd: random.Random):
+    now = time.time()
+    conn = storage._get_conn()
+    abuse = storage._get_conn('abuse')
+    with storage._writer_lock(), storage._writer_lock('abuse'):
+        for lo in range(0, size, _CHUNK):
+            ids = range(lo, min(size, lo + _CHUNK))
+            conn.executemany(
+                "INSERT INTO context_memory (user_id, channel_id, timestamp) VALUES (?, ?, ?)",
+                [(str(i), rnd.randrange(1, 10 ** 6), now) for i in ids]
+            )
+            abuse.executemany(
+                "INSERT INTO abuse_tracking (user_id, content_hash, content_len, timestamp) VALUES (?, ?, ?, ?)",
+                [(i % max(1, size // 20), f"{i:064x}", rnd.randrange(1, 2000), now - rnd.random() * 86400) for i in ids]
+            )
+            # every tenth description is older than the default 24h prune age
+            conn.executemany(
+                "INSERT INTO image_descriptions (attach_id, description, last_used) VALUES (?, ?, ?)",
+                [(str(i), "x" * 200, now - (2 * 86400 if i % 10 == 0 else 60)) for i in ids]
+            )
+            conn.executemany(
+                "INSERT INTO rpa_history (user_id, match) VALUES (?, ?)",
+                [(str(i % max(1, size // 10)), '{"result": "win"}') for i in ids]
+            )
+        conn.commit()
+        abuse.commit()
+    entries = min(size, _LARGE_KEY_ENTRIES)
+    storage.set_json('bench_large', {str(i): {'messages': i, 'last': now} for i in range(entries)})
+    storage.flush()
+    return entries
+
+
+def bench_suite(sizes=(1000, 100000, 1000000), profiles=tuple(PROFILES), ops: int = 1000):
+    for profile in profiles:
+        for size in sizes:
+            rnd = random.Random(size)
+            with tempfile.TemporaryDirectory() as tmpdir, _profile(profile):
+                _use_temp_db(tmpdir)
+                start = time.perf_counter()
+                entries = _generate_dataset(size, rnd)
+                base = {'bench': 'suite', 'profile': profile, 'size': size}
+                _emit(dict(base, op='generate', seconds=round(time.perf_counter() - start, 3),
+                           db_bytes=sum(p.stat().st_size for p in Path(tmpdir).glob("*.db*"))))
+
+                large_ops = max(5, ops // 50)
+                large = storage.get_json('bench_large', {})
+                key_info = {'entries': entries, 'value_bytes': len(json.dumps(large))}
+
+                def get_cold(key):
+                    storage.invalidate_json(key)
+                    storage.get_json(key)
+
+                _emit(dict(base, op='get_json_large_cold', **key_info, **_time_op(get_cold, [('bench_large',)] * large_ops)))
+                _emit(dict(base, op='get_json_large_cached', **key_info,
+                           **_time_op(storage.get_json, [('bench_large',)] * large_ops)))
+                _emit(dict(base, op='get_json_view_large', **key_info,
+                           **_time_op(storage.get_json_view, [('bench_large',)] * large_ops)))
+                _emit(dict(base, op='set_json_large', **key_info,
+                           **_time_op(storage.set_json, [('bench_large', large)] * large_ops)))
+                _emit(dict(base, op='flush', **_time_op(storage.flush, [()])))
+
+                users = max(1, size // 20)
+                _emit(dict(base, op='add_abuse_tracking_record', **_time_op(
+                    storage.add_abuse_tracking_record,
+                    [(rnd.randrange(users), f"{i:064x}", 100, time.time()) for i in range(ops)]
+                )))
+                _emit(dict(base, op='flush', **_time_op(storage.flush, [()])))
+                _emit(dict(base, op='get_abuse_tracking_records', **_time_op(
+                    storage.get_abuse_tracking_records, [(rnd.randrange(users), 200) for _ in range(ops)]
+                )))
+
+                _emit(dict(base, op='get_context_entry', **_time_op(
+                    storage.get_context_entry, [(rnd.randrange(size),) for _ in range(ops)]
+                )))
+                _emit(dict(base, op='get_image_description', **_time_op(
+                    storage.get_image_description, [(rnd.randrange(size) | 1,) for _ in range(ops)]
+                )))
+                storage.flush_image_touches()
+
+                rpa_users = max(1, size // 10)
+                _emit(dict(base, op='append_rpa_match', **_time_op(
+                    storage.append_rpa_match, [(rnd.randrange(rpa_users), {'result': 'loss'}) for _ in range(ops)]
+                )))
+                _emit(dict(base, op='flush', **_time_op(storage.flush, [()])))
+
+                removed = []
+                result = _time_op(lambda: removed.extend(storage.prune_image_descriptions(24)), [()])
+                _emit(dict(base, op='prune_image_descriptions', removed=len(removed), **result))
+
+
+def bench_readers(users: int = 10000, duration: float = 2.0, thread_counts=(1, 4, 16), serialized: bool = False):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _use_temp_db(tmpdir)
+        now = time.time()
+        for uid in range(users):
+            storage.set_context_entry(uid, random.randint(1, 1000), now)
+            storage.add_abuse_tracking_record(uid % 500, f"{uid:064x}", uid % 200, now - uid)
+        storage.flush()
+
+        for threads in thread_counts:
+            stop = threading.Event()
+            counts = [0] * threads
+
+            def writer():
+                i = 0
+                while not stop.is_set():
+                    storage.set_context_entry(i % users, i, time.time())
+                    storage.set_json('bench_counter', {'i': i})
+                    i += 1
+                    time.sleep(0.001)
+
+            def reader(slot):
+                rnd = random.Random(slot)
+                n = 0
+                while not stop.is_set():
+                    uid = rnd.randrange(users)
+                    if serialized:
+                        with storage._writer_lock():
+                            storage.get_context_entry(uid)
+                            storage.get_abuse_tracking_records(uid % 500, limit=20)
+                    else:
+                        storage.get_context_entry(uid)
+                        storage.get_abuse_tracking_records(uid % 500, limit=20)
+                    n += 1
+                counts[slot] = n
+
+            workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+            w = threading.Thread(target=writer)
+            w.start()
+            for t in workers:
+                t.start()
+            time.sleep(duration)
+            stop.set()
+            for t in workers:
+                t.join()
+            w.join()
+            total = sum(counts)
+            _emit({
+                'bench': 'readers',
+                'mode': 'serialized' if serialized else 'concurrent',
+                'threads': threads,
+                'reads': total,
+                'reads_per_sec': round(total / duration, 1),
+            })
+        storage.close()
+
+
+def _compression_values(entries: int, rnd: random.Random) -> dict:
+    now = time.time()
+    return {
+        'metrics_history': {
+            datetime.fromtimestamp(now - i * 60, timezone.utc).isoformat(): {
+                'servers': 1200 + i % 50, 'users': 90000 + i, 'messages': i * 3, 'cpu': round(rnd.random() * 100, 1),
+                'ram': round(rnd.random() * 100, 1)
+            }
+            for i in range(entries)
+        },
+        'recent_questions': {
+            'trivia': [
+                {'question': f"Question number {i} about science?", 'embedding': [round(rnd.uniform(-1, 1), 6) for _ in range(64)]}
+                for i in range(max(1, entries // 100))
+            ]
+        },
+        'knowledge_data': {
+            'items': [
+                {'text': f"Knowledge item {i}: the bot is made by Nerdlabs AI.", 'embedding': base64.b64encode(rnd.randbytes(256)).decode()}
+                for i in range(max(1, entries // 100))
+            ]
+        },
+    }
+
+
+def bench_compression(entries: int = 10000, rewrites: int = 20):
+    rnd = random.Random(entries)
+    values = _compression_values(entries, rnd)
+    for mode, overrides in (('raw', {'STORAGE_COMPRESS_MIN_BYTES': 0}), ('zlib', {})):
+        with tempfile.TemporaryDirectory() as tmpdir, _overrides(overrides):
+            _use_temp_db(tmpdir)
+            storage._get_conn()
+            for key, value in values.items():
+                start = time.perf_counter()
+                for _ in range(rewrites):
+                    storage.set_json(key, value)
+                    storage.flush()
+                elapsed = time.perf_counter() - start
+                conn = storage._get_conn(storage._domain_for('kv', key))
+                stored = conn.execute("SELECT length(value) FROM kv WHERE key = ?", (key,)).fetchone()[0]
+                _emit({
+                    'bench': 'compression', 'mode': mode, 'key': key, 'entries': entries,
+                    'json_bytes': len(json.dumps(value, ensure_ascii=False).encode('utf-8')),
+                    'stored_bytes': stored,
+                    'bytes_written': stored * rewrites,
+                    'write_ms': round(elapsed / rewrites * 1000, 3),
+                })
+
+            wal_bytes = sum(p.stat().st_size for p in Path(tmpdir).glob("*.db-wal"))
+            storage.invalidate_json()
+            start = time.perf_counter()
+            for key in values:
+                storage.get_json(key)
+            read_ms = (time.perf_counter() - start) * 1000
+            storage.checkpoint("TRUNCATE")
+            db_bytes = sum(p.stat().st_size for p in storage.database_paths() if p.exists())
+
+            manager = BackupManager(storage.database_paths(), Path(tmpdir) / "backups")
+            start = time.perf_counter()
+            manager._make_backup()
+            backup_seconds = time.perf_counter() - start
+            backups = Path(tmpdir) / "backups"
+            backup_bytes = sum(p.stat().st_size for p in backups.iterdir()) if backups.exists() else 0
+            _emit({
+                'bench': 'compression', 'mode': mode, 'key': '*', 'entries': entries,
+                'wal_bytes': wal_bytes, 'db_bytes': db_bytes, 'backup_bytes': backup_bytes,
+                'backup_ms': round(backup_seconds * 1000, 3), 'cold_read_ms': round(read_ms, 3),
+            })
+
+
+def _embeddings(size: int, dim: int, rnd: np.random.Generator) -> np.ndarray:
+    # real summaries cluster by topic, so the synthetic vectors are spread around a few hundred topic centers
+    centers = rnd.standard_normal((max(1, min(size // 20, 500)), dim)).astype(np.float32)
+    vecs = centers[rnd.integers(len(centers), size=size)] + 1.5 * rnd.standard_normal((size, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def bench_memory_index(sizes=(1000, 10000, 100000), dim: int = 1536, queries: int = 200, k: int = 5, probes=(4, 8, 16, 32)):
+    rnd = np.random.default_rng(0)
+    for size in sizes:
+        vecs = _embeddings(size + queries, dim, rnd)
+        data, query_vecs = vecs[:size], vecs[size:]
+        # recall is measured against a float32 scan of the unquantized vectors
+        durations, truth = [], []
+        for q in query_vecs:
+            start = time.perf_counter()
+            truth.append(set(top_k(data @ q, k).tolist()))
+            durations.append(time.perf_counter() - start)
+        _emit(dict(
+            _summary(durations), bench='memory_index', mode='float32', size=size, dim=dim, k=k, recall=1.0,
+            index_bytes=data.nbytes
+        ))
+
+        exact = VectorIndex.from_rows(list(data), dim)
+        durations, hits = [], 0
+        for q, expected in zip(query_vecs, truth):
+            start = time.perf_counter()
+            found = exact.search(q, k, exact=True)
+            durations.append(time.perf_counter() - start)
+            hits += len(expected & {p for p, _ in found})
+        _emit(dict(
+            _summary(durations), bench='memory_index', mode='exact', size=size, dim=dim, k=k,
+            recall=round(hits / (k * len(query_vecs)), 4), index_bytes=exact.nbytes
+        ))
+
+        for n_probes in probes:
+            index = VectorIndex.from_rows(list(data), dim, ann_min_size=1, probes=n_probes)
+            start = time.perf_counter()
+            index.train()
+            train_ms = (time.perf_counter() - start) * 1000
+            durations, hits = [], 0
+            for q, expected in zip(query_vecs, truth):
+                start = time.perf_counter()
+                found = index.search(q, k)
+                durations.append(time.perf_counter() - start)
+                hits += len(expected & {p for p, _ in found})
+            _emit(dict(
+                _summary(durations), bench='memory_index', mode='ivf', size=size, dim=dim, k=k, probes=n_probes,
+                lists=len(index._centroids), train_ms=round(train_ms, 3), recall=round(hits / (k * len(query_vecs)), 4)
+            ))
+
+        # a full window: every append evicts the oldest row
+        index = VectorIndex.from_rows(list(data), dim, ann_min_size=1)
+        index.train()
+        extra = _embeddings(queries, dim, rnd)
+        durations = []
+        for v in extra:
+            start = time.perf_counter()
+            index.popleft()
+            index.append(v)
+            durations.append(time.perf_counter() - start)
+        _emit(dict(_summary(durations), bench='memory_index', mode='append_evict', size=size, dim=dim))
+
+
+def bench_memory_records(sizes=(100, 1000, 10000), dim: int = 1536, rounds: int = 5):
+    # legacy is the old layout: indented JSON with base64 float32 embeddings, encrypted and base64-encoded again
+    rnd = random.Random(0)
+    key = os.urandom(32)
+    for size in sizes:
+        vecs = _embeddings(size, dim, np.random.default_rng(size))
+        topics = ['cats', 'dogs', 'python', 'rust']
+        texts = [f"User {i} said they like {rnd.choice(topics)} and play chess on weekends." for i in range(size)]
+        memories = [f"Full conversation {i}: " + " ".join(rnd.choice(texts) for _ in range(8)) for i in range(size)]
+        legacy = {
+            'summaries': [{'text': t, 'embedding': base64.urlsafe_b64encode(v.tobytes()).decode('ascii')} for t, v in zip(texts, vecs)],
+            'memories': memories,
+        }
+        packed = {'summaries': [{'text': t, 'embedding': pack_embedding(v)} for t, v in zip(texts, vecs)], 'memories': memories}
+        formats = {
+            'legacy': (
+                lambda: storage._encrypt_record(json.dumps(legacy, indent=2, ensure_ascii=False).encode('utf-8'), key),
+                lambda value: json.loads(storage._decrypt_record(value, key)),
+            ),
+            'packed': (
+                lambda: storage._seal_memory_record(packed, key),
+                lambda value: storage._open_memory_record(value, key),
+            ),
+        }
+        for name, (encode, decode) in formats.items():
+            encode_ms, decode_ms = [], []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                value = encode()
+                encode_ms.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                decode(value)
+                decode_ms.append((time.perf_counter() - start) * 1000)
+            # what set_blob stores: the base64 layout compresses, the raw ciphertext does not
+            stored = storage._compress(value)
+            _emit(dict(
+                bench='memory_records', format=name, size=size, dim=dim, value_bytes=len(value),
+                stored_bytes=len(value) if stored is None else len(stored),
+                encode_ms=round(sorted(encode_ms)[len(encode_ms) // 2], 3),
+                decode_ms=round(sorted(decode_ms)[len(decode_ms) // 2], 3)
+            ))
+
+
+def main():
+    global _OUTPUT, _BACKEND
+    parser = argparse.ArgumentParser(description="Storage benchmarks, results are printed as JSON lines")
+    parser.add_argument("--output", help="also append the JSON lines to this file")
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite",
+                        help="run against temporary SQLite files or RAM-only databases")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    suite = sub.add_parser("suite", help="time the public storage functions on synthetic datasets per PRAGMA profile")
+    suite.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    suite.add_argument("--profiles", nargs="+", choices=sorted(PROFILES), default=list(PROFILES))
+    suite.add_argument("--ops", type=int, default=1000)
+
+    readers = sub.add_parser("readers", help="read throughput with concurrent reader threads and one writer")
+    readers.add_argument("--users", type=int, default=10000)
+    readers.add_argument("--duration", type=float, default=2.0)
+    readers.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    readers.add_argument("--serialized", action="store_true", help="hold the writer lock around reads (old behaviour)")
+
+    compression = sub.add_parser("compression", help="write amplification, DB, WAL and backup size with and without compression")
+    compression.add_argument("--entries", type=int, default=10000, help="entries in the metrics_history document")
+    compression.add_argument("--rewrites", type=int, default=20)
+
+    memory_index = sub.add_parser("memory-index", help="recall@k and latency of exact and approximate memory search")
+    memory_index.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    memory_index.add_argument("--dim", type=int, default=1536)
+    memory_index.add_argument("--queries", type=int, default=200)
+    memory_index.add_argument("-k", type=int, default=5)
+    memory_index.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16, 32])
+
+    memory_records = sub.add_parser("memory-records", help="size, encryption and parse time of legacy and packed memory records")
+    memory_records.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    memory_records.add_argument("--dim", type=int, default=1536)
+    memory_records.add_argument("--rounds", type=int, default=5)
+
+    args = parser.parse_args()
+    _OUTPUT = args.output
+    _BACKEND = args.backend
+    if args.bench == "compression":
+        bench_compression(args.entries, args.rewrites)
+    elif args.bench == "suite":
+        bench_suite(args.sizes, args.profiles, args.ops)
+    elif args.bench == "readers":
+        bench_readers(args.users, args.duration, args.threads, args.serialized)
+    elif args.bench == "memory-index":
+        bench_memory_index(args.sizes, args.dim, args.queries, args.k, args.probes)
+    elif args.bench == "memory-records":
+        bench_memory_records(args.sizes, args.dim, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
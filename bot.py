@@ -41,7 +41,9 @@ from config import (
     KNOWLEDGE_TOP_K,
     NEWS_SUBREDDITS,
     TEMP_DIR,
-    EMOJI_MAP
+    EMOJI_MAP,
+    EMBED_CACHE_DAYS,
+    EMBED_CACHE_MAX_ROWS
 )
 from memory import (
     init_memory_files,
@@ -50,25 +52,25 @@ from memory import (
     save_user_memory,
     get_user_memory_detail,
     save_context,
-    get_channel_by_user,
+    aget_channel_by_user,
     get_all_summaries,
     get_user_summaries,
     load_memory_cache,
-    add_memory_to_cache,
-    add_user_memory_to_cache,
+    aadd_memory_to_cache,
+    aadd_user_memory_to_cache,
     flush_memory_cache,
     find_relevant_memories,
-    embed_text,
     delete_memory,
     delete_user_memory
 )
-from openai_client import generate_response, get_subreddit_posts, analyze_image, reddit_search
+from openai_client import generate_response, get_subreddit_posts, analyze_image, reddit_search, aembed_text
 from credentials import token as TOKEN
-from nerdscore import increase_nerdscore
+from nerdscore import aincrease_nerdscore
 from metrics import messages_sent, update_metrics
 import storage
 from knowledge import sync_knowledge, find_relevant_knowledge
 from backup import BackupManager
+from maintenance import MaintenanceManager
 import abuse_detection
 
 # Some variable and function definitions
@@ -87,6 +89,27 @@ def save_settings(settings: dict):
     except Exception:
         pass
 
+
+async def aload_settings() -> dict:
+    try:
+        return await storage.aload_settings() or {}
+    except Exception:
+        return {}
+
+
+async def aview_settings() -> dict:
+    try:
+        return await storage.aview_settings() or {}
+    except Exception:
+        return {}
+
+
+async def asave_settings(settings: dict):
+    try:
+        await storage.asave_settings(settings or {})
+    except Exception:
+        pass
+
 # Rate limiting
 RATE_LIMIT = 10
 RATE_PERIOD = 60
@@ -95,44 +118,29 @@ user_requests = defaultdict(lambda: deque())
 # Daily message counters
 from datetime import datetime, timezone, timedelta
 
-def load_daily_counts():
+async def increment_user_daily_count(user_id: int) -> int:
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
     try:
-        return storage.load_daily_counts() or {}
+        return await storage.aincrement_daily_count(user_id, today)
     except Exception:
-        return {}
+        return 0
+
+# Post-response bookkeeping, committed together per database file (the counters live in metrics.db, the rest in storage.db)
+def record_response(user_id, channel_id, freewill_channel_id=None, message_id=None) -> None:
+    with storage.transaction():
+        messages_sent.inc()
+        update_metrics(user_id)
+        save_context(user_id, channel_id)
+        if freewill_channel_id is not None:
+            storage.set_freewill_attempt(freewill_channel_id, message_id)
 
 
-def save_daily_counts(data: dict):
+async def arecord_response(user_id, channel_id, freewill_channel_id=None, message_id=None) -> None:
     try:
-        storage.save_daily_counts(data or {})
+        await storage.arun(record_response, user_id, channel_id, freewill_channel_id, message_id)
     except Exception:
-        pass
-
-def increment_user_daily_count(user_id: int) -> int:
-    data = load_daily_counts()
-    now = datetime.now(timezone.utc)
-    today = now.strftime('%Y-%m-%d')
-    last_update_str = data.get('_last_update')
-    if last_update_str:
-        try:
-            last_update = datetime.fromisoformat(last_update_str)
-        except Exception:
-            last_update = None
-    else:
-        last_update = None
-
-    if not last_update or last_update.date() != now.date():
-        data = {'_last_update': now.isoformat(), today: {}}
-    else:
-        data['_last_update'] = now.isoformat()
-        if today not in data:
-            data[today] = {}
-
-    day_counts = data.setdefault(today, {})
-    key = str(user_id)
-    day_counts[key] = day_counts.get(key, 0) + 1
-    save_daily_counts(data)
-    return day_counts[key]
+        if DEBUG:
+            print("Failed to record response")
 
 # Bot setup
 intents = discord.Intents.default()
@@ -146,7 +154,8 @@ commands.setup(bot)
 print("Loading knowledge...")
 sync_knowledge()
 
-backup_manager = BackupManager(storage._DB_PATH)
+backup_manager = BackupManager(storage.database_paths())
+maintenance_manager = MaintenanceManager()
 
 ALLOWED_IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
 
@@ -508,6 +517,11 @@ async def on_ready():
     except Exception:
         if DEBUG:
             print("Failed to start BackupManager")
+    try:
+        maintenance_manager.start()
+    except Exception:
+        if DEBUG:
+            print("Failed to start MaintenanceManager")
     try:
         deleted = abuse_detection.cleanup_old_records(days=7)
         if DEBUG and deleted > 0:
@@ -515,6 +529,11 @@ async def on_ready():
     except Exception:
         if DEBUG:
             print("Failed to cleanup abuse tracking records")
+    try:
+        await storage.arun(storage.load_banned_users)
+    except Exception:
+        if DEBUG:
+            print("Failed to load banned users")
     try:
         if not hasattr(bot, 'status_task'):
             bot.status_task = bot.loop.create_task(update_status())
@@ -527,6 +546,12 @@ async def on_ready():
     except Exception:
         if DEBUG:
             print("Failed to start image description prune task")
+    try:
+        if not hasattr(bot, 'embedding_prune_task'):
+            bot.embedding_prune_task = bot.loop.create_task(prune_embedding_cache_task())
+    except Exception:
+        if DEBUG:
+            print("Failed to start embedding cache prune task")
     try:
         if not hasattr(bot, 'cleanup_abuse_task'):
             bot.cleanup_abuse_task = bot.loop.create_task(cleanup_abuse_tracking_task())
@@ -561,16 +586,13 @@ async def send_message(message, system_msg=None, force_response=False, functions
         return
     
     try:
-        abuse_detection.track_message(message.author.id, message.content or '')
+        await abuse_detection.atrack_message(message.author.id, message.content or '')
     except Exception:
         pass
     
     try:
-        banned_map = storage.load_banned_map()
-        if message.author.id in banned_map and not force_response:
-            meta = banned_map.get(message.author.id) or {}
-            notified = bool(meta.get('notified'))
-            if not notified:
+        if storage.is_banned(message.author.id) and not force_response:
+            if not storage.is_banned_user_notified(message.author.id):
                 try:
                     await message.reply(
                         "You have been banned from using AI Nerd 2. Further messages will be ignored.\n-# [Terms of Service](<https://docs.google.com/document/d/1CBJ7tNOX0lKOsg4MZlJlc3TMkYQd_6mWXQ8ZWMtxix8/edit?usp=sharing>)\n-# If you believe this is a mistake, contact the developer via the Nerdlabs AI Discord server (link in about me).",
@@ -579,7 +601,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
                 except Exception:
                     pass
                 try:
-                    storage.mark_banned_user_notified(message.author.id)
+                    await storage.amark_banned_user_notified(message.author.id)
                 except Exception:
                     pass
             if DEBUG:
@@ -594,7 +616,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
     is_dm = isinstance(message.channel, discord.DMChannel)
     allowed = []
     if message.guild:
-        settings = load_settings()
+        settings = await aview_settings()
         guild_settings = settings.get(str(message.guild.id), {})
         allowed = guild_settings.get("allowed_channels", [])
     is_allowed = message.channel.id in allowed
@@ -631,7 +653,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
     dq.append(now)
 
     # System prompt building
-    channel_id, timestamp = get_channel_by_user(user_id)
+    channel_id, timestamp = await aget_channel_by_user(user_id)
     if channel_id == message.channel.id or time.time() - timestamp > 300 or freewill:
         history_channel = message.channel
         moved = False
@@ -699,7 +721,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
 
                 if ext in ALLOWED_IMAGE_EXTS:
                     try:
-                        cached = storage.get_image_description(attach.id)
+                        cached = await storage.aget_image_description(attach.id)
                     except Exception:
                         cached = None
                     if cached:
@@ -712,7 +734,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
                         })
 
                         try:
-                            storage.save_image_description(attach.id, image_desc)
+                            await storage.asave_image_description(attach.id, image_desc)
                         except Exception:
                             if DEBUG:
                                 print("Failed to save image description to storage")
@@ -734,7 +756,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
     if moved:
         history.append({'role': 'system', 'content': 'The conversation has moved to a different channel.'})
 
-    embedded_msg = embed_text(message.content)
+    embedded_msg = await aembed_text(message.content)
     try:
         relevant_globals = find_relevant_memories(embedded_msg, top_k=MEMORY_TOP_K, user_id=None)
         if relevant_globals:
@@ -804,7 +826,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
 
         if ext in ALLOWED_IMAGE_EXTS:
             try:
-                cached = storage.get_image_description(attach.id)
+                cached = await storage.aget_image_description(attach.id)
             except Exception:
                 cached = None
             if cached:
@@ -817,7 +839,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
                 })
 
                 try:
-                    storage.save_image_description(attach.id, image_desc)
+                    await storage.asave_image_description(attach.id, image_desc)
                 except Exception:
                     if DEBUG:
                         print("Failed to save image description to storage")
@@ -873,7 +895,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
             if chatrevive:
                 user = f"chatrevive_{message.guild.name}:{message.guild.id}"
             else:
-                count = increment_user_daily_count(user_id)
+                count = await increment_user_daily_count(user_id)
                 if count > DAILY_MESSAGE_LIMIT:
                     model_to_use = CHEAP_MODEL
                     user = f"limited_{message.author.name}:{message.author.id}"
@@ -924,7 +946,6 @@ async def send_message(message, system_msg=None, force_response=False, functions
 
     reply_msg = None
     cancelled = False
-    memory_cache_modified = False
 
 # Function call handling
     messages += completion.output
@@ -942,19 +963,18 @@ async def send_message(message, system_msg=None, force_response=False, functions
             if name == 'save_memory':
                 if args.get('user_memory'):
                     try:
-                        idx = add_user_memory_to_cache(message.author.id, args['summary'], args['full_memory'])
-                        memory_cache_modified = True
+                        idx = await aadd_user_memory_to_cache(message.author.id, args['summary'], args['full_memory'])
                         tool_result = f'User memory saved to cache. Index {idx}.'
                     except Exception:
-                        idx = save_user_memory(message.author.id, args['summary'], args['full_memory'])
+                        # the fallback embeds the text, so it runs off the event loop and off the write thread
+                        idx = await asyncio.to_thread(save_user_memory, message.author.id, args['summary'], args['full_memory'])
                         tool_result = f'User memory saved. Index {idx}.'
                 else:
                     try:
-                        idx = add_memory_to_cache(args['summary'], args['full_memory'])
-                        memory_cache_modified = True
+                        idx = await aadd_memory_to_cache(args['summary'], args['full_memory'])
                         tool_result = f'Global memory saved to cache. Index {idx}.'
                     except Exception:
-                        idx = save_memory(args['summary'], args['full_memory'])
+                        idx = await asyncio.to_thread(save_memory, args['summary'], args['full_memory'])
                         tool_result = f'Global memory saved. Index {idx}.'
 
             elif name == 'get_memory_detail':
@@ -1037,7 +1057,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
                 break
 
             elif name == 'give_nerdscore':
-                increase_nerdscore(message.author.id, 1)
+                await aincrease_nerdscore(message.author.id, 1)
                 tool_result = f"Nerdscore +1 for {message.author.name}"
 
             elif name == 'add_reaction':
@@ -1068,11 +1088,9 @@ async def send_message(message, system_msg=None, force_response=False, functions
                 try:
                     if args.get('user_memory'):
                         delete_user_memory(message.author.id, int(args['index']))
-                        memory_cache_modified = True
                         tool_result = f'User memory index {args["index"]} deleted.'
                     else:
                         delete_memory(int(args['index']))
-                        memory_cache_modified = True
                         tool_result = f'Global memory index {args["index"]} deleted.'
                 except Exception as e:
                     tool_result = f'Error deleting memory: {e}'
@@ -1139,28 +1157,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
         if DEBUG:
             print("Cancelling response.")
         # Post-response processing
-        messages_sent.inc()
-        update_metrics(user_id)
-        try:
-            save_context(user_id, message.channel.id)
-        except Exception:
-            pass
-        if natural_reply_context:
-            try:
-                freewill_attempts = storage.get_freewill_attempts() or {}
-            except Exception:
-                freewill_attempts = {}
-            freewill_attempts[str(channel_id)] = message.id
-            try:
-                storage.save_freewill_attempts(freewill_attempts)
-            except Exception:
-                pass
-        try:
-            if memory_cache_modified:
-                flush_memory_cache()
-        except Exception:
-            if DEBUG:
-                print("Failed to flush memory cache after cancelled response")
+        await arecord_response(user_id, message.channel.id, channel_id if natural_reply_context else None, message.id)
         return
 
     content = await process_response(msg_obj.content, message.guild, count, chatrevive)
@@ -1174,33 +1171,7 @@ async def send_message(message, system_msg=None, force_response=False, functions
         await message.reply(content, mention_author=False)
 
     # Post-response processing
-    messages_sent.inc()
-    update_metrics(user_id)
-    try:
-        save_context(user_id, message.channel.id)
-    except Exception:
-        pass
-    if natural_reply_context:
-        try:
-            freewill_attempts = storage.get_freewill_attempts() or {}
-        except Exception:
-            freewill_attempts = {}
-        freewill_attempts[str(channel_id)] = message.id
-        try:
-            storage.save_freewill_attempts(freewill_attempts)
-        except Exception:
-            pass
-
-    try:
-        if memory_cache_modified:
-            flush_memory_cache()
-            try:
-                load_memory_cache()
-            except Exception:
-                pass
-    except Exception:
-        if DEBUG:
-            print("Failed to flush memory cache after response")
+    await arecord_response(user_id, message.channel.id, channel_id if natural_reply_context else None, message.id)
 
 # Message response
 @bot.event
@@ -1220,7 +1191,7 @@ async def on_guild_join(guild):
 @bot.event
 async def on_member_join(member):
     guild = member.guild
-    settings = load_settings()
+    settings = await aview_settings()
     guild_settings = settings.get(str(guild.id), {})
     welcome_setting = guild_settings.get("welcome_msg")
     if welcome_setting:
@@ -1241,7 +1212,7 @@ async def on_member_join(member):
 async def chatrevive_task():
     await bot.wait_until_ready()
     while not bot.is_closed():
-        settings = load_settings()
+        settings = await aview_settings()
         for guild in bot.guilds:
             sid = str(guild.id)
             guild_settings = settings.get(sid, {})
@@ -1278,9 +1249,8 @@ async def freewill_task():
         if DEBUG:
             print("Running freewill task")
         try:
-            context = storage.get_context() or {}
-            freewill_attempts = storage.get_freewill_attempts() or {}
-            settings = load_settings()
+            context = await storage.aget_context() or {}
+            settings = await aview_settings()
             processed_channels = set()
             
             all_channels = []
@@ -1341,7 +1311,7 @@ async def freewill_task():
                 if not last_message:
                     continue
 
-                last_attempted_id = freewill_attempts.get(str(channel_id))
+                last_attempted_id = await storage.aget_freewill_attempt(channel_id)
                 if last_attempted_id == last_message.id:
                     continue
 
@@ -1373,8 +1343,7 @@ async def freewill_task():
                             is_natural_reply=True,
                             natural_reply_context=context_type
                         )
-                        freewill_attempts[str(channel_id)] = last_message.id
-                        storage.save_freewill_attempts(freewill_attempts)
+                        await storage.aset_freewill_attempt(channel_id, last_message.id)
                     except Exception as e:
                         if DEBUG:
                             print(f"Natural reply error: {e}")
@@ -1421,7 +1390,7 @@ async def prune_image_descriptions_task():
     await bot.wait_until_ready()
     while not bot.is_closed():
         try:
-            removed = storage.prune_image_descriptions(24)
+            removed = await storage.arun(storage.prune_image_descriptions, 24)
             if DEBUG and removed:
                 print(f"Pruned {len(removed)} stale image descriptions: {removed}")
         except Exception:
@@ -1430,11 +1399,24 @@ async def prune_image_descriptions_task():
         await asyncio.sleep(3600)
 
 
+async def prune_embedding_cache_task():
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        try:
+            removed = await storage.arun(storage.prune_embedding_cache, EMBED_CACHE_DAYS, EMBED_CACHE_MAX_ROWS)
+            if DEBUG and removed:
+                print(f"Pruned {removed} cached embeddings")
+        except Exception:
+            if DEBUG:
+                print("Failed to prune embedding cache")
+        await asyncio.sleep(86400)
+
+
 async def cleanup_abuse_tracking_task():
     await bot.wait_until_ready()
     while not bot.is_closed():
         try:
-            deleted = abuse_detection.cleanup_old_records(days=7)
+            deleted = await storage.arun(abuse_detection.cleanup_old_records, days=7)
             if DEBUG and deleted > 0:
                 print(f"Cleaned up {deleted} old abuse tracking records")
         except Exception:
@@ -1455,4 +1437,6 @@ signal.signal(signal.SIGTERM, shutdown_handler)
 
 # Runs the bot
 if __name__ == '__main__':
-    bot.run(TOKEN)
\ No newline at end of file
+    bot.run(TOKEN)
+    flush_memory_cache()
+    storage.close()
\ No newline at end of file
@@ -9,28 +9,39 @@ import time
 import datetime
 import sys
 import numpy as np
-from openai_client import generate_response, embed_text
+from openai_client import generate_response, aembed_text, embedding_cache_stats
 from config import DEBUG, OWNER_ID, COMMANDS_MODEL, IMAGE_MODEL
-from nerdscore import get_nerdscore, increase_nerdscore, load_nerdscore
+from nerdscore import aget_nerdscore, aincrease_nerdscore, aload_nerdscore
 import storage
 from memory import delete_user_memories
 import abuse_detection
 import metrics
 
-def load_recent_questions():
-    return storage.load_recent_questions() or {}
+async def load_daily_quiz_records():
+    return await storage.aread(storage.load_daily_quiz_records) or {}
 
-def save_recent_questions(data):
-    storage.save_recent_questions(data or {})
+async def save_daily_quiz_records(data):
+    await storage.arun(storage.save_daily_quiz_records, data or {})
 
-def load_daily_quiz_records():
-    return storage.load_daily_quiz_records() or {}
-
-def save_daily_quiz_records(data):
-    storage.save_daily_quiz_records(data or {})
+def ban_users(user_ids) -> int:
+    # bans and clears abuse tracking for every user in one storage transaction, returns how many were newly banned.
+    # bans (storage.db) commit before the abuse log (abuse.db): if clearing the log fails the bans still stand and the
+    # error is raised
+    banned = 0
+    with storage.transaction():
+        for uid in user_ids:
+            if storage.ban_user(uid):
+                abuse_detection.clear_user_tracking(uid)
+                banned += 1
+    return banned
 
-def cosine(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+def question_similarities(matrix, emb):
+    # cosine similarity against every stored question at once; stored rows are already unit length
+    vec = np.asarray(emb, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec) if vec.size else 0.0
+    if not norm or matrix.ndim != 2 or matrix.shape[1] != vec.size:
+        return np.zeros(len(matrix), dtype=np.float32)
+    return matrix @ (vec / norm)
 
 def setup(bot):
     config_group = app_commands.Group(name="config", description="Configuration")
@@ -43,8 +54,8 @@ def setup(bot):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("You must be a server administrator to use this command.", ephemeral=True)
             return
-        from bot import load_settings, save_settings
-        settings = load_settings()
+        from bot import aload_settings, asave_settings
+        settings = await aload_settings()
         sid = str(interaction.guild.id)
         guild_settings = settings.get(sid, {})
         allowed = guild_settings.get("allowed_channels", [])
@@ -61,7 +72,7 @@ def setup(bot):
             action = "now"
         guild_settings["allowed_channels"] = allowed
         settings[sid] = guild_settings
-        save_settings(settings)
+        await asave_settings(settings)
         await interaction.response.send_message(
             f"AI Nerd will {action} respond to all messages in <#{chan_id}>.",
             ephemeral=False
@@ -79,13 +90,13 @@ def setup(bot):
             return await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
         if not interaction.user.guild_permissions.administrator:
             return await interaction.response.send_message("You must be a server administrator to use this command.", ephemeral=True)
-        from bot import load_settings, save_settings
-        settings = load_settings()
+        from bot import aload_settings, asave_settings
+        settings = await aload_settings()
         sid = str(interaction.guild.id)
         guild_settings = settings.get(sid, {})
         guild_settings['freewill_rate'] = rate
         settings[sid] = guild_settings
-        save_settings(settings)
+        await asave_settings(settings)
         await interaction.response.send_message(f"Natural replies rate set to **{rate}**.")
 
     @config_group.command(name="welcome", description="Toggle welcome messages in this channel")
@@ -100,8 +111,8 @@ def setup(bot):
         if not permissions.send_messages:
             await interaction.response.send_message("I do not have permission to send messages in this channel.", ephemeral=True)
             return
-        from bot import load_settings, save_settings
-        settings = load_settings()
+        from bot import aload_settings, asave_settings
+        settings = await aload_settings()
         sid = str(interaction.guild.id)
         guild_settings = settings.get(sid, {})
         allowed = guild_settings.get("welcome_msg", None)
@@ -113,7 +124,7 @@ def setup(bot):
             guild_settings["welcome_msg"] = chan_id
             action = "now"
         settings[sid] = guild_settings
-        save_settings(settings)
+        await asave_settings(settings)
         await interaction.response.send_message(
             f"AI Nerd 2 will {action} welcome new members in <#{chan_id}>.",
             ephemeral=False
@@ -144,8 +155,8 @@ def setup(bot):
             )
             return
 
-        from bot import load_settings, save_settings
-        settings = load_settings()
+        from bot import aload_settings, asave_settings
+        settings = await aload_settings()
         sid = str(interaction.guild.id)
         guild_settings = settings.get(sid, {})
         chatrevive = guild_settings.get("chatrevive", {})
@@ -159,7 +170,7 @@ def setup(bot):
             "role_id": role.id
         }
         settings[sid] = guild_settings
-        save_settings(settings)
+        await asave_settings(settings)
         await interaction.response.send_message(
             f"Chat revive enabled for <#{chan_id}>. Timeout: {timeout} minutes. Role to mention: {role.mention}",
             ephemeral=False
@@ -173,8 +184,8 @@ def setup(bot):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("You must be a server administrator to use this command.", ephemeral=True)
             return
-        from bot import load_settings, save_settings
-        settings = load_settings()
+        from bot import aload_settings, asave_settings
+        settings = await aload_settings()
         sid = str(interaction.guild.id)
         guild_settings = settings.get(sid, {})
         chatrevive = guild_settings.get("chatrevive", {})
@@ -183,7 +194,7 @@ def setup(bot):
         if chatrevive.get("channel_id"):
             guild_settings["chatrevive"] = {}
             settings[sid] = guild_settings
-            save_settings(settings)
+            await asave_settings(settings)
             await interaction.response.send_message(f"Chat revive is now disabled for <#{setting_chan_id}>.", ephemeral=False)
         else:
             await interaction.response.send_message(f"Chat revive is already disabled in this server.", ephemeral=False)
@@ -213,7 +224,7 @@ def setup(bot):
         latency_ms = round(interaction.client.latency * 1000, 2)
         bot_ram_usage = proc.memory_info().rss / (1024 * 1024)
         try:
-            metrics_data = storage.load_user_metrics() or {}
+            metrics_data = await storage.aread(storage.load_user_metrics) or {}
             user_count = len(metrics_data)
         except Exception:
             user_count = 0
@@ -302,7 +313,6 @@ def setup(bot):
         
         messages = [{'role': 'developer', 'content': f"You are an agent designed to generate trivia questions. Create a trivia question with one correct answer and four incorrect answers. The question should be engaging and suitable for a trivia game.\nQuestion genre: {genre}\nQuestion difficulty: {difficulty}"}]
         user_id = str(interaction.user.id)
-        questions_data = load_recent_questions()
 
         MAX_RETRIES = 3
         for _ in range(MAX_RETRIES):
@@ -329,36 +339,21 @@ def setup(bot):
             if 'difficulty' in args:
                 difficulty = args['difficulty']
 
-            if user_id not in questions_data:
-                questions_data[user_id] = {}
-            if genre not in questions_data[user_id]:
-                questions_data[user_id][genre] = []
+            prev_qs, prev_embs = await storage.aread(storage.get_question_history, user_id, genre)
 
-            user_recent = questions_data[user_id][genre]
+            new_emb = await aembed_text(args["question"])
+            scores = question_similarities(prev_embs, new_emb)
+            if DEBUG and len(scores):
+                best = int(scores.argmax())
+                print(f"Cosine similarity with previous question '{prev_qs[best]}': {scores[best]}")
 
-            new_emb = embed_text(args["question"])
-            similar = False
-            for prev in user_recent:
-                if "emb" not in prev:
-                    continue
-                score = cosine(new_emb, np.array(prev["emb"], dtype=np.float32))
-                if DEBUG:
-                    print(f"Cosine similarity with previous question '{prev['q']}': {score}")
-                if score > 0.85:
-                    similar = True
-                    break
-
-            if not similar:
+            if not (scores > 0.85).any():
                 break
         else:
             await interaction.followup.send("An error occurred while creating the trivia question. Please try again.")
             return
 
-        user_recent.append({"q": args["question"], "emb": new_emb})
-        if len(user_recent) > 50:
-            user_recent.pop(0)
-        questions_data[user_id][genre] = user_recent
-        save_recent_questions(questions_data)
+        await storage.arun(storage.add_question, user_id, genre, args["question"], new_emb)
         
         question_time = time.monotonic()
         view = discord.ui.View()
@@ -383,7 +378,7 @@ def setup(bot):
                     points = max(0, int(round((30 - (answer_time - question_time)) * multiplier, 0)))
                     if points > 0:
                         await interaction.response.send_message(f"**{btn['label']}** is correct! 🎉\n-# {interaction.user.mention} guessed it after {max(0, int(round((answer_time - question_time), 0)))} seconds and earned {points} nerdscore")
-                        increase_nerdscore(interaction.user.id, points)
+                        await aincrease_nerdscore(interaction.user.id, points)
                     else:
                         await interaction.response.send_message(f"**{btn['label']}** is correct! 🎉\n-# {interaction.user.mention} guessed it after {max(0, int(round((answer_time - question_time), 0)))} seconds")
                     for child in view.children:
@@ -394,7 +389,7 @@ def setup(bot):
                             child.style = discord.ButtonStyle.danger
                 else:
                     await interaction.response.send_message(f"**{btn['label']}** is incorrect! ❌\n-# {interaction.user.mention} lost 5 nerdscore")
-                    increase_nerdscore(interaction.user.id, -5)
+                    await aincrease_nerdscore(interaction.user.id, -5)
                     for child in view.children:
                         if child.custom_id == btn["custom_id"]:
                             child.disabled = True
@@ -451,7 +446,7 @@ def setup(bot):
                         content = "### ❌⭕ Tic Tac Toe\nIt's a tie!"
                     else:
                         content = f"### ❌ Tic Tac Toe\n{player.display_name} wins!\n-# You earned 10 nerdscore"
-                        increase_nerdscore(interaction.user.id, 10)
+                        await aincrease_nerdscore(interaction.user.id, 10)
                     return await interaction.response.edit_message(content=content, view=self)
                 self.current_turn = "ai"
                 await interaction.response.edit_message(view=self)
@@ -503,7 +498,7 @@ Current board state: """ + str(self.board)}
                         content = "### ❌⭕ Tic Tac Toe\nIt's a tie!"
                     else:
                         content = "### ⭕ Tic Tac Toe\nAI Nerd 2 wins!\n-# You lost 10 nerdscore"
-                        increase_nerdscore(interaction.user.id, -5)
+                        await aincrease_nerdscore(interaction.user.id, -5)
                     return await message.edit(content=content, view=self)
                 self.current_turn = "player"
                 await message.edit(content="### ❌ Tic Tac Toe\n**Click a button to make your move!**", view=self)
@@ -539,13 +534,13 @@ Current board state: """ + str(self.board)}
         if user is None:
             user = interaction.user
         await interaction.response.defer()
-        score = get_nerdscore(user.id)
+        score = await aget_nerdscore(user.id)
         await interaction.followup.send(f"### 🤓 {user.display_name}'s Nerdscore\n**{str(score)}**")
     
     @fun_group.command(name="nerdscore-leaderboard", description="Show leaderboard of top 10 users with highest nerdscore")
     async def nerdscore_leaderboard(interaction: Interaction):
         await interaction.response.defer()
-        scores = load_nerdscore()
+        scores = await aload_nerdscore()
         sorted_scores = sorted(scores.items(), key=lambda item: item[1], reverse=True)
         top10 = sorted_scores[:10]
         leaderboard_lines = []
@@ -558,7 +553,7 @@ Current board state: """ + str(self.board)}
     @fun_group.command(name="dailyquiz", description="Take the daily quiz to earn 500 nerdscore (one per day)")
     async def dailyquiz(interaction: Interaction):
         await interaction.response.defer()
-        records = load_daily_quiz_records()
+        records = await load_daily_quiz_records()
         user_id = str(interaction.user.id)
         today = datetime.datetime.utcnow().date().isoformat()
 
@@ -582,20 +577,13 @@ Current board state: """ + str(self.board)}
             }
         ]
 
-        questions_data = load_recent_questions()
-        if user_id not in questions_data:
-            questions_data[user_id] = {}
-
-        genre_counts = {}
-        for g, lst in questions_data[user_id].items():
-            if isinstance(lst, list) and len(lst) > 0:
-                genre_counts[g] = genre_counts.get(g, 0) + len(lst)
+        genre_counts = await storage.aread(storage.get_question_genre_counts, user_id)
 
         if genre_counts:
             top_genre = max(genre_counts.items(), key=lambda x: x[1])[0]
         else:
             top_genre = "Any"
-        user_recent = questions_data[user_id][top_genre]
+        prev_qs, prev_embs = await storage.aread(storage.get_question_history, user_id, top_genre)
 
         MAX_RETRIES = 3
         quiz_question = None
@@ -615,7 +603,6 @@ Current board state: """ + str(self.board)}
 
             if attempt >= 2:
                 skip_similarity = True
-                prev_qs = [p.get('q') for p in user_recent[-50:] if p.get('q')]
                 if prev_qs:
                     exclusion_text = (
                         "Do not reuse any of these previous questions (exact or paraphrased):\n"
@@ -652,28 +639,18 @@ Current board state: """ + str(self.board)}
             if skip_similarity:
                 break
 
-            new_emb = embed_text(quiz_question)
-            similar = False
-            for prev in user_recent:
-                if "emb" not in prev:
-                    continue
-                score = cosine(new_emb, np.array(prev["emb"], dtype=np.float32))
-                if DEBUG:
-                    print(f"Cosine similarity with previous daily quiz '{prev['q']}': {score}")
-                if score > 0.85:
-                    similar = True
-                    break
-            if not similar:
+            new_emb = await aembed_text(quiz_question)
+            scores = question_similarities(prev_embs, new_emb)
+            if DEBUG and len(scores):
+                best = int(scores.argmax())
+                print(f"Cosine similarity with previous daily quiz '{prev_qs[best]}': {scores[best]}")
+            if not (scores > 0.85).any():
                 break
         else:
             await interaction.followup.send("An error occurred while creating the dailyquiz question. Please try again.")
             return
 
-        user_recent.append({"q": quiz_question, "emb": new_emb})
-        if len(user_recent) > 50:
-            user_recent.pop(0)
-        questions_data[user_id][top_genre] = user_recent
-        save_recent_questions(questions_data)
+        await storage.arun(storage.add_question, user_id, top_genre, quiz_question, new_emb)
 
         await interaction.followup.send(f"### 🎯 Daily Quiz\n> {quiz_question}\nType your answer now within 30 seconds!")
 
@@ -709,10 +686,10 @@ Otherwise output only: False
             timeout = True
 
         records[user_id] = today
-        save_daily_quiz_records(records)
+        await save_daily_quiz_records(records)
 
         if first_attempt_correct:
-            increase_nerdscore(interaction.user.id, 500)
+            await aincrease_nerdscore(interaction.user.id, 500)
             await interaction.followup.send("Correct! You earned 500 nerdscore.")
             return
 
@@ -722,7 +699,7 @@ Otherwise output only: False
                 self.retry_used = False
             @discord.ui.button(label="Retry", style=discord.ButtonStyle.primary, custom_id="dailyquiz_retry")
             async def retry_button(self, interaction: Interaction, button: discord.ui.Button):
-                if get_nerdscore(interaction.user.id) < 250:
+                if await aget_nerdscore(interaction.user.id) < 250:
                     await interaction.response.send_message("You need at least 250 nerdscore to retry.", ephemeral=True)
                     return
                 await interaction.response.defer(thinking=True)
@@ -730,6 +707,7 @@ Otherwise output only: False
                 button.disabled = True
                 await interaction.message.edit(view=self)
 
+                prev_qs, prev_embs = await storage.aread(storage.get_question_history, user_id, top_genre)
                 for _ in range(MAX_RETRIES):
                     if DEBUG:
                         print('--- DAILY QUIZ REQUEST ---')
@@ -752,29 +730,17 @@ Otherwise output only: False
                     correct_answers = [args.get("correct_answer", "")]
                     if not quiz_question:
                         continue
-                    new_emb = embed_text(quiz_question)
-                    similar = False
-                    for prev in user_recent:
-                        if "emb" not in prev:
-                            continue
-                        score = cosine(new_emb, np.array(prev["emb"], dtype=np.float32))
-                        if score > 0.85:
-                            similar = True
-                            break
-                    if not similar:
+                    new_emb = await aembed_text(quiz_question)
+                    if not (question_similarities(prev_embs, new_emb) > 0.85).any():
                         break
                 else:
                     await interaction.followup.send("An error occurred while creating the dailyquiz question.")
                     self.stop()
                     return
                 
-                increase_nerdscore(interaction.user.id, -250)
+                await aincrease_nerdscore(interaction.user.id, -250)
 
-                user_recent.append({"q": quiz_question, "emb": new_emb})
-                if len(user_recent) > 50:
-                    user_recent.pop(0)
-                questions_data[user_id][top_genre] = user_recent
-                save_recent_questions(questions_data)
+                await storage.arun(storage.add_question, user_id, top_genre, quiz_question, new_emb)
 
                 await interaction.followup.send(f"-# You bought a retry for 250 nerdscore\n### 🎯 Daily Quiz\n> {quiz_question}\nType your answer now within 30 seconds!")
                 try:
@@ -784,7 +750,7 @@ Otherwise output only: False
                     self.stop()
                     return
                 if any(retry_reply.content.strip().lower() == ans.strip().lower() for ans in correct_answers):
-                    increase_nerdscore(interaction.user.id, 500)
+                    await aincrease_nerdscore(interaction.user.id, 500)
                     await interaction.followup.send("Correct! You earned 500 nerdscore.")
                 else:
                     checkmessages = [
@@ -805,12 +771,12 @@ Otherwise output only: False
                         print('--- RESPONSE ---')
                         print(completion.output_text)
                     if completion.output_text.strip() == "True":
-                        increase_nerdscore(interaction.user.id, 500)
+                        await aincrease_nerdscore(interaction.user.id, 500)
                         await interaction.followup.send("Correct! You earned 500 nerdscore.")
                     else:
                         await interaction.followup.send(f"Incorrect! The correct answer was: **{correct_answers[0]}**")
                 records[user_id] = today
-                save_daily_quiz_records(records)
+                await save_daily_quiz_records(records)
                 self.stop()
 
         view = RetryView()
@@ -820,7 +786,7 @@ Otherwise output only: False
         await view.wait()
         if not view.retry_used:
             records[user_id] = today
-            save_daily_quiz_records(records)
+            await save_daily_quiz_records(records)
 
 
     #  Rock, Paper, Anything starts here
@@ -956,7 +922,7 @@ Otherwise output only: False
         user    = interaction.user
         user_id = user.id
         uname   = user.display_name
-        history = storage.get_rpa_user_history(user_id)
+        history = await storage.aread(storage.get_rpa_user_history, user_id)
 
         # -- Round 1: get AI choice, show it immediately, then judge --
         ai_item = await _rpa_ai_choose(history, [], user_id)
@@ -1025,14 +991,14 @@ Otherwise output only: False
                     if uw == 2 or aw == 2:
                         if uw > aw:
                             result_line = f"🏆 **{uname} wins the match {uw}–{aw}!** +{RPA_NERDSCORE_WIN} nerdscore"
-                            increase_nerdscore(user_id, RPA_NERDSCORE_WIN)
+                            await aincrease_nerdscore(user_id, RPA_NERDSCORE_WIN)
                             match_winner = "user"
                         else:
                             result_line = f"💀 **AI Nerd 2 wins the match {aw}–{uw}.** {RPA_NERDSCORE_LOSS} nerdscore"
-                            increase_nerdscore(user_id, RPA_NERDSCORE_LOSS)
+                            await aincrease_nerdscore(user_id, RPA_NERDSCORE_LOSS)
                             match_winner = "ai"
 
-                        storage.append_rpa_match(user_id, {
+                        await storage.arun(storage.append_rpa_match, user_id, {
                             "rounds": self.current_rounds,
                             "match_winner": match_winner,
                             "timestamp": datetime.datetime.utcnow().isoformat()
@@ -1059,17 +1025,17 @@ Otherwise output only: False
                     # Final message — show all 3 rounds + result
                     if uw > aw:
                         result_line = f"🏆 **{uname} wins the match {uw}–{aw}!** +{RPA_NERDSCORE_WIN} nerdscore"
-                        increase_nerdscore(user_id, RPA_NERDSCORE_WIN)
+                        await aincrease_nerdscore(user_id, RPA_NERDSCORE_WIN)
                         match_winner = "user"
                     elif aw > uw:
                         result_line = f"💀 **AI Nerd 2 wins the match {aw}–{uw}.** {RPA_NERDSCORE_LOSS} nerdscore"
-                        increase_nerdscore(user_id, RPA_NERDSCORE_LOSS)
+                        await aincrease_nerdscore(user_id, RPA_NERDSCORE_LOSS)
                         match_winner = "ai"
                     else:
                         result_line = "🤝 **It's a draw!** No nerdscore change."
                         match_winner = "tie"
 
-                    storage.append_rpa_match(user_id, {
+                    await storage.arun(storage.append_rpa_match, user_id, {
                         "rounds": self.current_rounds,
                         "match_winner": match_winner,
                         "timestamp": datetime.datetime.utcnow().isoformat()
@@ -1121,20 +1087,24 @@ Otherwise output only: False
             uptime_seconds = 0
 
         server_count = len(bot.guilds)
+        docs = await storage.aget_many(
+            ['user_metrics', 'metrics', 'nerdscore', 'serversettings', 'daily_quiz_records'], view=True
+        )
+        user_metrics = docs['user_metrics'] or {}
         try:
-            metrics_data = storage.load_user_metrics() or {}
-            user_count_from_file = len(metrics_data)
+            user_count_from_file = len(user_metrics)
         except Exception:
             user_count_from_file = 0
 
         # Record metrics for history tracking
         try:
-            messages_sent = int(metrics.messages_sent._value.get())
+            messages_sent = int((docs['metrics'] or {}).get('messages_sent', 0))
         except Exception:
             messages_sent = "N/A"
         
         try:
-            metrics.record_daily_metrics(
+            await storage.arun(
+                metrics.record_daily_metrics,
                 servers=server_count,
                 users=user_count_from_file,
                 messages=int(messages_sent) if isinstance(messages_sent, int) else 0
@@ -1145,7 +1115,7 @@ Otherwise output only: False
 
         # Nerdscore data
         try:
-            scores = load_nerdscore()
+            scores = docs['nerdscore'] or {}
             nerdscore_users = len(scores)
             total_nerdscore = sum(scores.values()) if isinstance(scores, dict) else 0
             top10 = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:10]
@@ -1164,12 +1134,11 @@ Otherwise output only: False
             top10_str = "N/A"
 
         # Get storage data
-        daily_messages = storage.load_daily_counts() or {}
-        recent_freewill = storage.get_freewill_attempts() or {}
-        recent_questions = storage.load_recent_questions() or {}
-        serversettings = storage.load_settings() or {}
-        daily_quiz = storage.load_daily_quiz_records() or {}
-        user_metrics = storage.load_user_metrics() or {}
+        daily_messages = await storage.aread(storage.load_daily_counts) or {}
+        recent_freewill = await storage.aread(storage.get_freewill_attempts) or {}
+        recent_questions = await storage.aread(storage.get_question_users_count)
+        serversettings = docs['serversettings'] or {}
+        daily_quiz = docs['daily_quiz_records'] or {}
 
         try:
             daily_avg_active = "N/A"
@@ -1217,12 +1186,11 @@ Otherwise output only: False
             avg_total_messages = "N/A"
 
         try:
-            from memory import get_all_summaries, _read_json_encrypted
+            from memory import get_all_summaries
             all_summaries = get_all_summaries() or []
             memory_count = len(all_summaries)
             try:
-                user_mem_data = _read_json_encrypted('user_memories_enc') or {}
-                user_mem_count = len(user_mem_data.keys()) if isinstance(user_mem_data, dict) else 0
+                user_mem_count = await storage.aread(storage.get_user_memory_count)
             except Exception:
                 user_mem_count = "N/A"
         except Exception:
@@ -1230,7 +1198,7 @@ Otherwise output only: False
             user_mem_count = "N/A"
 
         # Get growth stats
-        growth_stats = metrics.get_growth_stats()
+        growth_stats = await storage.aread(metrics.get_growth_stats)
 
         # Create embeds
         embeds = []
@@ -1322,7 +1290,7 @@ Otherwise output only: False
         storage_embed.add_field(name="Server Settings", value=len(serversettings), inline=True)
         storage_embed.add_field(name="User Metrics", value=len(user_metrics), inline=True)
         storage_embed.add_field(name="Natural Replies Entries", value=len(recent_freewill), inline=True)
-        storage_embed.add_field(name="Recent Questions", value=len(recent_questions), inline=True)
+        storage_embed.add_field(name="Recent Questions", value=recent_questions, inline=True)
         embeds.append(storage_embed)
 
         # Send embeds
@@ -1384,6 +1352,63 @@ Otherwise output only: False
             if DEBUG:
                 print(f"Graph generation error: {e}")
 
+    @admin_group.command(name="storage-stats", description="Show per-key storage latency, bytes and lock wait")
+    @app_commands.describe(reset="Reset the counters after showing them")
+    async def storage_stats(interaction: Interaction, reset: bool = False):
+        if interaction.user.id != OWNER_ID:
+            return await interaction.response.send_message("You are not authorized to use this command.", ephemeral=True)
+
+        snapshot = storage.storage_stats(reset=reset)
+        operations = snapshot['operations']
+        cache = snapshot['cache']
+        since = datetime.datetime.fromtimestamp(snapshot['since'], datetime.timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+
+        embed = discord.Embed(
+            title="Storage Stats",
+            description=(
+                f"Since {since} | Cache hit rate: {cache['hit_rate'] * 100:.1f}% ({cache['keys']} keys) | "
+                f"Pending writes: {snapshot['pending_writes']}"
+            ),
+            color=discord.Color.blue()
+        )
+        if not operations:
+            embed.add_field(name="No data", value="No storage operations recorded yet.", inline=False)
+        for o in operations[:15]:
+            p99 = f"≤{o['p99_ms']}ms" if o['p99_ms'] is not None else ">1000ms"
+            embed.add_field(
+                name=f"{o['op']} {o['name']}"[:256],
+                value=(
+                    f"**Calls:** {o['count']} | **Total:** {o['total_ms'] / 1000:.2f}s\n"
+                    f"**Avg:** {o['avg_ms']:.2f}ms | **p99:** {p99} | **Max:** {o['max_ms']:.1f}ms\n"
+                    f"**Read:** {o['bytes_read'] / 1024:.1f} KiB | **Written:** {o['bytes_written'] / 1024:.1f} KiB | "
+                    f"**Lock wait:** {o['lock_wait_ms']:.1f}ms"
+                ),
+                inline=False
+            )
+        databases = []
+        for domain in storage._DATABASES:
+            try:
+                info = await storage.aread(storage.database_info, domain)
+            except Exception:
+                continue
+            databases.append(
+                f"**{domain}:** {info['db_bytes'] / 1048576:.1f} MiB | WAL {info['wal_bytes'] / 1048576:.1f} MiB | "
+                f"free pages {info['freelist_count']}/{info['page_count']}"
+            )
+        if databases:
+            embed.add_field(name="Databases", value="\n".join(databases)[:1024], inline=False)
+        embeddings = embedding_cache_stats(reset=reset)
+        embed.add_field(
+            name="Embedding cache",
+            value=(
+                f"**Hit rate:** {embeddings['hit_rate'] * 100:.1f}% | **RAM hits:** {embeddings['memory_hits']} | "
+                f"**DB hits:** {embeddings['disk_hits']} | **API calls:** {embeddings['misses']} | "
+                f"**Empty:** {embeddings['empty']} | **In RAM:** {embeddings['entries']}"
+            ),
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @admin_group.command(name="ban", description="Ban or unban a user")
     @app_commands.describe(action="Choose ban, unban, or ban all high-risk users", user="The user to affect (not needed for ban-all-high-risk)")
     @app_commands.choices(action=[
@@ -1397,31 +1422,13 @@ Otherwise output only: False
         
         if action == "ban-all-high-risk":
             await interaction.response.defer(thinking=True, ephemeral=True)
+            suspicious_users = await storage.aread(abuse_detection.get_top_suspicious_users, limit=1000)
+            uids = [u['user_id'] for u in suspicious_users if u['score'] > 200 and u['user_id'] != bot.user.id]
             try:
-                banned_map = storage.load_banned_map() or {}
-            except Exception:
-                banned_map = {}
-            
-            suspicious_users = abuse_detection.get_top_suspicious_users(limit=1000)
-            banned_count = 0
-            skipped_count = 0
-            
-            for user_data in suspicious_users:
-                if user_data['score'] > 200:
-                    uid = user_data['user_id']
-                    if uid == bot.user.id:
-                        continue
-                    if uid in banned_map:
-                        skipped_count += 1
-                        continue
-                    banned_map[uid] = {'notified': False}
-                    abuse_detection.clear_user_tracking(uid)
-                    banned_count += 1
-            
-            try:
-                storage.save_banned_map(banned_map)
+                banned_count = await storage.arun(ban_users, uids)
             except Exception:
                 return await interaction.followup.send("Failed to save banned users list.", ephemeral=True)
+            skipped_count = len(uids) - banned_count
             
             await interaction.followup.send(
                 f"Banned {banned_count} users with abuse score > 200. ({skipped_count} already banned)",
@@ -1432,28 +1439,20 @@ Otherwise output only: False
         if user is None:
             return await interaction.response.send_message("You must specify a user for ban/unban actions.", ephemeral=True)
         
-        try:
-            banned_map = storage.load_banned_map() or {}
-        except Exception:
-            banned_map = {}
-
         uid = int(user.id)
         if action == 'ban':
-            if uid in banned_map:
+            if storage.is_banned(uid):
                 return await interaction.response.send_message(f"{user} is already banned.", ephemeral=True)
-            banned_map[uid] = {'notified': False}
             try:
-                storage.save_banned_map(banned_map)
-                abuse_detection.clear_user_tracking(uid)
+                await storage.arun(ban_users, [uid])
             except Exception:
                 return await interaction.response.send_message("Failed to save banned users list.", ephemeral=True)
             await interaction.response.send_message(f"Banned {user} from using the bot.", ephemeral=True)
         else:
-            if uid not in banned_map:
+            if not storage.is_banned(uid):
                 return await interaction.response.send_message(f"{user} is not banned.", ephemeral=True)
             try:
-                banned_map.pop(uid, None)
-                storage.save_banned_map(banned_map)
+                await storage.arun(storage.unban_user, uid)
             except Exception:
                 return await interaction.response.send_message("Failed to update banned users list.", ephemeral=True)
             await interaction.response.send_message(f"Unbanned {user}.", ephemeral=True)
@@ -1465,9 +1464,9 @@ Otherwise output only: False
         
         await interaction.response.defer(ephemeral=True)
         
-        suspicious_users = abuse_detection.get_top_suspicious_users(limit=15)
+        suspicious_users = await storage.aread(abuse_detection.get_top_suspicious_users, limit=15)
         suspicious_users = [u for u in suspicious_users if u['user_id'] != bot.user.id]
-        stats = abuse_detection.get_stats()
+        stats = await storage.aread(abuse_detection.get_stats)
         
         if not suspicious_users:
             await interaction.followup.send("No suspicious activity detected.", ephemeral=True)
@@ -1516,8 +1515,8 @@ Otherwise output only: False
         
         await interaction.response.defer(ephemeral=True)
         
-        abuse_score = abuse_detection.calculate_abuse_score(user.id)
-        message_history = abuse_detection.get_user_message_history(user.id, limit=30)
+        abuse_score = await storage.aread(abuse_detection.calculate_abuse_score, user.id)
+        message_history = await storage.aread(abuse_detection.get_user_message_history, user.id, limit=30)
         
         if not message_history:
             await interaction.followup.send(f"No tracking data found for user {user.id}.", ephemeral=True)
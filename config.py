@@ -16,6 +16,12 @@ KNOWLEDGE_TOP_K = 3 # Number of relevant knowledge items to include in context (
 DEBUG = False # Enables debug logging (default: False)
 NATURAL_REPLIES_INTERVAL = 180 # Time in seconds between natural replies message checks (default: 180)
 MEMORY_LIMIT = 500 # Max number of memories to store (per user and global memories) (default: 500)
+MEMORY_FLUSH_DELAY = 5 # Seconds memory changes are held before being encrypted and saved, changes made in the meantime are saved together (default: 5)
+MEMORY_ANN_MIN_SIZE = 5000 # Memory lists with at least this many entries are searched through an approximate nearest-neighbor index instead of comparing every entry (default: 5000)
+MEMORY_ANN_PROBES = 48 # Index groups scored per approximate memory search, more finds more of the true best matches but is slower (default: 48)
+EMBED_CACHE_SIZE = 2048 # Number of embeddings kept in RAM, repeated texts are also looked up in the database before calling the API when MEMORY_KEY is set (default: 2048)
+EMBED_CACHE_DAYS = 30 # Stored embeddings unused for this many days are deleted (default: 30)
+EMBED_CACHE_MAX_ROWS = 100000 # Max number of stored embeddings, the least recently used are deleted first, 0 for no limit (default: 100000)
 DAILY_MESSAGE_LIMIT = 50 # Max number of messages per user per day before switching to fallback model (default: 50)
 OWNER_ID = 686109465971392512 # User id of the bot owner (for admin commands)
 
@@ -23,6 +29,22 @@ OWNER_ID = 686109465971392512 # User id of the bot owner (for admin commands)
 DATA_DIR = Path("data")
 TEMP_DIR = Path("temp")
 
+# Storage settings
+STORAGE_BACKEND = "sqlite" # "sqlite" keeps data in DATA_DIR, "memory" keeps everything in RAM and discards it on exit, the AI_NERD_STORAGE_BACKEND environment variable overrides this (default: "sqlite")
+STORAGE_WRITE_WINDOW_MS = 50 # Writes issued within this window are committed together in one transaction, 0 commits every write immediately (default: 50)
+STORAGE_READ_WORKERS = 4 # Threads serving awaitable storage reads, each with its own read-only connection; writes always run on one thread (default: 4)
+STORAGE_SYNCHRONOUS = "NORMAL" # SQLite durability level: "FULL" syncs every commit, "NORMAL" may lose the last commits on power loss, "OFF" never syncs (default: "NORMAL")
+STORAGE_CACHE_SIZE_KB = 2000 # SQLite page cache per connection in KiB (default: 2000)
+STORAGE_MMAP_SIZE = 0 # Bytes of the database file SQLite may memory-map for reads, 0 disables mmap (default: 0)
+STORAGE_TEMP_STORE = "DEFAULT" # Where SQLite keeps temporary tables and indexes: "DEFAULT", "FILE" or "MEMORY" (default: "DEFAULT")
+STORAGE_COMPRESS_MIN_BYTES = 4096 # kv values and blobs at least this large are stored zlib-compressed, 0 disables compression (default: 4096)
+STORAGE_MAINTENANCE_INTERVAL = 60 # Seconds between storage maintenance checks (default: 60)
+STORAGE_WAL_CHECKPOINT_MB = 4 # A WAL file larger than this many MiB gets a passive checkpoint (default: 4)
+STORAGE_WAL_TRUNCATE_MB = 64 # A WAL file larger than this many MiB is checkpointed and truncated during a quiet period (default: 64)
+STORAGE_QUIET_SECONDS = 30 # A database counts as quiet after this many seconds without writes (default: 30)
+STORAGE_VACUUM_STEP_PAGES = 256 # Free pages returned to the filesystem per incremental vacuum step during quiet periods (default: 256)
+STORAGE_AUTO_VACUUM_SWITCH = False # Let maintenance rewrite database files created without incremental vacuum once (VACUUM) during a quiet period, writes wait until the rewrite finishes (default: False)
+
 
 KNOWLEDGE_ITEMS = [
     "You are created by Nerdlabs AI, of which Purpyel is the lead developer.",
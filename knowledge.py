@@ -1,9 +1,9 @@
 import hashlib
 import numpy as np
 from config import KNOWLEDGE_ITEMS
-from memory import _cosine
-from openai_client import embed_text
-from storage import load_knowledge, save_knowledge
+from memory import _cosine, _encode_embedding, _decode_embedding
+from openai_client import embed_texts
+from storage import load_knowledge, save_knowledge, view_knowledge
 
 def _hash_text(text: str) -> str:
     return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
@@ -12,6 +12,7 @@ def sync_knowledge():
     knowledge_data = load_knowledge()
     current_hashes = {}
     changed = False
+    pending = []
 
     for item in KNOWLEDGE_ITEMS:
         h = _hash_text(item)
@@ -19,15 +20,20 @@ def sync_knowledge():
 
         if item not in knowledge_data:
             print(f"Found new knowledge: {item[:60]}...")
-            emb = embed_text(item)
-            knowledge_data[item] = {"hash": h, "embedding": emb}
-            changed = True
+            pending.append(item)
         elif knowledge_data[item].get("hash") != h:
             print(f"Found edited knowledge: {item[:60]}...")
-            emb = embed_text(item)
-            knowledge_data[item] = {"hash": h, "embedding": emb}
+            pending.append(item)
+        elif isinstance(knowledge_data[item].get("embedding"), list):
+            # float lists from before embeddings were stored as int8
+            knowledge_data[item]["embedding"] = _encode_embedding(knowledge_data[item]["embedding"])
             changed = True
 
+    # new and edited items are embedded in one request
+    for item, emb in zip(pending, embed_texts(pending) if pending else []):
+        knowledge_data[item] = {"hash": current_hashes[item], "embedding": _encode_embedding(emb)}
+        changed = True
+
     to_remove = [k for k in knowledge_data.keys() if k not in current_hashes]
     for k in to_remove:
         print(f"Deleted knowledge: {k[:60]}...")
@@ -46,11 +52,12 @@ def find_relevant_knowledge(query_emb, top_k: int = 3) -> list:
     except Exception:
         q_vec = None
 
-    data = load_knowledge()
+    data = view_knowledge()
     scored = []
 
     for i, (text, info) in enumerate(data.items()):
-        emb = np.array(info.get("embedding", []), dtype=np.float32)
+        emb = info.get("embedding") or []
+        emb = _decode_embedding(emb) if isinstance(emb, str) else np.array(emb, dtype=np.float32)
         if q_vec is None or emb.size == 0:
             score = 0.0
         else:
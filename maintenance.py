@@ -0,0 +1,91 @@
+import threading
+import time
+
+import storage
+from config import (
+    STORAGE_MAINTENANCE_INTERVAL, STORAGE_WAL_CHECKPOINT_MB, STORAGE_WAL_TRUNCATE_MB, STORAGE_QUIET_SECONDS,
+    STORAGE_VACUUM_STEP_PAGES, STORAGE_AUTO_VACUUM_SWITCH
+)
+
+
+class MaintenanceManager:
+    def __init__(self, interval_seconds: float = STORAGE_MAINTENANCE_INTERVAL, checkpoint_mb: float = STORAGE_WAL_CHECKPOINT_MB,
+                 truncate_mb: float = STORAGE_WAL_TRUNCATE_MB, quiet_seconds: float = STORAGE_QUIET_SECONDS,
+                 vacuum_pages: int = STORAGE_VACUUM_STEP_PAGES, switch_auto_vacuum: bool = STORAGE_AUTO_VACUUM_SWITCH):
+        self.interval = max(1, int(interval_seconds))
+        self.checkpoint_bytes = int(checkpoint_mb * 1024 * 1024)
+        self.truncate_bytes = int(truncate_mb * 1024 * 1024)
+        self.quiet_seconds = quiet_seconds
+        self.vacuum_pages = vacuum_pages
+        self.switch_auto_vacuum = switch_auto_vacuum
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._report = {}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name="StorageMaintenance")
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {domain: dict(entry) for domain, entry in self._report.items()}
+
+    def _run_loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                pass
+
+    def run_once(self) -> dict:
+        for domain in storage._DATABASES:
+            try:
+                self._maintain(domain)
+            except Exception:
+                continue
+        return self.report()
+
+    def _maintain(self, domain: str):
+        info = storage.database_info(domain)
+        quiet = info['idle_seconds'] is None or info['idle_seconds'] >= self.quiet_seconds
+        entry = {'checked_at': time.time(), 'quiet': quiet}
+
+        # TRUNCATE also shrinks the WAL file but waits for readers, so it only runs while the database is quiet
+        mode = None
+        if info['wal_bytes'] >= self.truncate_bytes and quiet:
+            mode = "TRUNCATE"
+        elif info['wal_bytes'] >= self.checkpoint_bytes:
+            mode = "PASSIVE"
+        if mode:
+            entry['checkpoint'] = storage.checkpoint(mode, domain)[domain]
+
+        # files too large for the migration to switch are rewritten here once, only when enabled
+        if quiet and self.switch_auto_vacuum and info['auto_vacuum'] != 'incremental':
+            entry['auto_vacuum_switched'] = storage.enable_incremental_vacuum(domain)
+            info = storage.database_info(domain)
+
+        if quiet and info['freelist_count'] and info['auto_vacuum'] == 'incremental':
+            entry['vacuumed_pages'] = storage.incremental_vacuum(domain, self.vacuum_pages)
+
+        if mode or entry.get('vacuumed_pages'):
+            info = storage.database_info(domain)
+        entry.update(info)
+
+        with self._lock:
+            previous = self._report.get(domain, {})
+            entry.setdefault('checkpoint', previous.get('checkpoint'))
+            entry['checkpoints'] = previous.get('checkpoints', 0) + (1 if mode else 0)
+            entry['total_vacuumed_pages'] = previous.get('total_vacuumed_pages', 0) + entry.get('vacuumed_pages', 0)
+            self._report[domain] = entry
+
+
+__all__ = ["MaintenanceManager"]
@@ -1,19 +1,27 @@
-import os
-import json
 import time
+import atexit
 import base64
+import threading
 import storage
 import numpy as np
-from config import MEMORY_LIMIT
+from collections import deque
+from config import MEMORY_LIMIT, MEMORY_FLUSH_DELAY
 from credentials import MEMORY_KEY_B64
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from openai_client import embed_text
+from openai_client import embed_text, aembed_text
+from vector_index import VectorIndex, pack_embedding, unpack_embedding, embedding_to_text, embedding_from_text
 
 MEMORIES_FILE = 'memories_enc'  # storage blob key
-_USER_MEMORIES_FILE = 'user_memories_enc'
 
 _MEMORIES_CACHE = None
 _USER_MEMORIES_CACHE = None
+# scope (None for global, user key otherwise) -> VectorIndex, one row per summary
+_INDEXES = {}
+# scopes changed in the cache but not written yet, flushed together by a background thread
+_DIRTY = set()
+_CACHE_LOCK = threading.RLock()
+_FLUSH_LOCK = threading.Lock()
+_FLUSH_EVENT = threading.Event()
+_FLUSH_THREAD = None
 
 def _get_key() -> bytes:
     if not MEMORY_KEY_B64:
@@ -23,89 +31,83 @@ def _get_key() -> bytes:
         raise ValueError("MEMORY key must be 32 bytes for AES-256")
     return key
 
-def _encrypt_bytes(plaintext: bytes) -> bytes:
-    key = _get_key()
-    aesgcm = AESGCM(key)
-    nonce = os.urandom(12)
-    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
-    return base64.urlsafe_b64encode(nonce + ciphertext)
-
-def _decrypt_bytes(data_b64: bytes) -> bytes:
-    raw = base64.urlsafe_b64decode(data_b64)
-    if len(raw) < 12:
-        raise ValueError("Invalid encrypted data")
-    nonce = raw[:12]
-    ciphertext = raw[12:]
-    key = _get_key()
-    aesgcm = AESGCM(key)
-    return aesgcm.decrypt(nonce, ciphertext, None)
-
-def _read_json_encrypted(path_or_key):
-    key = str(path_or_key)
-    if key == str('memories.json') or key.endswith('memories.json'):
-        key = MEMORIES_FILE
-    if key == str('user_memories.json') or key.endswith('user_memories.json'):
-        key = _USER_MEMORIES_FILE
-    b = storage.get_blob(key) if key in (MEMORIES_FILE, _USER_MEMORIES_FILE) else storage.get_encrypted_blob_for_path(key)
+# both stores hold packed memory records (see storage._seal_memory_record), legacy JSON ones are still read and are
+# rewritten packed the next time their scope changes
+def _decode_memory_record(b):
     if not b:
         return None
     try:
-        dec = _decrypt_bytes(b)
-        return json.loads(dec.decode('utf-8'))
+        key = _get_key()
     except Exception:
-        try:
-            return json.loads(b.decode('utf-8'))
-        except Exception:
-            return None
+        key = None
+    try:
+        return storage._open_memory_record(b, key)
+    except Exception:
+        return None
+
+def _encode_memory_record(data) -> bytes:
+    return storage._seal_memory_record(data, _get_key())
 
-def _write_json_encrypted(path_or_key, obj):
+def _read_memory_store(path_or_key):
     key = str(path_or_key)
     if key == str('memories.json') or key.endswith('memories.json'):
         key = MEMORIES_FILE
-    if key == str('user_memories.json') or key.endswith('user_memories.json'):
-        key = _USER_MEMORIES_FILE
-    plain = json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
-    enc = _encrypt_bytes(plain)
-    storage.set_blob(key, enc)
+    b = storage.get_blob(key) if key == MEMORIES_FILE else storage.get_encrypted_blob_for_path(key)
+    return _decode_memory_record(b)
+
+def _write_memory_store(path_or_key, obj):
+    key = str(path_or_key)
+    if key == str('memories.json') or key.endswith('memories.json'):
+        key = MEMORIES_FILE
+    storage.set_blob(key, _encode_memory_record(obj))
+
+# user memories are one encrypted row per user, so a change only re-encrypts that user's entry
+def _read_user_memories(user_key: str):
+    return _decode_memory_record(storage.get_user_memory_record(user_key))
+
+def _encode_user_memories(entry):
+    if not entry or not (entry.get("summaries") or entry.get("memories")):
+        return None
+    return _encode_memory_record(entry)
+
+def _write_user_memories(user_key: str, entry):
+    storage.set_user_memory_record(user_key, _encode_user_memories(entry))
+
+def _cache_entry(data=None) -> dict:
+    # cached lists are deques so evicting the oldest memory is O(1)
+    data = data or {}
+    return {"summaries": deque(data.get("summaries", [])), "memories": deque(data.get("memories", []))}
 
 def init_memory_files():
-    if _read_json_encrypted(MEMORIES_FILE) is None:
-        _write_json_encrypted(MEMORIES_FILE, {"summaries": [], "memories": []})
-    if _read_json_encrypted(_USER_MEMORIES_FILE) is None:
-        _write_json_encrypted(_USER_MEMORIES_FILE, {})
+    if _read_memory_store(MEMORIES_FILE) is None:
+        _write_memory_store(MEMORIES_FILE, {"summaries": [], "memories": []})
 
 def load_memory_cache():
     global _MEMORIES_CACHE, _USER_MEMORIES_CACHE
-    data = _read_json_encrypted(MEMORIES_FILE) or {"summaries": [], "memories": []}
-    if isinstance(data, dict):
-        summaries = list(data.get("summaries", []))
-        memories = list(data.get("memories", []))
-    else:
-        summaries = []
-        memories = []
-    _MEMORIES_CACHE = {"summaries": summaries, "memories": memories}
+    # unwritten changes would be lost by the reload
+    if _DIRTY:
+        flush_memory_cache()
+    _INDEXES.clear()
+    b = storage.get_blob(MEMORIES_FILE)
+    data = _decode_memory_record(b)
+    _MEMORIES_CACHE = _cache_entry(data)
+    if data is not None and not storage._is_sealed_memory_record(b):
+        _mark_dirty(None)
 
-    udata = _read_json_encrypted(_USER_MEMORIES_FILE) or {}
     _USER_MEMORIES_CACHE = {}
-    if isinstance(udata, dict):
-        for k, v in udata.items():
-            if isinstance(v, dict):
-                usum = list(v.get("summaries", []))
-                umem = list(v.get("memories", []))
-            else:
-                usum = []
-                umem = []
-            _USER_MEMORIES_CACHE[k] = {"summaries": usum, "memories": umem}
-    else:
-        _USER_MEMORIES_CACHE = {}
+    for k, b in storage.load_user_memory_records().items():
+        entry = _decode_memory_record(b)
+        if entry is not None:
+            _USER_MEMORIES_CACHE[k] = _cache_entry(entry)
+            if not storage._is_sealed_memory_record(b):
+                _mark_dirty(k)
 
 def _encode_embedding(emb: list) -> str:
-    arr = np.array(emb, dtype=np.float32)
-    return base64.urlsafe_b64encode(arr.tobytes()).decode('ascii')
+    arr = np.array(emb, dtype=np.float32).ravel()
+    return embedding_to_text(pack_embedding(arr)) if arr.size else ""
 
-def _decode_embedding(b64: str) -> np.ndarray:
-    raw = base64.urlsafe_b64decode(b64.encode('ascii'))
-    return np.frombuffer(raw, dtype=np.float32)
+def _decode_embedding(text: str) -> np.ndarray:
+    return unpack_embedding(embedding_from_text(text))
 
 def _cosine(a: np.ndarray, b: np.ndarray) -> float:
     if a.size == 0 or b.size == 0:
@@ -116,77 +118,157 @@ def _cosine(a: np.ndarray, b: np.ndarray) -> float:
         return 0.0
     return float(np.dot(a, b) / (da * db))
 
-
-def add_memory_to_cache(summary: str, full_memory: str) -> int:
-    global _MEMORIES_CACHE
-    if _MEMORIES_CACHE is None:
-        load_memory_cache()
-    if _MEMORIES_CACHE is None:
-        _MEMORIES_CACHE = {"summaries": [], "memories": []}
-
+def _unit_row(emb: bytes):
     try:
-        emb = embed_text(summary)
-        emb_b64 = _encode_embedding(emb)
+        vec = unpack_embedding(emb) if emb else None
     except Exception:
-        emb_b64 = ""
-
-    summaries = _MEMORIES_CACHE.setdefault("summaries", [])
-    memories = _MEMORIES_CACHE.setdefault("memories", [])
-    if len(summaries) >= MEMORY_LIMIT:
-        summaries.pop(0)
-        memories.pop(0)
-    summaries.append({"text": summary, "embedding": emb_b64})
+        vec = None
+    if vec is None or vec.size == 0:
+        return None
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else None
+
+def _build_index(items) -> VectorIndex:
+    # summaries without a usable embedding (or from another embedding model) get a zero row and always score 0
+    rows = [_unit_row(s.get("embedding")) if isinstance(s, dict) else None for s in items]
+    dim = next((r.size for r in reversed(rows) if r is not None), 0)
+    return VectorIndex.from_rows([r if r is not None and r.size == dim else None for r in rows], dim)
+
+def _scope_index(scope, items) -> VectorIndex:
+    index = _INDEXES.get(scope)
+    if index is None or len(index) != len(items):
+        index = _INDEXES[scope] = _build_index(items)
+    return index
+
+def _append_cached(scope, entry: dict, item: dict, full_memory: str) -> int:
+    summaries = entry.setdefault("summaries", deque())
+    memories = entry.setdefault("memories", deque())
+    dropped = len(summaries) >= MEMORY_LIMIT
+    if dropped:
+        summaries.popleft()
+        memories.popleft()
+    summaries.append(item)
     memories.append(full_memory)
+
+    index = _INDEXES.get(scope)
+    if index is not None:
+        if dropped:
+            index.popleft()
+        row = _unit_row(item.get("embedding"))
+        if row is not None and row.size != index.dim:
+            # the embedding size changed, rebuild on the next lookup
+            _INDEXES.pop(scope, None)
+        else:
+            index.append(row)
     return len(summaries)
 
-def add_user_memory_to_cache(user_id: str, summary: str, full_memory: str) -> int:
-    global _USER_MEMORIES_CACHE
-    user_key = str(user_id)
-    if _USER_MEMORIES_CACHE is None:
-        load_memory_cache()
-    if _USER_MEMORIES_CACHE is None:
-        _USER_MEMORIES_CACHE = {}
-    if user_key not in _USER_MEMORIES_CACHE:
-        _USER_MEMORIES_CACHE[user_key] = {"summaries": [], "memories": []}
+def _delete_cached(scope, entry: dict, idx: int) -> None:
+    summaries = entry.setdefault("summaries", deque())
+    del entry.setdefault("memories", deque())[idx - 1]
+    if idx - 1 < len(summaries):
+        del summaries[idx - 1]
+        index = _INDEXES.get(scope)
+        if index is not None and idx - 1 < len(index):
+            index.delete(idx - 1)
 
+
+def _summary_embedding(emb) -> bytes:
+    # summaries keep their embedding packed (float32 scale + int8 codes), the same bytes the stored records hold
     try:
-        emb = embed_text(summary)
-        emb_b64 = _encode_embedding(emb)
+        arr = np.array(emb, dtype=np.float32).ravel()
+        return pack_embedding(arr) if arr.size else b""
     except Exception:
-        emb_b64 = ""
-
-    usum = _USER_MEMORIES_CACHE[user_key].setdefault("summaries", [])
-    umem = _USER_MEMORIES_CACHE[user_key].setdefault("memories", [])
-    if len(usum) >= MEMORY_LIMIT:
-        usum.pop(0)
-        umem.pop(0)
-    usum.append({"text": summary, "embedding": emb_b64})
-    umem.append(full_memory)
-    return len(usum)
-
-def flush_memory_cache():
+        return b""
+
+def _add_to_cache(scope, summary: str, emb: bytes, full_memory: str) -> int:
     global _MEMORIES_CACHE, _USER_MEMORIES_CACHE
-    if _MEMORIES_CACHE is not None:
+    if (_MEMORIES_CACHE if scope is None else _USER_MEMORIES_CACHE) is None:
+        load_memory_cache()
+    if _MEMORIES_CACHE is None:
+        _MEMORIES_CACHE = _cache_entry()
+    if _USER_MEMORIES_CACHE is None:
+        _USER_MEMORIES_CACHE = {}
+
+    with _CACHE_LOCK:
+        entry = _MEMORIES_CACHE if scope is None else _USER_MEMORIES_CACHE.setdefault(scope, _cache_entry())
+        count = _append_cached(scope, entry, {"text": summary, "embedding": emb}, full_memory)
+        _mark_dirty(scope)
+        return count
+
+def add_memory_to_cache(summary: str, full_memory: str) -> int:
+    return _add_to_cache(None, summary, _summary_embedding(embed_text(summary)), full_memory)
+
+async def aadd_memory_to_cache(summary: str, full_memory: str) -> int:
+    return _add_to_cache(None, summary, _summary_embedding(await aembed_text(summary)), full_memory)
+
+def add_user_memory_to_cache(user_id: str, summary: str, full_memory: str) -> int:
+    return _add_to_cache(str(user_id), summary, _summary_embedding(embed_text(summary)), full_memory)
+
+async def aadd_user_memory_to_cache(user_id: str, summary: str, full_memory: str) -> int:
+    return _add_to_cache(str(user_id), summary, _summary_embedding(await aembed_text(summary)), full_memory)
+
+def _mark_dirty(scope) -> None:
+    global _FLUSH_THREAD
+    with _CACHE_LOCK:
+        _DIRTY.add(scope)
+        if _FLUSH_THREAD is None:
+            _FLUSH_THREAD = threading.Thread(target=_flush_loop, daemon=True, name="MemoryWriteBehind")
+            _FLUSH_THREAD.start()
+    _FLUSH_EVENT.set()
+
+def _flush_loop():
+    while True:
+        _FLUSH_EVENT.wait()
+        time.sleep(max(0, MEMORY_FLUSH_DELAY))
+        _FLUSH_EVENT.clear()
         try:
-            _write_json_encrypted(MEMORIES_FILE, {"summaries": _MEMORIES_CACHE.get("summaries", []), "memories": _MEMORIES_CACHE.get("memories", [])})
+            flush_memory_cache()
         except Exception:
-            raise
-    if _USER_MEMORIES_CACHE is not None:
+            pass
+
+def _encode_scope(scope):
+    if scope is None:
+        data = _MEMORIES_CACHE or {}
+        return _encode_memory_record(data)
+    return _encode_user_memories((_USER_MEMORIES_CACHE or {}).get(scope))
+
+def flush_memory_cache() -> int:
+    # only the scopes changed since the last flush are re-encrypted. encoding happens under the cache lock so each
+    # scope is written as one consistent snapshot, the database writes happen outside it
+    with _FLUSH_LOCK:
+        with _CACHE_LOCK:
+            scopes = list(_DIRTY)
+            _DIRTY.clear()
+            try:
+                payloads = [(scope, _encode_scope(scope)) for scope in scopes]
+            except Exception:
+                _DIRTY.update(scopes)
+                raise
+        if not payloads:
+            return 0
         try:
-            _write_json_encrypted(_USER_MEMORIES_FILE, _USER_MEMORIES_CACHE)
+            with storage.transaction():
+                for scope, data in payloads:
+                    if scope is None:
+                        storage.set_blob(MEMORIES_FILE, data)
+                    else:
+                        storage.set_user_memory_record(scope, data)
         except Exception:
+            with _CACHE_LOCK:
+                _DIRTY.update(scopes)
             raise
+        return len(payloads)
 
 def save_memory(summary: str, full_memory: str) -> int:
     global _MEMORIES_CACHE
-    data = _read_json_encrypted(MEMORIES_FILE)
+    data = _read_memory_store(MEMORIES_FILE)
     if data is None:
         data = {"summaries": [], "memories": []}
     stored_summaries = data.get("summaries", [])
     new_summaries = []
     for s in stored_summaries:
         if isinstance(s, str):
-            new_summaries.append({"text": s, "embedding": ""})
+            new_summaries.append({"text": s, "embedding": b""})
         else:
             new_summaries.append(s)
     data["summaries"] = new_summaries
@@ -195,21 +277,17 @@ def save_memory(summary: str, full_memory: str) -> int:
         data["memories"].pop(0)
 
     try:
-        emb = embed_text(summary)
-        emb_b64 = _encode_embedding(emb)
+        emb = _summary_embedding(embed_text(summary))
     except Exception:
-        emb_b64 = ""
+        emb = b""
 
-    data.setdefault("summaries", []).append({"text": summary, "embedding": emb_b64})
+    data.setdefault("summaries", []).append({"text": summary, "embedding": emb})
     data.setdefault("memories", []).append(full_memory)
-    _write_json_encrypted(MEMORIES_FILE, data)
+    _write_memory_store(MEMORIES_FILE, data)
 
     if _MEMORIES_CACHE is not None:
-        _MEMORIES_CACHE.setdefault("summaries", []).append({"text": summary, "embedding": emb_b64})
-        _MEMORIES_CACHE.setdefault("memories", []).append(full_memory)
-        if len(_MEMORIES_CACHE.get("summaries", [])) > MEMORY_LIMIT:
-            _MEMORIES_CACHE["summaries"].pop(0)
-            _MEMORIES_CACHE["memories"].pop(0)
+        with _CACHE_LOCK:
+            _append_cached(None, _MEMORIES_CACHE, {"text": summary, "embedding": emb}, full_memory)
     return len(data["summaries"])
 
 def get_memory_detail(index: int) -> str:
@@ -217,7 +295,7 @@ def get_memory_detail(index: int) -> str:
     if _MEMORIES_CACHE is not None:
         memories = _MEMORIES_CACHE.get("memories", [])
     else:
-        data = _read_json_encrypted(MEMORIES_FILE) or {"memories": []}
+        data = _read_memory_store(MEMORIES_FILE) or {"memories": []}
         memories = data.get("memories", [])
     if 1 <= index <= len(memories):
         return memories[index - 1]
@@ -232,22 +310,22 @@ def delete_memory(index: int) -> bool:
     if idx < 1:
         return False
 
-    data = _read_json_encrypted(MEMORIES_FILE) or {"summaries": [], "memories": []}
-    summaries = data.get("summaries", [])
-    memories = data.get("memories", [])
+    with _CACHE_LOCK:
+        cached = _MEMORIES_CACHE is not None
+        data = _MEMORIES_CACHE if cached else (_read_memory_store(MEMORIES_FILE) or {"summaries": [], "memories": []})
+        summaries = data.setdefault("summaries", [])
+        memories = data.setdefault("memories", [])
 
-    if 1 <= idx <= len(memories):
-        try:
-            memories.pop(idx - 1)
-            if idx - 1 < len(summaries):
-                summaries.pop(idx - 1)
-            data["summaries"] = summaries
-            data["memories"] = memories
-            _write_json_encrypted(MEMORIES_FILE, data)
-            load_memory_cache()
+        if 1 <= idx <= len(memories):
+            if cached:
+                _delete_cached(None, data, idx)
+                _mark_dirty(None)
+            else:
+                memories.pop(idx - 1)
+                if idx - 1 < len(summaries):
+                    summaries.pop(idx - 1)
+                _write_memory_store(MEMORIES_FILE, data)
             return True
-        except Exception:
-            raise
     return False
 
 def get_all_summaries() -> list:
@@ -255,48 +333,33 @@ def get_all_summaries() -> list:
     if _MEMORIES_CACHE is not None:
         items = _MEMORIES_CACHE.get("summaries", [])
     else:
-        data = _read_json_encrypted(MEMORIES_FILE) or {"summaries": []}
+        data = _read_memory_store(MEMORIES_FILE) or {"summaries": []}
         items = data.get("summaries", [])
     return [s["text"] if isinstance(s, dict) else s for s in items]
 
 def save_user_memory(user_id: str, summary: str, full_memory: str) -> int:
     global _USER_MEMORIES_CACHE
     user_key = str(user_id)
-    data = _read_json_encrypted(_USER_MEMORIES_FILE) or {}
-    if user_key not in data:
-        data[user_key] = {"summaries": [], "memories": []}
-
-    usum = data[user_key].get("summaries", [])
-    new_usum = []
-    for s in usum:
-        if isinstance(s, str):
-            new_usum.append({"text": s, "embedding": ""})
-        else:
-            new_usum.append(s)
-    data[user_key]["summaries"] = new_usum
+    entry = _read_user_memories(user_key) or {"summaries": [], "memories": []}
+    entry["summaries"] = [{"text": s, "embedding": b""} if isinstance(s, str) else s for s in entry["summaries"]]
 
     try:
-        emb = embed_text(summary)
-        emb_b64 = _encode_embedding(emb)
+        emb = _summary_embedding(embed_text(summary))
     except Exception:
-        emb_b64 = ""
+        emb = b""
 
-    if len(data[user_key].get("summaries", [])) >= MEMORY_LIMIT:
-        data[user_key]["summaries"].pop(0)
-        data[user_key]["memories"].pop(0)
-    data[user_key].setdefault("summaries", []).append({"text": summary, "embedding": emb_b64})
-    data[user_key].setdefault("memories", []).append(full_memory)
-    _write_json_encrypted(_USER_MEMORIES_FILE, data)
+    if len(entry["summaries"]) >= MEMORY_LIMIT:
+        entry["summaries"].pop(0)
+        entry["memories"].pop(0)
+    entry["summaries"].append({"text": summary, "embedding": emb})
+    entry["memories"].append(full_memory)
+    _write_user_memories(user_key, entry)
 
     if _USER_MEMORIES_CACHE is not None:
-        if user_key not in _USER_MEMORIES_CACHE:
-            _USER_MEMORIES_CACHE[user_key] = {"summaries": [], "memories": []}
-        _USER_MEMORIES_CACHE[user_key].setdefault("summaries", []).append({"text": summary, "embedding": emb_b64})
-        _USER_MEMORIES_CACHE[user_key].setdefault("memories", []).append(full_memory)
-        if len(_USER_MEMORIES_CACHE[user_key].get("summaries", [])) > MEMORY_LIMIT:
-            _USER_MEMORIES_CACHE[user_key]["summaries"].pop(0)
-            _USER_MEMORIES_CACHE[user_key]["memories"].pop(0)
-    return len(data[user_key]["summaries"])
+        with _CACHE_LOCK:
+            entry = _USER_MEMORIES_CACHE.setdefault(user_key, _cache_entry())
+            _append_cached(user_key, entry, {"text": summary, "embedding": emb}, full_memory)
+    return len(entry["summaries"])
 
 def get_user_memory_detail(user_id: str, index: int) -> str:
     user_key = str(user_id)
@@ -305,9 +368,9 @@ def get_user_memory_detail(user_id: str, index: int) -> str:
         memories = _USER_MEMORIES_CACHE[user_key].get("memories", [])
         if 1 <= index <= len(memories):
             return memories[index - 1]
-    data = _read_json_encrypted(_USER_MEMORIES_FILE) or {}
-    if user_key in data:
-        memories = data[user_key].get("memories", [])
+    entry = _read_user_memories(user_key)
+    if entry is not None:
+        memories = entry["memories"]
         if 1 <= index <= len(memories):
             return memories[index - 1]
     return ""
@@ -317,9 +380,9 @@ def get_user_summaries(user_id: str) -> list:
     global _USER_MEMORIES_CACHE
     if _USER_MEMORIES_CACHE is not None and user_key in _USER_MEMORIES_CACHE:
         return [s["text"] if isinstance(s, dict) else s for s in _USER_MEMORIES_CACHE[user_key].get("summaries", [])]
-    data = _read_json_encrypted(_USER_MEMORIES_FILE) or {}
-    if user_key in data:
-        return [s["text"] if isinstance(s, dict) else s for s in data[user_key].get("summaries", [])]
+    entry = _read_user_memories(user_key)
+    if entry is not None:
+        return [s["text"] if isinstance(s, dict) else s for s in entry["summaries"]]
     return []
 
 def find_relevant_memories(query: str, top_k: int = 5, user_id: str = None) -> list:
@@ -329,51 +392,51 @@ def find_relevant_memories(query: str, top_k: int = 5, user_id: str = None) -> l
         q_vec = None
 
     if user_id is not None:
-        data = _USER_MEMORIES_CACHE if _USER_MEMORIES_CACHE is not None else (_read_json_encrypted(_USER_MEMORIES_FILE) or {})
-        user_key = str(user_id)
-        items = []
-        if isinstance(data, dict) and user_key in data:
-            items = data[user_key].get("summaries", [])
+        cached = _USER_MEMORIES_CACHE is not None
+        scope = str(user_id)
+        entry = _USER_MEMORIES_CACHE.get(scope) if cached else _read_user_memories(scope)
+        items = entry.get("summaries", []) if entry else []
     else:
-        data = _MEMORIES_CACHE if _MEMORIES_CACHE is not None else (_read_json_encrypted(MEMORIES_FILE) or {"summaries": []})
+        cached = _MEMORIES_CACHE is not None
+        data = _MEMORIES_CACHE if cached else (_read_memory_store(MEMORIES_FILE) or {"summaries": []})
+        scope = None
         items = data.get("summaries", [])
 
-    scored = []
-    for i, s in enumerate(items):
-        if isinstance(s, dict):
-            text = s.get("text", "")
-            emb_b64 = s.get("embedding", "")
-            if q_vec is None or not emb_b64:
-                score = 0.0
-            else:
-                try:
-                    emb_vec = _decode_embedding(emb_b64)
-                    score = _cosine(q_vec, emb_vec)
-                except Exception:
-                    score = 0.0
-        else:
-            text = s
-            score = 0.0
-        scored.append((i + 1, text, float(score)))
-    scored.sort(key=lambda x: x[2], reverse=True)
+    # the uncached path builds a throwaway index, so it is not worth training
+    index = _scope_index(scope, items) if cached else _build_index(items)
+    norm = np.linalg.norm(q_vec) if q_vec is not None and q_vec.ndim == 1 and q_vec.size == index.dim else 0
+    q_vec = q_vec / norm if norm else None
     results = []
-    for idx, text, score in scored[:top_k]:
-        results.append({"index": idx, "summary": text, "score": score})
+    for i, score in index.search(q_vec, top_k, exact=not cached):
+        s = items[i]
+        text = s.get("text", "") if isinstance(s, dict) else s
+        results.append({"index": i + 1, "summary": text, "score": score})
     return results
 
 def save_context(user_id: str, channel_id: str) -> None:
-    current_time = time.time()
-    context = storage.get_context() or {}
-    context[str(user_id)] = {"channel_id": channel_id, "timestamp": current_time}
-    storage.save_context(context)
+    storage.set_context_entry(user_id, channel_id, time.time())
 
 def get_channel_by_user(user_id: str):
-    context = storage.get_context() or {}
-    data = context.get(str(user_id), {})
+    data = storage.get_context_entry(user_id)
+    if isinstance(data, dict):
+        return data.get("channel_id", ""), data.get("timestamp", 0)
+    return "", 0
+
+async def aget_channel_by_user(user_id: str):
+    data = await storage.aget_context_entry(user_id)
     if isinstance(data, dict):
         return data.get("channel_id", ""), data.get("timestamp", 0)
     return "", 0
 
+def _set_cached_user_memories(user_key: str, entry) -> None:
+    if _USER_MEMORIES_CACHE is None:
+        return
+    if entry and (entry.get("summaries") or entry.get("memories")):
+        _USER_MEMORIES_CACHE[user_key] = entry
+    else:
+        _USER_MEMORIES_CACHE.pop(user_key, None)
+    _INDEXES.pop(user_key, None)
+
 def delete_user_memory(user_id: str, index: int) -> bool:
     try:
         idx = int(index)
@@ -384,36 +447,41 @@ def delete_user_memory(user_id: str, index: int) -> bool:
         return False
 
     key = str(user_id)
-    data = _read_json_encrypted(_USER_MEMORIES_FILE) or {}
-    if key not in data:
-        return False
-
-    usum = data[key].get("summaries", [])
-    umem = data[key].get("memories", [])
-
-    if 1 <= idx <= len(umem):
-        try:
-            umem.pop(idx - 1)
-            if idx - 1 < len(usum):
-                usum.pop(idx - 1)
-            data[key]["summaries"] = usum
-            data[key]["memories"] = umem
-            _write_json_encrypted(_USER_MEMORIES_FILE, data)
-            load_memory_cache()
+    with _CACHE_LOCK:
+        cached = _USER_MEMORIES_CACHE is not None
+        entry = _USER_MEMORIES_CACHE.get(key) if cached else _read_user_memories(key)
+        if entry is None:
+            return False
+
+        usum = entry.setdefault("summaries", [])
+        umem = entry.setdefault("memories", [])
+
+        if 1 <= idx <= len(umem):
+            if cached:
+                _delete_cached(key, entry, idx)
+                if not (usum or umem):
+                    _set_cached_user_memories(key, None)
+                _mark_dirty(key)
+            else:
+                umem.pop(idx - 1)
+                if idx - 1 < len(usum):
+                    usum.pop(idx - 1)
+                _write_user_memories(key, entry)
             return True
-        except Exception:
-            raise
     return False
 
 def delete_user_memories(user_id: str) -> bool:
     key = str(user_id)
-    data = _read_json_encrypted(_USER_MEMORIES_FILE) or {}
-    if key in data:
-        try:
-            del data[key]
-            _write_json_encrypted(_USER_MEMORIES_FILE, data)
-            load_memory_cache()
+    with _CACHE_LOCK:
+        if _USER_MEMORIES_CACHE is not None:
+            if _USER_MEMORIES_CACHE.get(key) is None:
+                return False
+            _set_cached_user_memories(key, None)
+            _mark_dirty(key)
             return True
-        except Exception:
-            raise
-    return False
\ No newline at end of file
+    if storage.get_user_memory_record(key) is not None:
+        _write_user_memories(key, None)
+        return True
+    return False
+
+atexit.register(flush_memory_cache)
\ No newline at end of file
@@ -55,7 +55,7 @@ class _ValueHolder:
 class Counter:
 	def __init__(self, key: str):
 		self.key = key
-		self._value = _ValueHolder(lambda: _load().get(self.key, 0))
+		self._value = _ValueHolder(lambda: (storage.get_json_view('metrics', {}) or {}).get(self.key, 0))
 
 	def inc(self, amount: int = 1):
 		with _LOCK:
@@ -127,7 +127,7 @@ def record_daily_metrics(day: Optional[str] = None, servers: Optional[int] = Non
 
 def get_metrics_history(days: int = 30, metric_type: str = "servers") -> Dict[str, int]:
 	try:
-		daily = storage.get_json(DAILY_METRICS_KEY, {})
+		daily = storage.get_json_view(DAILY_METRICS_KEY, {})
 		if not isinstance(daily, dict):
 			return {}
 		
@@ -152,7 +152,7 @@ def get_metrics_history(days: int = 30, metric_type: str = "servers") -> Dict[st
 
 def get_growth_stats() -> Dict:
 	try:
-		daily = storage.get_json(DAILY_METRICS_KEY, {})
+		daily = storage.get_json_view(DAILY_METRICS_KEY, {})
 		if not isinstance(daily, dict) or len(daily) < 2:
 			return {"available": False}
 		
@@ -22,5 +22,19 @@ def increase_nerdscore(user_id: int, amount: int = 1) -> int:
     return current
 
 def get_nerdscore(user_id: int) -> int:
-    scores = load_nerdscore()
-    return scores.get(str(user_id), 0)
\ No newline at end of file
+    scores = storage.view_nerdscore()
+    if not isinstance(scores, dict):
+        return 0
+    return scores.get(str(user_id), 0)
+
+
+async def aload_nerdscore() -> dict:
+    return await storage.aread(load_nerdscore)
+
+
+async def aincrease_nerdscore(user_id: int, amount: int = 1) -> int:
+    return await storage.arun(increase_nerdscore, user_id, amount)
+
+
+async def aget_nerdscore(user_id: int) -> int:
+    return await storage.aread(get_nerdscore, user_id)
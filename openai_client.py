@@ -1,10 +1,18 @@
 import asyncio
 import functools
+import hashlib
+import hmac
+import threading
+import time
+import unicodedata
 import requests
 import html
+import numpy as np
+from collections import OrderedDict
 from openai import OpenAI
 from openrouter import OpenRouter
-from config import MODEL, DEBUG, EMBED_MODEL, IMAGE_MODEL
+import storage
+from config import MODEL, DEBUG, EMBED_MODEL, IMAGE_MODEL, EMBED_CACHE_SIZE
 from credentials import ai_key
 
 _oai = OpenAI(api_key=ai_key, base_url="https://openrouter.ai/api/v1")
@@ -68,18 +76,134 @@ async def generate_response(messages, tools=None, tool_choice=None, model=MODEL,
     )
     return completion
 
-def embed_text(text: str) -> list:
+# (model, text hash) -> float32 embedding, most recently used last. misses fall back to the embedding_cache table,
+# which is only used when MEMORY_KEY is set
+_EMBED_CACHE = OrderedDict()
+_EMBED_CACHE_LOCK = threading.Lock()
+_EMBED_STATS = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'empty': 0, 'since': time.time()}
+
+def _normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", str(text)).split())
+
+def _embed_cache_key(text: str, key: bytes | None) -> tuple:
+    # keyed with the memory key so a stored hash cannot be matched against guessed messages
+    data = text.encode("utf-8")
+    digest = hmac.new(key, data, hashlib.sha256) if key else hashlib.sha256(data)
+    return EMBED_MODEL, digest.hexdigest()
+
+def _count(stat: str) -> None:
+    with _EMBED_CACHE_LOCK:
+        _EMBED_STATS[stat] += 1
+
+def _remember(key: tuple, vec: np.ndarray) -> None:
+    with _EMBED_CACHE_LOCK:
+        _EMBED_CACHE[key] = vec
+        _EMBED_CACHE.move_to_end(key)
+        while len(_EMBED_CACHE) > max(0, EMBED_CACHE_SIZE):
+            _EMBED_CACHE.popitem(last=False)
+
+def _lookup_cached(texts: list):
+    # fills in empty texts and RAM hits, returns the results plus the keys still to look up and where they go
+    results = [[] for _ in texts]
+    wanted = OrderedDict()
+    hash_key = storage._get_image_key()
+    for i, text in enumerate(texts):
+        text = _normalize_text(text or "")
+        if not text:
+            _count('empty')
+            continue
+        key = _embed_cache_key(text, hash_key)
+        with _EMBED_CACHE_LOCK:
+            vec = _EMBED_CACHE.get(key)
+            if vec is not None:
+                _EMBED_CACHE.move_to_end(key)
+                _EMBED_STATS['memory_hits'] += 1
+                results[i] = vec.tolist()
+                continue
+        wanted.setdefault(key, (text, []))[1].append(i)
+    return results, wanted
+
+def _fill(results: list, wanted: OrderedDict, key: tuple, vec: np.ndarray) -> None:
+    _remember(key, vec)
+    for i in wanted.pop(key)[1]:
+        results[i] = vec.tolist()
+
+def _fill_stored(results: list, wanted: OrderedDict, stored: dict) -> None:
+    for key in list(wanted):
+        if stored.get(key[1]):
+            _fill(results, wanted, key, np.frombuffer(stored[key[1]], dtype=np.float32))
+            _count('disk_hits')
+    with _EMBED_CACHE_LOCK:
+        _EMBED_STATS['misses'] += len(wanted)
+
+def _fill_generated(results: list, wanted: OrderedDict, res) -> None:
+    data = sorted(res.data, key=lambda d: d.index if d.index is not None else 0)
+    for key, item in zip(list(wanted), data):
+        vec = np.asarray(item.embedding, dtype=np.float32)
+        if not vec.size:
+            continue
+        _fill(results, wanted, key, vec)
+        try:
+            storage.save_cached_embedding(*key, vec.tobytes())
+        except Exception:
+            pass
+
+def embed_texts(texts: list) -> list:
+    """One embedding per text ([] for empty texts and failures), the uncached ones are requested together."""
+    results, wanted = _lookup_cached(texts)
+    if wanted:
+        _fill_stored(results, wanted, storage.get_cached_embeddings(EMBED_MODEL, [k[1] for k in wanted]))
+    if not wanted:
+        return results
+
+    inputs = [text for text, _ in wanted.values()]
     if DEBUG:
-        print(f"""Embedding text "{text}" with model: {EMBED_MODEL}""")
+        print(f"""Embedding texts {inputs} with model: {EMBED_MODEL}""")
 
     try:
         with OpenRouter(api_key=ai_key, timeout_ms=10000) as open_router: # Added timeout because this little shit kept freezing up my bot
-            res = open_router.embeddings.generate(input=text, model=EMBED_MODEL)
-            return res.data[0].embedding
+            res = open_router.embeddings.generate(input=inputs, model=EMBED_MODEL)
+        _fill_generated(results, wanted, res)
     except Exception as e:
         if DEBUG:
             print(f"embed_text failed: {e}")
-        return []
+    return results
+
+async def aembed_texts(texts: list) -> list:
+    results, wanted = _lookup_cached(texts)
+    if wanted:
+        stored = await storage.aread(storage.get_cached_embeddings, EMBED_MODEL, [k[1] for k in wanted])
+        _fill_stored(results, wanted, stored)
+    if not wanted:
+        return results
+
+    inputs = [text for text, _ in wanted.values()]
+    if DEBUG:
+        print(f"""Embedding texts {inputs} with model: {EMBED_MODEL}""")
+
+    try:
+        async with OpenRouter(api_key=ai_key, timeout_ms=10000) as open_router:
+            res = await open_router.embeddings.generate_async(input=inputs, model=EMBED_MODEL)
+        _fill_generated(results, wanted, res)
+    except Exception as e:
+        if DEBUG:
+            print(f"aembed_texts failed: {e}")
+    return results
+
+def embed_text(text: str) -> list:
+    return embed_texts([text])[0]
+
+async def aembed_text(text: str) -> list:
+    return (await aembed_texts([text]))[0]
+
+def embedding_cache_stats(reset: bool = False) -> dict:
+    with _EMBED_CACHE_LOCK:
+        stats = dict(_EMBED_STATS, entries=len(_EMBED_CACHE))
+        if reset:
+            _EMBED_STATS.update(memory_hits=0, disk_hits=0, misses=0, empty=0, since=time.time())
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+    return stats
 
 def get_subreddit_posts(subreddit: str, limit: int):
     url = f"https://www.reddit.com/r/{subreddit}/top.json?t=day&limit={limit}"
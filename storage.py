@@ -4,40 +4,799 @@ import threading
 import time
 import os
 import base64
+import struct
+import asyncio
+import atexit
+import bisect
+import functools
+import itertools
+import zlib
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from vector_index import pack_embedding, unpack_embedding, embedding_to_text, embedding_from_text
+from config import (
+    DATA_DIR, STORAGE_BACKEND, STORAGE_WRITE_WINDOW_MS, STORAGE_SYNCHRONOUS, STORAGE_CACHE_SIZE_KB, STORAGE_MMAP_SIZE, STORAGE_TEMP_STORE,
+    STORAGE_COMPRESS_MIN_BYTES, STORAGE_READ_WORKERS
+)
+
+_RPA_HISTORY_LIMIT = 10
+_QUESTION_HISTORY_LIMIT = 50
+# awaitable storage calls run on these so sqlite never blocks the event loop. writes keep one thread so they are
+# queued in the order the bot issued them, reads get a pool (each worker has its own read-only connection) so a slow
+# scan does not hold up the lookups behind it
+_IO_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-io")
+_READ_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, STORAGE_READ_WORKERS), thread_name_prefix="storage-read")
+
+# write-behind queue: dedup key -> (sql, params, value), committed in one transaction per window.
+# dedup keys are tuples starting with the table name; a trailing None means "never deduplicate"
+_PENDING = OrderedDict()
+_PENDING_TABLES = {}
+_PENDING_LOCK = threading.Lock()
+_PENDING_SEQ = itertools.count()
+# dedup key -> failed flush attempts of its queued write, the write is dropped after _MAX_WRITE_ATTEMPTS
+_PENDING_FAILURES = {}
+_MAX_WRITE_ATTEMPTS = 3
+_FLUSH_EVENT = threading.Event()
+_FLUSH_THREAD = None
+_MISSING = object()
+# writes buffered by an open transaction() on this thread
+_TXN = threading.local()
+
+# each domain is its own database with its own writer lock, connection and WAL,
+# so the append-heavy abuse log never waits on settings or memory writes
+_DOMAIN_FILES = {
+    'core': 'storage.db',
+    'abuse': 'abuse.db',
+    'memory': 'memory.db',
+    'metrics': 'metrics.db',
+}
+_TABLE_DOMAINS = {'abuse_tracking': 'abuse', 'blobs': 'memory', 'user_memories': 'memory', 'embedding_cache': 'memory'}
+_METRICS_KEYS = ('metrics', 'user_metrics', 'metrics_history', 'daily_metrics')
+
+
+class _Database:
+    def __init__(self, domain: str):
+        self.domain = domain
+        self.lock = threading.RLock()
+        self.conn = None
+        # reads use one read-only connection per thread so WAL lets them run alongside the writer
+        self.readers = threading.local()
+        self.reader_conns = []
+        self.generation = 0
+        self.last_write = 0.0
+
+    @property
+    def path(self):
+        return _BACKEND.path(self.domain)
+
+
+_DATABASES = {domain: _Database(domain) for domain in _DOMAIN_FILES}
+
+
+class SQLiteBackend:
+    # one WAL-mode SQLite file per domain under data_dir
+    name = 'sqlite'
+
+    def __init__(self, data_dir=None):
+        self.data_dir = Path(data_dir) if data_dir is not None else Path(DATA_DIR)
+
+    def path(self, domain: str):
+        return self.data_dir / _DOMAIN_FILES[domain]
+
+    def connect(self, domain: str) -> sqlite3.Connection:
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path(domain)), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        return conn
+
+    def connect_reader(self, domain: str):
+        uri = self.path(domain).resolve().as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+class MemoryBackend:
+    # RAM-only databases private to this process, nothing touches disk and everything is gone after close()
+    name = 'memory'
+
+    def path(self, domain: str):
+        return None
 
-_DB_PATH = Path("data") / "storage.db"
-_LOCK = threading.Lock()
-_CONN = None
-
+    def connect(self, domain: str) -> sqlite3.Connection:
+        return sqlite3.connect(":memory:", check_same_thread=False)
 
-def _get_conn():
-    global _CONN
-    if _CONN is None:
-        _DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-        _CONN = sqlite3.connect(str(_DB_PATH), check_same_thread=False)
-        _CONN.execute("PRAGMA journal_mode=WAL;")
-        _init_db(_CONN)
-    return _CONN
+    def connect_reader(self, domain: str):
+        # an in-memory database has a single connection, reads share it under the writer lock
+        return None
 
 
-def _init_db(conn: sqlite3.Connection):
+_BACKENDS = {'sqlite': SQLiteBackend, 'memory': MemoryBackend}
+
+
+def _make_backend(name: str):
+    name = str(name or 'sqlite').lower()
+    if name not in _BACKENDS:
+        raise ValueError(f"unknown storage backend: {name}")
+    return _BACKENDS[name]()
+
+
+_BACKEND = _make_backend(os.getenv("AI_NERD_STORAGE_BACKEND") or STORAGE_BACKEND)
+
+# per (op, name) counters for storage_stats(); name is the kv/blob key or the table
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+_STATS_SINCE = time.time()
+_LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+_CURRENT = threading.local()
+
+
+def _record(op: str, name: str, seconds: float, bytes_read: int = 0, bytes_written: int = 0, lock_wait: float = 0.0):
+    ms = seconds * 1000
+    with _STATS_LOCK:
+        st = _STATS.get((op, name))
+        if st is None:
+            st = _STATS[(op, name)] = {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'histogram': [0] * (len(_LATENCY_BUCKETS_MS) + 1),
+                'bytes_read': 0, 'bytes_written': 0, 'lock_wait_ms': 0.0
+            }
+        st['count'] += 1
+        st['total_ms'] += ms
+        st['max_ms'] = max(st['max_ms'], ms)
+        st['histogram'][bisect.bisect_left(_LATENCY_BUCKETS_MS, ms)] += 1
+        st['bytes_read'] += bytes_read
+        st['bytes_written'] += bytes_written
+        st['lock_wait_ms'] += lock_wait * 1000
+
+
+def _instrumented(op: str, table: str = None):
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            name = table or str(args[0] if args else kwargs.get('key'))
+            outer = getattr(_CURRENT, 'm', None)
+            m = _CURRENT.m = [0, 0, 0.0]
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _CURRENT.m = outer
+                _record(op, name, time.perf_counter() - start, *m)
+        return inner
+    return wrap
+
+
+def _add_bytes(read: int = 0, written: int = 0) -> None:
+    m = getattr(_CURRENT, 'm', None)
+    if m is not None:
+        m[0] += read
+        m[1] += written
+
+
+def _domain_for(table: str, key=None) -> str:
+    if table == 'kv' and key in _METRICS_KEYS:
+        return 'metrics'
+    return _TABLE_DOMAINS.get(table, 'core')
+
+
+def database_paths() -> list:
+    return [db.path for db in _DATABASES.values() if db.path is not None]
+
+
+def use_backend(backend):
+    # switches every domain to another backend (a name from _BACKENDS or an instance), returns the old one
+    global _BACKEND
+    if isinstance(backend, str):
+        backend = _make_backend(backend)
+    close()
+    previous, _BACKEND = _BACKEND, backend
+    invalidate_json()
+    return previous
+
+
+@contextmanager
+def _writer_lock(domain: str = 'core'):
+    start = time.perf_counter()
+    with _DATABASES[domain].lock:
+        m = getattr(_CURRENT, 'm', None)
+        if m is not None:
+            m[2] += time.perf_counter() - start
+        yield
+
+
+def _get_conn(domain: str = 'core'):
+    db = _DATABASES[domain]
+    if db.conn is None:
+        conn = _BACKEND.connect(domain)
+        _apply_pragmas(conn)
+        _init_db(conn, domain)
+        db.conn = conn
+    return db.conn
+
+
+def _read_conn(domain: str = 'core'):
+    db = _DATABASES[domain]
+    conn = getattr(db.readers, 'conn', None)
+    if conn is not None and db.readers.generation == db.generation:
+        return conn
+    with _writer_lock(domain):
+        _get_conn(domain)
+        conn = _BACKEND.connect_reader(domain)
+        if conn is None:
+            return None
+        _apply_pragmas(conn)
+        db.reader_conns.append(conn)
+        db.readers.conn = conn
+        db.readers.generation = db.generation
+    return conn
+
+
+@contextmanager
+def _read_cursor(domain: str = 'core'):
+    conn = _read_conn(domain)
+    if conn is None:
+        with _writer_lock(domain):
+            cur = _get_conn(domain).cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+        return
     cur = conn.cursor()
-    cur.execute("""
+    try:
+        yield cur
+    finally:
+        cur.close()
+
+
+def _synchronous_level() -> str:
+    level = str(STORAGE_SYNCHRONOUS or "NORMAL").upper()
+    return level if level in ("OFF", "NORMAL", "FULL", "EXTRA") else "NORMAL"
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    temp_store = str(STORAGE_TEMP_STORE or "DEFAULT").upper()
+    if temp_store not in ("DEFAULT", "FILE", "MEMORY"):
+        temp_store = "DEFAULT"
+    conn.execute(f"PRAGMA synchronous={_synchronous_level()};")
+    conn.execute(f"PRAGMA cache_size={-abs(int(STORAGE_CACHE_SIZE_KB or 2000))};")
+    conn.execute(f"PRAGMA mmap_size={max(0, int(STORAGE_MMAP_SIZE or 0))};")
+    conn.execute(f"PRAGMA temp_store={temp_store};")
+
+
+def _queue_write(dedup_key, sql: str, params=(), value=_MISSING) -> None:
+    global _FLUSH_THREAD
+    if dedup_key[-1] is None:
+        dedup_key = dedup_key[:-1] + (next(_PENDING_SEQ),)
+    txn = getattr(_TXN, 'writes', None)
+    if txn is not None:
+        txn.pop(dedup_key, None)
+        txn[dedup_key] = (sql, params, value)
+        return
+    domain = _domain_for(*dedup_key[:2])
+    _DATABASES[domain].last_write = time.time()
+    if STORAGE_WRITE_WINDOW_MS <= 0:
+        with _writer_lock(domain):
+            conn = _get_conn(domain)
+            conn.execute(sql, params)
+            conn.commit()
+        return
+    with _PENDING_LOCK:
+        if _PENDING.pop(dedup_key, None) is None:
+            _PENDING_TABLES[dedup_key[0]] = _PENDING_TABLES.get(dedup_key[0], 0) + 1
+        _PENDING[dedup_key] = (sql, params, value)
+        _PENDING_FAILURES.pop(dedup_key, None)
+        if _FLUSH_THREAD is None:
+            _FLUSH_THREAD = threading.Thread(target=_flush_loop, daemon=True, name="StorageWriteBehind")
+            _FLUSH_THREAD.start()
+    _FLUSH_EVENT.set()
+
+
+def _pending_value(dedup_key):
+    txn = getattr(_TXN, 'writes', None)
+    if txn is not None and dedup_key in txn:
+        return txn[dedup_key][2]
+    with _PENDING_LOCK:
+        entry = _PENDING.get(dedup_key)
+    return _MISSING if entry is None else entry[2]
+
+
+def _flush_table(table: str) -> None:
+    # scans only wait for queued writes to their own table
+    with _PENDING_LOCK:
+        if not _PENDING_TABLES.get(table):
+            return
+    flush(_domain_for(table))
+
+
+def _flush_loop():
+    while True:
+        _FLUSH_EVENT.wait()
+        time.sleep(STORAGE_WRITE_WINDOW_MS / 1000.0)
+        _FLUSH_EVENT.clear()
+        try:
+            flush()
+        except Exception as e:
+            # the batch stays queued and is retried by the next flush
+            print(f"Write-behind flush failed: {e}")
+
+
+def flush(domain: str = None) -> int:
+    return sum(_flush_domain(d) for d in ([domain] if domain else _DATABASES))
+
+
+@_instrumented('flush')
+def _flush_domain(domain: str, statements=()) -> int:
+    # queued writes go first; `statements` ride along in the same commit and roll everything back if one fails
+    with _writer_lock(domain):
+        with _PENDING_LOCK:
+            batch = [(k, e) for k, e in _PENDING.items() if _domain_for(*k[:2]) == domain]
+        if not batch and not statements:
+            return 0
+        conn = _get_conn(domain)
+        failed = set()
+        for key, (sql, params, _) in batch:
+            _add_bytes(written=sum(len(p) for p in params if isinstance(p, (str, bytes))))
+            try:
+                conn.execute(sql, params)
+            except Exception as e:
+                # a failed statement leaves the rest of the batch intact, its entry stays queued for the next flush
+                # until it has failed _MAX_WRITE_ATTEMPTS times
+                print(f"Queued write {key!r} failed: {e}")
+                failed.add(key)
+        try:
+            for sql, params in statements:
+                _add_bytes(written=sum(len(p) for p in params if isinstance(p, (str, bytes))))
+                conn.execute(sql, params)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        dropped = []
+        with _PENDING_LOCK:
+            for key, entry in batch:
+                if _PENDING.get(key) is not entry:
+                    continue
+                if key in failed:
+                    _PENDING_FAILURES[key] = _PENDING_FAILURES.get(key, 0) + 1
+                    if _PENDING_FAILURES[key] < _MAX_WRITE_ATTEMPTS:
+                        continue
+                    del _PENDING_FAILURES[key]
+                    dropped.append(key)
+                del _PENDING[key]
+                _PENDING_TABLES[key[0]] -= 1
+    for key in dropped:
+        print(f"Dropping queued write {key!r} after {_MAX_WRITE_ATTEMPTS} failed attempts")
+        # the cached document was written through and would otherwise keep serving the lost value
+        if key[0] == 'kv':
+            invalidate_json(key[1])
+    return len(batch) - len(failed)
+
+
+@contextmanager
+def transaction():
+    # collects the writes this thread makes inside the block and commits them when it exits, in one SQLite
+    # transaction per database file. nothing is written if the block raises. point reads inside the block see its
+    # writes, table scans do not.
+    # a block touching several domains is NOT atomic across them: the files commit one after another (in
+    # _DATABASES order), and if one fails the files before it stay committed. rollback hooks then only undo the
+    # in-memory state of the domains that did not commit, so memory keeps matching the files
+    if getattr(_TXN, 'writes', None) is not None:
+        yield
+        return
+    writes = _TXN.writes = OrderedDict()
+    undo = _TXN.undo = []
+    callbacks = _TXN.committed = []
+    done = set()
+    failed = None
+    try:
+        yield
+        _TXN.writes = None
+        by_domain = {}
+        for key, (sql, params, _) in writes.items():
+            by_domain.setdefault(_domain_for(*key[:2]), []).append((sql, params))
+        for domain in _DATABASES:
+            if domain in by_domain:
+                _DATABASES[domain].last_write = time.time()
+                _flush_domain(domain, by_domain[domain])
+            done.add(domain)
+    except BaseException as e:
+        failed = e
+        for domain, fn in reversed(undo):
+            if domain in done:
+                continue
+            try:
+                fn()
+            except Exception:
+                continue
+    finally:
+        _TXN.writes = _TXN.undo = _TXN.committed = None
+    for domain, fn in callbacks:
+        if (failed is None) if domain is None else domain in done:
+            try:
+                fn()
+            except Exception:
+                continue
+    if failed is not None:
+        raise failed
+
+
+def _on_rollback(fn, domain: str) -> None:
+    # fn undoes in-memory state that belongs to writes in `domain`
+    undo = getattr(_TXN, 'undo', None)
+    if undo is not None:
+        undo.append((domain, fn))
+
+
+def after_commit(fn, domain: str = None) -> None:
+    # runs fn once the current transaction has committed (never if it rolls back), right away outside of one.
+    # with a domain it runs as soon as that file has committed, even if a later file of the block fails
+    callbacks = getattr(_TXN, 'committed', None)
+    if callbacks is None:
+        fn()
+    else:
+        callbacks.append((domain, fn))
+
+
+def close() -> None:
+    global _BANS
+    try:
+        flush_image_touches()
+        flush()
+    finally:
+        for domain, db in _DATABASES.items():
+            with _writer_lock(domain):
+                db.generation += 1
+                for conn in db.reader_conns:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                db.reader_conns.clear()
+                if db.conn is not None:
+                    db.conn.close()
+                    db.conn = None
+        _BANS = None
+
+
+def checkpoint(mode: str = "PASSIVE", domain: str = None) -> dict:
+    mode = str(mode or "PASSIVE").upper()
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        mode = "PASSIVE"
+    results = {}
+    for d in ([domain] if domain else _DATABASES):
+        start = time.perf_counter()
+        with _writer_lock(d):
+            busy, wal_pages, checkpointed = _get_conn(d).execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        elapsed = time.perf_counter() - start
+        _record('checkpoint', d, elapsed)
+        results[d] = {
+            'mode': mode,
+            'busy': bool(busy),
+            'wal_pages': wal_pages,
+            'checkpointed_pages': checkpointed,
+            'duration_ms': round(elapsed * 1000, 3),
+        }
+    return results
+
+
+def database_info(domain: str = 'core') -> dict:
+    db = _DATABASES[domain]
+    with _writer_lock(domain):
+        conn = _get_conn(domain)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    path = db.path
+    wal = Path(f"{path}-wal") if path is not None else None
+    return {
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_count': freelist,
+        'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(auto_vacuum, str(auto_vacuum)),
+        'db_bytes': page_size * page_count,
+        'wal_bytes': wal.stat().st_size if wal is not None and wal.exists() else 0,
+        'idle_seconds': round(time.time() - db.last_write, 1) if db.last_write else None,
+    }
+
+
+def incremental_vacuum(domain: str = 'core', pages: int = 256) -> int:
+    # returns up to `pages` free pages to the filesystem, short enough to run between writes
+    start = time.perf_counter()
+    with _writer_lock(domain):
+        conn = _get_conn(domain)
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # execute() only steps the pragma once (one page); executescript runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({max(1, int(pages))});")
+        freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    _record('vacuum', domain, time.perf_counter() - start)
+    return freed
+
+
+def _switch_auto_vacuum(conn: sqlite3.Connection) -> bool:
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def enable_incremental_vacuum(domain: str = 'core') -> bool:
+    # rewrites the whole file once, every write to the domain waits for it
+    start = time.perf_counter()
+    with _writer_lock(domain):
+        switched = _switch_auto_vacuum(_get_conn(domain))
+    _record('vacuum_switch', domain, time.perf_counter() - start)
+    return switched
+
+
+atexit.register(close)
+
+
+# numbered schema migrations per domain, applied in order when its file is opened;
+# PRAGMA user_version holds the last applied one
+_MIGRATIONS = {domain: [] for domain in _DOMAIN_FILES}
+_MIGRATION_CHUNK = 5000
+
+
+def migration(version: int, domain: str = 'core'):
+    def register(fn):
+        _MIGRATIONS[domain].append((version, fn))
+        _MIGRATIONS[domain].sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def schema_version(domain: str = 'core') -> int:
+    with _read_cursor(domain) as cur:
+        cur.execute("PRAGMA user_version")
+        return int(cur.fetchone()[0])
+
+
+def _init_db(conn: sqlite3.Connection, domain: str = 'core'):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS migration_progress (
+        name TEXT PRIMARY KEY,
+        position INTEGER NOT NULL
+    )
+    """)
+    conn.commit()
+    current = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    for version, fn in _MIGRATIONS[domain]:
+        if version <= current:
+            continue
+        fn(conn)
+        conn.execute(f"PRAGMA user_version = {int(version)}")
+        conn.commit()
+        current = version
+    if domain == 'memory' and current >= 4:
+        _split_legacy_user_memories(conn)
+
+
+def _migrate_document(conn: sqlite3.Connection, key: str, to_rows, insert_sql: str):
+    # moves one kv JSON document into a table, one short transaction per chunk.
+    # progress is committed with each chunk so an interrupted run resumes where it stopped
+    row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+    if not row:
+        return
+    try:
+        rows = to_rows(json.loads(row[0]))
+    except Exception as e:
+        # kept under another key instead of being dropped, the table simply starts empty
+        unmigrated = f"{key}_unmigrated"
+        print(f"Could not migrate the {key!r} document, it is kept as {unmigrated!r}: {e}")
+        conn.execute("DELETE FROM kv WHERE key = ?", (unmigrated,))
+        conn.execute("UPDATE kv SET key = ? WHERE key = ?", (unmigrated, key))
+        conn.execute("DELETE FROM migration_progress WHERE name = ?", (key,))
+        return
+    done = conn.execute("SELECT position FROM migration_progress WHERE name = ?", (key,)).fetchone()
+    start = done[0] if done else 0
+    while start < len(rows):
+        chunk = rows[start:start + _MIGRATION_CHUNK]
+        conn.executemany(insert_sql, chunk)
+        start += len(chunk)
+        conn.execute("REPLACE INTO migration_progress (name, position) VALUES (?, ?)", (key, start))
+        conn.commit()
+    # only reached once every row is in the table
+    conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+    conn.execute("DELETE FROM migration_progress WHERE name = ?", (key,))
+
+
+@migration(1)
+def _create_base_tables(conn: sqlite3.Connection):
+    # blobs and abuse_tracking used to be created here too, they now live in their own files
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS kv (
         key TEXT PRIMARY KEY,
         value TEXT
     )
     """)
+
+
+@migration(2)
+def _create_row_tables(conn: sqlite3.Connection):
+    cur = conn.cursor()
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS blobs (
-        key TEXT PRIMARY KEY,
-        value BLOB
+    CREATE TABLE IF NOT EXISTS context_memory (
+        user_id TEXT PRIMARY KEY,
+        channel_id INTEGER,
+        timestamp REAL NOT NULL
     )
     """)
     cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_message_counts (
+        day TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id)
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS recent_freewill (
+        channel_id TEXT PRIMARY KEY,
+        message_id INTEGER
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS rpa_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        match TEXT NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_rpa_user_id ON rpa_history(user_id, id)
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS image_descriptions (
+        attach_id TEXT PRIMARY KEY,
+        description TEXT NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_image_last_used ON image_descriptions(last_used)
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS banned_users (
+        user_id INTEGER PRIMARY KEY,
+        notified INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+
+@migration(3)
+def _migrate_context_memory(conn: sqlite3.Connection):
+    _migrate_document(
+        conn, 'context_memory',
+        lambda doc: [
+            (str(k), v.get('channel_id'), float(v.get('timestamp') or 0))
+            for k, v in doc.items() if isinstance(v, dict)
+        ],
+        "INSERT OR REPLACE INTO context_memory (user_id, channel_id, timestamp) VALUES (?, ?, ?)"
+    )
+
+
+@migration(4)
+def _migrate_daily_message_counts(conn: sqlite3.Connection):
+    def to_rows(doc):
+        rows = []
+        for day, users in doc.items():
+            if str(day).startswith('_') or not isinstance(users, dict):
+                continue
+            for uid, count in users.items():
+                try:
+                    rows.append((str(day), str(uid), int(count)))
+                except Exception:
+                    continue
+        return rows
+
+    _migrate_document(
+        conn, 'daily_message_counts', to_rows,
+        "INSERT OR REPLACE INTO daily_message_counts (day, user_id, count) VALUES (?, ?, ?)"
+    )
+
+
+@migration(5)
+def _migrate_recent_freewill(conn: sqlite3.Connection):
+    _migrate_document(
+        conn, 'recent_freewill',
+        lambda doc: [(str(k), v) for k, v in doc.items()],
+        "INSERT OR REPLACE INTO recent_freewill (channel_id, message_id) VALUES (?, ?)"
+    )
+
+
+@migration(6)
+def _migrate_rpa_history(conn: sqlite3.Connection):
+    def to_rows(doc):
+        rows = []
+        for uid, matches in doc.items():
+            if not isinstance(matches, list):
+                continue
+            rows.extend((str(uid), json.dumps(m, ensure_ascii=False)) for m in matches[-_RPA_HISTORY_LIMIT:])
+        return rows
+
+    _migrate_document(conn, 'rpa_history', to_rows, "INSERT INTO rpa_history (user_id, match) VALUES (?, ?)")
+
+
+@migration(7)
+def _migrate_image_descriptions(conn: sqlite3.Connection):
+    def to_rows(doc):
+        rows = []
+        for attach_id, ent in doc.items():
+            if not isinstance(ent, dict) or not ent.get('description'):
+                continue
+            try:
+                last_used = datetime.fromisoformat(ent.get('last_used'))
+                if last_used.tzinfo is None:
+                    last_used = last_used.replace(tzinfo=timezone.utc)
+                last_used = last_used.timestamp()
+            except Exception:
+                last_used = 0.0
+            rows.append((str(attach_id), ent['description'], last_used))
+        return rows
+
+    _migrate_document(
+        conn, 'image_descriptions', to_rows,
+        "INSERT OR REPLACE INTO image_descriptions (attach_id, description, last_used) VALUES (?, ?, ?)"
+    )
+
+
+@migration(8)
+def _migrate_banned_users(conn: sqlite3.Connection):
+    def to_rows(doc):
+        if isinstance(doc, list):
+            doc = {x: {} for x in doc}
+        rows = []
+        for uid, meta in doc.items():
+            try:
+                rows.append((int(uid), 1 if isinstance(meta, dict) and meta.get('notified') else 0))
+            except Exception:
+                continue
+        return rows
+
+    _migrate_document(
+        conn, 'banned_users', to_rows,
+        "INSERT OR REPLACE INTO banned_users (user_id, notified) VALUES (?, ?)"
+    )
+
+
+@migration(9)
+def _add_codec_columns(conn: sqlite3.Connection):
+    # rows written before compression existed keep codec NULL and are read as-is
+    for table in ('kv', 'blobs'):
+        columns = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+        if columns and 'codec' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN codec TEXT")
+
+
+def _import_from_core(conn: sqlite3.Connection, table: str, copy):
+    # before the split every table lived in storage.db, move this domain's rows out of it
+    core = _DATABASES['core'].path
+    if core is None or not core.exists():
+        return
+    conn.execute("ATTACH DATABASE ? AS legacy", (str(core),))
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if exists:
+            columns = [r[1] for r in conn.execute(f"PRAGMA legacy.table_info({table})")]
+            copy(columns)
+            conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE legacy")
+
+
+@migration(1, 'abuse')
+def _create_abuse_tables(conn: sqlite3.Connection):
+    cur = conn.cursor()
+    cur.execute("""
     CREATE TABLE IF NOT EXISTS abuse_tracking (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
@@ -53,52 +812,513 @@ def _init_db(conn: sqlite3.Connection):
     cur.execute("""
     CREATE INDEX IF NOT EXISTS idx_abuse_timestamp ON abuse_tracking(timestamp)
     """)
+
+
+@migration(2, 'abuse')
+def _import_core_abuse_tracking(conn: sqlite3.Connection):
+    def copy(columns):
+        # ids are kept, so an interrupted copy resumes after the highest id already moved
+        while True:
+            last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM abuse_tracking").fetchone()[0]
+            moved = conn.execute(
+                "INSERT INTO abuse_tracking (id, user_id, content_hash, content_len, timestamp, created_at) "
+                "SELECT id, user_id, content_hash, content_len, timestamp, created_at FROM legacy.abuse_tracking "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (last, _MIGRATION_CHUNK)
+            ).rowcount
+            conn.commit()
+            if moved < _MIGRATION_CHUNK:
+                break
+        conn.execute("DROP TABLE legacy.abuse_tracking")
+
+    _import_from_core(conn, 'abuse_tracking', copy)
+
+
+@migration(1, 'memory')
+def _create_memory_tables(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        key TEXT PRIMARY KEY,
+        value BLOB,
+        codec TEXT
+    )
+    """)
+
+
+@migration(2, 'memory')
+def _import_core_blobs(conn: sqlite3.Connection):
+    def copy(columns):
+        codec = 'codec' if 'codec' in columns else 'NULL'
+        conn.execute(f"INSERT OR REPLACE INTO blobs (key, value, codec) SELECT key, value, {codec} FROM legacy.blobs")
+        conn.commit()
+        conn.execute("DROP TABLE legacy.blobs")
+
+    _import_from_core(conn, 'blobs', copy)
+
+
+@migration(1, 'metrics')
+def _create_metrics_tables(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        codec TEXT
+    )
+    """)
+
+
+@migration(2, 'metrics')
+def _import_core_metrics(conn: sqlite3.Connection):
+    def copy(columns):
+        codec = 'codec' if 'codec' in columns else 'NULL'
+        marks = ", ".join("?" * len(_METRICS_KEYS))
+        conn.execute(
+            f"INSERT OR REPLACE INTO kv (key, value, codec) SELECT key, value, {codec} FROM legacy.kv WHERE key IN ({marks})",
+            _METRICS_KEYS
+        )
+        conn.commit()
+        conn.execute(f"DELETE FROM legacy.kv WHERE key IN ({marks})", _METRICS_KEYS)
+
+    _import_from_core(conn, 'kv', copy)
+
+
+# files up to this size switch to incremental auto_vacuum when the migration runs, larger ones are left to
+# enable_incremental_vacuum (maintenance runs it in a quiet period when STORAGE_AUTO_VACUUM_SWITCH is set)
+_AUTO_VACUUM_MIGRATION_MAX_BYTES = 8 * 1024 * 1024
+
+
+def _enable_incremental_vacuum(conn: sqlite3.Connection):
+    # lets maintenance hand free pages back a few at a time. switching needs a VACUUM that rewrites the file, which
+    # would hold up startup on a large existing database
+    size = conn.execute("PRAGMA page_size").fetchone()[0] * conn.execute("PRAGMA page_count").fetchone()[0]
+    if size <= _AUTO_VACUUM_MIGRATION_MAX_BYTES:
+        _switch_auto_vacuum(conn)
+
+
+for _domain, _version in (('core', 10), ('abuse', 3), ('memory', 3), ('metrics', 3)):
+    migration(_version, _domain)(_enable_incremental_vacuum)
+
+
+def _unit_embedding(vec):
+    try:
+        arr = np.asarray(vec, dtype=np.float32).ravel()
+    except Exception:
+        return None
+    norm = float(np.linalg.norm(arr)) if arr.size else 0.0
+    return arr / norm if norm else None
+
+
+def _pack_float32_embedding(vec):
+    # the question_embeddings layout before migration 12
+    arr = _unit_embedding(vec)
+    return None if arr is None else arr.tobytes()
+
+
+def _pack_embedding(vec):
+    # unit length, stored as int8 codes with a per-vector scale (see vector_index.pack_embedding)
+    arr = _unit_embedding(vec)
+    return None if arr is None else pack_embedding(arr)
+
+
+@migration(11)
+def _create_question_embeddings(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS question_embeddings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        genre TEXT NOT NULL,
+        question TEXT NOT NULL,
+        embedding BLOB
+    )
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_question_user_genre ON question_embeddings(user_id, genre, id)
+    """)
+
+    def to_rows(doc):
+        rows = []
+        for uid, genres in doc.items():
+            if not isinstance(genres, dict):
+                continue
+            for genre, entries in genres.items():
+                if not isinstance(entries, list):
+                    continue
+                for e in entries[-_QUESTION_HISTORY_LIMIT:]:
+                    if isinstance(e, dict) and e.get('q'):
+                        rows.append((str(uid), str(genre), e['q'], _pack_float32_embedding(e.get('emb'))))
+        return rows
+
+    _migrate_document(
+        conn, 'recent_questions', to_rows,
+        "INSERT INTO question_embeddings (user_id, genre, question, embedding) VALUES (?, ?, ?, ?)"
+    )
+
+
+@migration(12)
+def _quantize_question_embeddings(conn: sqlite3.Connection):
+    # every stored row is still unit float32 at this point
+    rows = conn.execute("SELECT id, embedding FROM question_embeddings WHERE embedding IS NOT NULL").fetchall()
+    conn.executemany(
+        "UPDATE question_embeddings SET embedding = ? WHERE id = ?",
+        [(_pack_embedding(np.frombuffer(blob, dtype=np.float32)), row_id) for row_id, blob in rows]
+    )
+
+
+@migration(4, 'memory')
+def _split_user_memories(conn: sqlite3.Connection):
+    # one encrypted row per user instead of the single user_memories_enc blob holding everyone
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_memories (
+        user_id TEXT PRIMARY KEY,
+        value BLOB NOT NULL
+    )
+    """)
+    _split_legacy_user_memories(conn)
+
+
+def _split_legacy_user_memories(conn: sqlite3.Connection):
+    # without MEMORY_KEY the old blob cannot be re-encrypted per user, it is kept and split by _init_db on a later
+    # start instead of failing the memory database
+    row = conn.execute("SELECT value, codec FROM blobs WHERE key = 'user_memories_enc'").fetchone()
+    if not row or not row[0]:
+        return
+    key = _get_image_key()
+    if not key:
+        return
+    raw = _decompress(row[0], row[1])
+    try:
+        data = json.loads(_decrypt_record(raw, key))
+    except Exception:
+        try:
+            data = json.loads(raw)
+        except Exception:
+            return
+    if not isinstance(data, dict):
+        return
+    rows = []
+    for uid, entry in data.items():
+        if not isinstance(entry, dict) or not (entry.get('summaries') or entry.get('memories')):
+            continue
+        plain = {'summaries': entry.get('summaries') or [], 'memories': entry.get('memories') or []}
+        rows.append((str(uid), _encrypt_record(json.dumps(plain, ensure_ascii=False).encode('utf-8'), key)))
+    # rows written since the blob was kept are newer than it
+    conn.executemany("INSERT OR IGNORE INTO user_memories (user_id, value) VALUES (?, ?)", rows)
+    conn.execute("DELETE FROM blobs WHERE key = 'user_memories_enc'")
     conn.commit()
 
 
+@migration(5, 'memory')
+def _create_embedding_cache(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        model TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (model, text_hash)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used)")
+
+
+@migration(6, 'memory')
+def _clear_plain_embedding_cache(conn: sqlite3.Connection):
+    # earlier rows hold unencrypted embeddings under a plain sha256 of the text, the cache refills itself
+    conn.execute("DELETE FROM embedding_cache")
+
+
+def _compress(data: bytes):
+    if not STORAGE_COMPRESS_MIN_BYTES or len(data) < STORAGE_COMPRESS_MIN_BYTES:
+        return None
+    packed = zlib.compress(data, 6)
+    # already dense values (encrypted blobs) are not worth the decompression cost
+    if len(packed) > len(data) * 0.9:
+        return None
+    return packed
+
+
+def _decompress(value, codec):
+    if codec == 'zlib':
+        return zlib.decompress(value)
+    if codec:
+        raise ValueError(f"unknown storage codec: {codec}")
+    return value
+
+
+class FrozenDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("cached storage values are read-only, use get_json() for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+class FrozenList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("cached storage values are read-only, use get_json() for a mutable copy")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = remove = pop = clear = sort = reverse = _readonly
+
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(_freeze(v) for v in obj)
+    return obj
+
+
+def _thaw(obj):
+    if isinstance(obj, dict):
+        return {k: _thaw(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_thaw(v) for v in obj]
+    return obj
+
+
+# decoded kv values: key -> frozen object (or _MISSING when the key does not exist)
+_CACHE = {}
+_CACHE_VERSIONS = {}
+_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+
+def _decode_kv(value, codec) -> str:
+    _add_bytes(read=len(value))
+    raw = _decompress(value, codec)
+    return raw.decode('utf-8') if isinstance(raw, bytes) else raw
+
+
+def _cached_json(key: str):
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE_STATS['hits'] += 1
+            return _CACHE[key]
+        _CACHE_STATS['misses'] += 1
+        version = _CACHE_VERSIONS.get(key, 0)
+    raw = _pending_value(('kv', key))
+    if raw is _MISSING:
+        with _read_cursor(_domain_for('kv', key)) as cur:
+            cur.execute("SELECT value, codec FROM kv WHERE key = ?", (key,))
+            row = cur.fetchone()
+        if row:
+            raw = _decode_kv(*row)
+    value = _MISSING if raw is _MISSING else _freeze(json.loads(raw))
+    with _CACHE_LOCK:
+        # a set_json that raced with this read wins
+        if _CACHE_VERSIONS.get(key, 0) == version:
+            _CACHE[key] = value
+    return value
+
+
+@_instrumented('get')
 def get_json(key: str, default=None):
     try:
-        with _LOCK:
-            cur = _get_conn().cursor()
-            cur.execute("SELECT value FROM kv WHERE key = ?", (key,))
-            row = cur.fetchone()
-            if not row:
-                return default
-            return json.loads(row[0])
+        value = _cached_json(key)
+        if value is _MISSING:
+            return default
+        return _thaw(value)
     except Exception:
         return default
 
 
+@_instrumented('get')
+def get_json_view(key: str, default=None):
+    try:
+        value = _cached_json(key)
+        if value is _MISSING:
+            return default
+        return value
+    except Exception:
+        return default
+
+
+@_instrumented('set')
 def set_json(key: str, obj) -> None:
     try:
         val = json.dumps(obj, ensure_ascii=False)
-        with _LOCK:
-            conn = _get_conn()
-            conn.execute("REPLACE INTO kv (key, value) VALUES (?, ?)", (key, val))
-            conn.commit()
+        frozen = _freeze(json.loads(val))
+        with _CACHE_LOCK:
+            _CACHE_VERSIONS[key] = _CACHE_VERSIONS.get(key, 0) + 1
+            _CACHE[key] = frozen
+        _on_rollback(lambda: invalidate_json(key), _domain_for('kv', key))
+        packed = _compress(val.encode('utf-8'))
+        _add_bytes(written=len(val) if packed is None else len(packed))
+        _queue_write(
+            ('kv', key),
+            "REPLACE INTO kv (key, value, codec) VALUES (?, ?, ?)",
+            (key, val, None) if packed is None else (key, packed, 'zlib'),
+            val
+        )
     except Exception:
         raise
 
 
+def get_many(keys, default=None, view: bool = False) -> dict:
+    # several kv documents with one query per database file; view=True returns read-only views like get_json_view.
+    # every key is recorded as a 'get' with its share of the batch time, the same rows get_json fills
+    keys = list(dict.fromkeys(keys))
+    outer = getattr(_CURRENT, 'm', None)
+    m = _CURRENT.m = [0, 0, 0.0]
+    start = time.perf_counter()
+    read = {}
+    try:
+        values, versions, by_domain = {}, {}, {}
+        with _CACHE_LOCK:
+            for key in keys:
+                if key in _CACHE:
+                    _CACHE_STATS['hits'] += 1
+                    values[key] = _CACHE[key]
+                else:
+                    _CACHE_STATS['misses'] += 1
+                    versions[key] = _CACHE_VERSIONS.get(key, 0)
+        for key in versions:
+            raw = _pending_value(('kv', key))
+            if raw is _MISSING:
+                by_domain.setdefault(_domain_for('kv', key), []).append(key)
+            else:
+                values[key] = _freeze(json.loads(raw))
+        for domain, domain_keys in by_domain.items():
+            with _read_cursor(domain) as cur:
+                cur.execute(
+                    f"SELECT key, value, codec FROM kv WHERE key IN ({','.join('?' * len(domain_keys))})", domain_keys
+                )
+                rows = cur.fetchall()
+            for key, value, codec in rows:
+                read[key] = len(value)
+                values[key] = _freeze(json.loads(_decode_kv(value, codec)))
+        with _CACHE_LOCK:
+            for key, version in versions.items():
+                if _CACHE_VERSIONS.get(key, 0) == version:
+                    _CACHE[key] = values.setdefault(key, _MISSING)
+    except Exception:
+        values = None
+    finally:
+        _CURRENT.m = outer
+    if values is None:
+        # get_json records these lookups itself
+        return {key: (get_json_view if view else get_json)(key, default) for key in keys}
+    if keys:
+        share = (time.perf_counter() - start) / len(keys)
+        for key in keys:
+            _record('get', key, share, read.get(key, 0), 0, m[2] / len(keys))
+    out = {}
+    for key in keys:
+        value = values.get(key, _MISSING)
+        if value is _MISSING:
+            out[key] = default
+        else:
+            out[key] = value if view else _thaw(value)
+    return out
+
+
+def set_many(items: dict) -> None:
+    with transaction():
+        for key, obj in items.items():
+            set_json(key, obj)
+
+
+def invalidate_json(key: str = None) -> None:
+    with _CACHE_LOCK:
+        if key is None:
+            for k in _CACHE:
+                _CACHE_VERSIONS[k] = _CACHE_VERSIONS.get(k, 0) + 1
+            _CACHE.clear()
+        else:
+            _CACHE_VERSIONS[key] = _CACHE_VERSIONS.get(key, 0) + 1
+            _CACHE.pop(key, None)
+
+
+def cache_stats() -> dict:
+    with _CACHE_LOCK:
+        hits = _CACHE_STATS['hits']
+        misses = _CACHE_STATS['misses']
+        keys = len(_CACHE)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'keys': keys,
+        'hit_rate': (hits / total) if total else 0.0
+    }
+
+
+def storage_stats(reset: bool = False) -> dict:
+    global _STATS_SINCE
+    with _STATS_LOCK:
+        stats = {k: dict(v, histogram=list(v['histogram'])) for k, v in _STATS.items()}
+        since = _STATS_SINCE
+        if reset:
+            _STATS.clear()
+            _STATS_SINCE = time.time()
+    with _PENDING_LOCK:
+        pending = len(_PENDING)
+    labels = [f"<={b}ms" for b in _LATENCY_BUCKETS_MS] + [f">{_LATENCY_BUCKETS_MS[-1]}ms"]
+
+    def percentile(histogram, count, q):
+        # upper bound of the bucket holding the q-th call
+        seen = 0
+        for i, n in enumerate(histogram):
+            seen += n
+            if seen >= q * count:
+                return _LATENCY_BUCKETS_MS[i] if i < len(_LATENCY_BUCKETS_MS) else None
+        return None
+
+    operations = []
+    for (op, name), st in stats.items():
+        count = st['count']
+        operations.append({
+            'op': op,
+            'name': name,
+            'count': count,
+            'total_ms': round(st['total_ms'], 3),
+            'avg_ms': round(st['total_ms'] / count, 3) if count else 0.0,
+            'max_ms': round(st['max_ms'], 3),
+            'p50_ms': percentile(st['histogram'], count, 0.5),
+            'p99_ms': percentile(st['histogram'], count, 0.99),
+            'bytes_read': st['bytes_read'],
+            'bytes_written': st['bytes_written'],
+            'lock_wait_ms': round(st['lock_wait_ms'], 3),
+            'histogram': dict(zip(labels, st['histogram'])),
+        })
+    operations.sort(key=lambda o: o['total_ms'], reverse=True)
+    return {
+        'since': since,
+        'operations': operations,
+        'cache': cache_stats(),
+        'pending_writes': pending,
+    }
+
+
+@_instrumented('get_blob')
 def get_blob(key: str):
     try:
-        with _LOCK:
-            cur = _get_conn().cursor()
-            cur.execute("SELECT value FROM blobs WHERE key = ?", (key,))
+        pending = _pending_value(('blobs', key))
+        if pending is not _MISSING:
+            return pending
+        with _read_cursor('memory') as cur:
+            cur.execute("SELECT value, codec FROM blobs WHERE key = ?", (key,))
             row = cur.fetchone()
             if not row:
                 return None
-            return row[0]
+            _add_bytes(read=len(row[0]))
+            return _decompress(row[0], row[1])
     except Exception:
         return None
 
 
+@_instrumented('set_blob')
 def set_blob(key: str, data: bytes) -> None:
     try:
-        with _LOCK:
-            conn = _get_conn()
-            conn.execute("REPLACE INTO blobs (key, value) VALUES (?, ?)", (key, data))
-            conn.commit()
+        packed = _compress(bytes(data)) if data is not None else None
+        _add_bytes(written=len(data or b'') if packed is None else len(packed))
+        _queue_write(
+            ('blobs', key),
+            "REPLACE INTO blobs (key, value, codec) VALUES (?, ?, ?)",
+            (key, data, None) if packed is None else (key, packed, 'zlib'),
+            data
+        )
     except Exception:
         raise
 
@@ -107,24 +1327,69 @@ def load_settings():
     return get_json('serversettings', {}) or {}
 
 
+def view_settings():
+    return get_json_view('serversettings', {}) or {}
+
+
 def save_settings(settings: dict):
     set_json('serversettings', settings or {})
 
 
+@_instrumented('scan', 'daily_message_counts')
 def load_daily_counts():
-    return get_json('daily_message_counts', {}) or {}
+    try:
+        _flush_table('daily_message_counts')
+        with _read_cursor() as cur:
+            cur.execute("SELECT day, user_id, count FROM daily_message_counts")
+            rows = cur.fetchall()
+    except Exception:
+        return {}
+    out = {}
+    for day, uid, count in rows:
+        out.setdefault(day, {})[uid] = count
+    return out
 
 
+@_instrumented('replace', 'daily_message_counts')
 def save_daily_counts(data: dict):
-    set_json('daily_message_counts', data or {})
-
-
-def load_recent_questions():
-    return get_json('recent_questions', {}) or {}
-
-
-def save_recent_questions(data: dict):
-    set_json('recent_questions', data or {})
+    rows = []
+    for day, users in (data or {}).items():
+        if str(day).startswith('_') or not isinstance(users, dict):
+            continue
+        for uid, count in users.items():
+            rows.append((str(day), str(uid), int(count)))
+    flush()
+    with _writer_lock():
+        conn = _get_conn()
+        conn.execute("DELETE FROM daily_message_counts")
+        conn.executemany("INSERT INTO daily_message_counts (day, user_id, count) VALUES (?, ?, ?)", rows)
+        conn.commit()
+
+
+_DAILY_COUNT_LOCK = threading.Lock()
+
+
+@_instrumented('increment', 'daily_message_counts')
+def increment_daily_count(user_id, day: str) -> int:
+    uid = str(user_id)
+    key = ('daily_message_counts', day, uid)
+    with _DAILY_COUNT_LOCK:
+        count = _pending_value(key)
+        if count is _MISSING:
+            with _read_cursor() as cur:
+                row = cur.execute(
+                    "SELECT count FROM daily_message_counts WHERE day = ? AND user_id = ?", (day, uid)
+                ).fetchone()
+            count = row[0] if row else 0
+        count += 1
+        _queue_write(('daily_message_counts', 'prune', day), "DELETE FROM daily_message_counts WHERE day < ?", (day,))
+        _queue_write(
+            key,
+            "REPLACE INTO daily_message_counts (day, user_id, count) VALUES (?, ?, ?)",
+            (day, uid, count),
+            count
+        )
+    return count
 
 
 def load_daily_quiz_records():
@@ -139,6 +1404,10 @@ def load_nerdscore():
     return get_json('nerdscore', {}) or {}
 
 
+def view_nerdscore():
+    return get_json_view('nerdscore', {}) or {}
+
+
 def save_nerdscore(data: dict):
     set_json('nerdscore', data or {})
 
@@ -159,20 +1428,103 @@ def save_user_metrics(data: dict):
     set_json('user_metrics', data or {})
 
 
+@_instrumented('scan', 'recent_freewill')
 def get_freewill_attempts():
-    return get_json('recent_freewill', {}) or {}
+    try:
+        _flush_table('recent_freewill')
+        with _read_cursor() as cur:
+            cur.execute("SELECT channel_id, message_id FROM recent_freewill")
+            return {row[0]: row[1] for row in cur.fetchall()}
+    except Exception:
+        return {}
 
 
+@_instrumented('replace', 'recent_freewill')
 def save_freewill_attempts(data: dict):
-    set_json('recent_freewill', data or {})
+    flush()
+    with _writer_lock():
+        conn = _get_conn()
+        conn.execute("DELETE FROM recent_freewill")
+        conn.executemany(
+            "INSERT INTO recent_freewill (channel_id, message_id) VALUES (?, ?)",
+            [(str(k), v) for k, v in (data or {}).items()]
+        )
+        conn.commit()
+
+
+@_instrumented('get', 'recent_freewill')
+def get_freewill_attempt(channel_id):
+    try:
+        pending = _pending_value(('recent_freewill', str(channel_id)))
+        if pending is not _MISSING:
+            return pending
+        with _read_cursor() as cur:
+            cur.execute("SELECT message_id FROM recent_freewill WHERE channel_id = ?", (str(channel_id),))
+            row = cur.fetchone()
+            return row[0] if row else None
+    except Exception:
+        return None
+
+
+@_instrumented('set', 'recent_freewill')
+def set_freewill_attempt(channel_id, message_id) -> None:
+    _queue_write(
+        ('recent_freewill', str(channel_id)),
+        "REPLACE INTO recent_freewill (channel_id, message_id) VALUES (?, ?)",
+        (str(channel_id), message_id),
+        message_id
+    )
 
 
+@_instrumented('scan', 'context_memory')
 def get_context():
-    return get_json('context_memory', {}) or {}
+    try:
+        _flush_table('context_memory')
+        with _read_cursor() as cur:
+            cur.execute("SELECT user_id, channel_id, timestamp FROM context_memory")
+            return {row[0]: {'channel_id': row[1], 'timestamp': row[2]} for row in cur.fetchall()}
+    except Exception:
+        return {}
 
 
+@_instrumented('replace', 'context_memory')
 def save_context(data: dict):
-    set_json('context_memory', data or {})
+    rows = [
+        (str(k), v.get('channel_id'), float(v.get('timestamp') or 0))
+        for k, v in (data or {}).items() if isinstance(v, dict)
+    ]
+    flush()
+    with _writer_lock():
+        conn = _get_conn()
+        conn.execute("DELETE FROM context_memory")
+        conn.executemany("INSERT INTO context_memory (user_id, channel_id, timestamp) VALUES (?, ?, ?)", rows)
+        conn.commit()
+
+
+@_instrumented('get', 'context_memory')
+def get_context_entry(user_id):
+    try:
+        pending = _pending_value(('context_memory', str(user_id)))
+        if pending is not _MISSING:
+            return dict(pending)
+        with _read_cursor() as cur:
+            cur.execute("SELECT channel_id, timestamp FROM context_memory WHERE user_id = ?", (str(user_id),))
+            row = cur.fetchone()
+            if not row:
+                return None
+            return {'channel_id': row[0], 'timestamp': row[1]}
+    except Exception:
+        return None
+
+
+@_instrumented('set', 'context_memory')
+def set_context_entry(user_id, channel_id, timestamp: float) -> None:
+    _queue_write(
+        ('context_memory', str(user_id)),
+        "REPLACE INTO context_memory (user_id, channel_id, timestamp) VALUES (?, ?, ?)",
+        (str(user_id), channel_id, timestamp),
+        {'channel_id': channel_id, 'timestamp': timestamp}
+    )
 
 
 def get_blob_key_for_path(path_name: str) -> str:
@@ -195,16 +1547,75 @@ def set_encrypted_blob_for_path(path_name: str, data: bytes):
 def load_knowledge():
     return get_json('knowledge_data', {}) or {}
 
+def view_knowledge():
+    return get_json_view('knowledge_data', {}) or {}
+
 def save_knowledge(data: dict):
     set_json('knowledge_data', data or {})
 
 
+# authoritative in-process copy of banned_users: user_id -> {'notified': bool}
+_BANS = None
+_BANS_LOCK = threading.Lock()
+
+
+def _bans() -> dict:
+    global _BANS
+    if _BANS is None:
+        with _BANS_LOCK:
+            if _BANS is None:
+                _flush_table('banned_users')
+                with _read_cursor() as cur:
+                    cur.execute("SELECT user_id, notified FROM banned_users")
+                    _BANS = {int(uid): {'notified': bool(notified)} for uid, notified in cur.fetchall()}
+    return _BANS
+
+
+def _write_ban(user_id: int, meta) -> None:
+    if meta is None:
+        _queue_write(('banned_users', user_id), "DELETE FROM banned_users WHERE user_id = ?", (user_id,))
+    else:
+        _queue_write(
+            ('banned_users', user_id),
+            "REPLACE INTO banned_users (user_id, notified) VALUES (?, ?)",
+            (user_id, 1 if meta.get('notified') else 0)
+        )
+
+
+def is_banned(user_id: int) -> bool:
+    try:
+        return int(user_id) in _bans()
+    except Exception:
+        return False
+
+
+def ban_user(user_id: int) -> bool:
+    user_id = int(user_id)
+    bans = _bans()
+    with _BANS_LOCK:
+        if user_id in bans:
+            return False
+        bans[user_id] = {'notified': False}
+        _write_ban(user_id, bans[user_id])
+    _on_rollback(lambda: bans.pop(user_id, None), _domain_for('banned_users'))
+    return True
+
+
+def unban_user(user_id: int) -> bool:
+    user_id = int(user_id)
+    bans = _bans()
+    with _BANS_LOCK:
+        meta = bans.pop(user_id, None)
+        if meta is None:
+            return False
+        _write_ban(user_id, None)
+    _on_rollback(lambda: bans.setdefault(user_id, meta), _domain_for('banned_users'))
+    return True
+
+
 def load_banned_users():
-    data = get_json('banned_users', []) or []
     try:
-        if isinstance(data, dict):
-            return [int(k) for k in data.keys()]
-        return [int(x) for x in data]
+        return list(_bans().keys())
     except Exception:
         return []
 
@@ -214,49 +1625,52 @@ def save_banned_users(user_list):
         data = [int(x) for x in (user_list or [])]
     except Exception:
         data = []
-    set_json('banned_users', data)
+    current = load_banned_map()
+    save_banned_map({uid: current.get(uid, {'notified': False}) for uid in data})
 
 
 def load_banned_map():
-    raw = get_json('banned_users', {}) or {}
     try:
-        if isinstance(raw, dict):
-            out = {}
-            for k, v in raw.items():
-                try:
-                    out[int(k)] = v or {}
-                except Exception:
-                    continue
-            return out
-        if isinstance(raw, list):
-            return {int(x): {'notified': False} for x in raw}
+        bans = _bans()
+        with _BANS_LOCK:
+            return {uid: dict(meta) for uid, meta in bans.items()}
     except Exception:
-        pass
-    return {}
+        return {}
 
 
 def save_banned_map(banned_map: dict):
     try:
-        serial = {str(int(k)): (v or {}) for k, v in (banned_map or {}).items()}
-        set_json('banned_users', serial)
+        wanted = {int(k): {'notified': bool((v or {}).get('notified'))} for k, v in (banned_map or {}).items()}
+        bans = _bans()
+        # only the rows that changed are written
+        with _BANS_LOCK:
+            for uid in [uid for uid in bans if uid not in wanted]:
+                del bans[uid]
+                _write_ban(uid, None)
+            for uid, meta in wanted.items():
+                if bans.get(uid) != meta:
+                    bans[uid] = meta
+                    _write_ban(uid, meta)
     except Exception:
         raise
 
 
 def mark_banned_user_notified(user_id: int):
     try:
-        bm = load_banned_map()
-        if int(user_id) in bm:
-            bm[int(user_id)]['notified'] = True
-            save_banned_map(bm)
+        user_id = int(user_id)
+        bans = _bans()
+        with _BANS_LOCK:
+            meta = bans.get(user_id)
+            if meta is not None and not meta.get('notified'):
+                meta['notified'] = True
+                _write_ban(user_id, meta)
     except Exception:
         pass
 
 
 def is_banned_user_notified(user_id: int) -> bool:
     try:
-        bm = load_banned_map()
-        meta = bm.get(int(user_id))
+        meta = _bans().get(int(user_id))
         if not meta:
             return False
         return bool(meta.get('notified'))
@@ -277,6 +1691,124 @@ def _get_image_key() -> bytes | None:
         return None
 
 
+def _encrypt_record(plaintext: bytes, key: bytes) -> bytes:
+    # legacy layout of memory records: urlsafe base64 of nonce + ciphertext
+    nonce = os.urandom(12)
+    return base64.urlsafe_b64encode(nonce + AESGCM(key).encrypt(nonce, plaintext, None))
+
+
+def _decrypt_record(data: bytes, key: bytes) -> bytes:
+    raw = base64.urlsafe_b64decode(data)
+    if len(raw) < 12:
+        raise ValueError("Invalid encrypted data")
+    return AESGCM(key).decrypt(raw[:12], raw[12:], None)
+
+
+# memory records (the global memories blob and the user_memories rows) are _MEMORY_RECORD_MAGIC, a version byte, the
+# nonce and the raw AES-GCM ciphertext of a packed record, with the header as associated data. the packed record is the
+# summary count, each summary's text and embedding (float32 scale + int8 codes, empty without one), the memory count
+# and the memories, every count and length a little-endian uint32. values without the magic are legacy records, JSON
+# documents stored as _encrypt_record or in plain text
+_MEMORY_RECORD_MAGIC = b'\x00AIM'
+_MEMORY_RECORD_VERSION = 1
+_U32 = struct.Struct('<I')
+
+
+def _pack_memory_record(data: dict) -> bytes:
+    summaries = list(data.get('summaries') or [])
+    memories = list(data.get('memories') or [])
+    parts = [_U32.pack(len(summaries))]
+    for s in summaries:
+        if isinstance(s, dict):
+            text, emb = s.get('text') or '', s.get('embedding') or b''
+        else:
+            text, emb = s or '', b''
+        if isinstance(emb, str):
+            emb = embedding_from_text(emb)
+        text = str(text).encode('utf-8')
+        parts += (_U32.pack(len(text)), text, _U32.pack(len(emb)), emb)
+    parts.append(_U32.pack(len(memories)))
+    for m in memories:
+        m = str(m).encode('utf-8')
+        parts += (_U32.pack(len(m)), m)
+    return b''.join(parts)
+
+
+def _unpack_memory_record(plain: bytes) -> dict:
+    unpack, end = _U32.unpack_from, len(plain)
+    pos = 4
+    summaries = []
+    for _ in range(unpack(plain, 0)[0]):
+        n = unpack(plain, pos)[0]
+        text = plain[pos + 4:pos + 4 + n].decode('utf-8')
+        pos += 4 + n
+        n = unpack(plain, pos)[0]
+        summaries.append({'text': text, 'embedding': plain[pos + 4:pos + 4 + n]})
+        pos += 4 + n
+    memories = []
+    count = unpack(plain, pos)[0]
+    pos += 4
+    for _ in range(count):
+        n = unpack(plain, pos)[0]
+        memories.append(plain[pos + 4:pos + 4 + n].decode('utf-8'))
+        pos += 4 + n
+    if pos != end:
+        raise ValueError("Invalid memory record")
+    return {'summaries': summaries, 'memories': memories}
+
+
+def _seal_memory_record(data: dict, key: bytes) -> bytes:
+    header = _MEMORY_RECORD_MAGIC + bytes([_MEMORY_RECORD_VERSION])
+    nonce = os.urandom(12)
+    return header + nonce + AESGCM(key).encrypt(nonce, _pack_memory_record(data), header)
+
+
+def _is_sealed_memory_record(value) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:len(_MEMORY_RECORD_MAGIC)]) == _MEMORY_RECORD_MAGIC
+
+
+def _open_memory_record(value: bytes, key) -> dict:
+    """Decodes a packed or legacy memory record, summaries always come back as {'text', 'embedding'} with packed embeddings."""
+    # a decrypted export imported without --encrypt leaves the legacy JSON document in a TEXT cell
+    value = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    if _is_sealed_memory_record(value):
+        header = value[:len(_MEMORY_RECORD_MAGIC) + 1]
+        if header[-1] != _MEMORY_RECORD_VERSION:
+            raise ValueError(f"unknown memory record version: {header[-1]}")
+        if not key:
+            raise RuntimeError("MEMORY_KEY is not set!")
+        nonce = value[len(header):len(header) + 12]
+        return _unpack_memory_record(AESGCM(key).decrypt(nonce, value[len(header) + 12:], header))
+
+    data = None
+    if key:
+        try:
+            data = json.loads(_decrypt_record(value, key))
+        except Exception:
+            pass
+    if data is None:
+        data = json.loads(value)
+    if not isinstance(data, dict):
+        raise ValueError("Invalid memory record")
+    summaries = []
+    for s in data.get('summaries') or []:
+        if not isinstance(s, dict):
+            summaries.append({'text': s, 'embedding': b''})
+            continue
+        try:
+            emb = embedding_from_text(s.get('embedding') or '')
+        except Exception:
+            emb = b''
+        summaries.append({'text': s.get('text', ''), 'embedding': emb})
+    return {'summaries': summaries, 'memories': list(data.get('memories') or [])}
+
+
+def _memory_record_json(data: dict) -> bytes:
+    # the legacy JSON document, exports use it so decrypted memories stay readable and import as legacy records
+    summaries = [{'text': s['text'], 'embedding': embedding_to_text(s['embedding'])} for s in data['summaries']]
+    return json.dumps({'summaries': summaries, 'memories': data['memories']}, ensure_ascii=False).encode('utf-8')
+
+
 def _encrypt_image_description(plaintext: str) -> str:
     key = _get_image_key()
     if not key:
@@ -308,23 +1840,69 @@ def _decrypt_image_description(encrypted: str) -> str:
         return encrypted
 
 
+# cache hits only record last_used here; the timestamps are written in batches
+_IMAGE_TOUCHES = {}
+_IMAGE_TOUCH_LOCK = threading.Lock()
+_IMAGE_TOUCH_BATCH = 256
+
+
+def _touch_image(attach_id: str) -> None:
+    with _IMAGE_TOUCH_LOCK:
+        _IMAGE_TOUCHES[attach_id] = time.time()
+        full = len(_IMAGE_TOUCHES) >= _IMAGE_TOUCH_BATCH
+    if full:
+        flush_image_touches()
+
+
+@_instrumented('touch', 'image_descriptions')
+def flush_image_touches() -> int:
+    with _IMAGE_TOUCH_LOCK:
+        if not _IMAGE_TOUCHES:
+            return 0
+        touches = [(ts, attach_id) for attach_id, ts in _IMAGE_TOUCHES.items()]
+        _IMAGE_TOUCHES.clear()
+    _flush_table('image_descriptions')
+    with _writer_lock():
+        conn = _get_conn()
+        conn.executemany(
+            "UPDATE image_descriptions SET last_used = MAX(last_used, ?) WHERE attach_id = ?",
+            touches
+        )
+        conn.commit()
+    return len(touches)
+
+
+@_instrumented('scan', 'image_descriptions')
 def load_image_descriptions() -> dict:
-    return get_json('image_descriptions', {}) or {}
+    try:
+        flush_image_touches()
+        with _read_cursor() as cur:
+            cur.execute("SELECT attach_id, description, last_used FROM image_descriptions")
+            rows = cur.fetchall()
+        return {
+            attach_id: {
+                'description': description,
+                'last_used': datetime.fromtimestamp(last_used, timezone.utc).isoformat()
+            }
+            for attach_id, description, last_used in rows
+        }
+    except Exception:
+        return {}
 
 
+@_instrumented('get', 'image_descriptions')
 def get_image_description(attach_id) -> str | None:
     try:
-        imgs = load_image_descriptions()
-        ent = imgs.get(str(attach_id))
-        if not ent:
-            return None
-        try:
-            ent['last_used'] = datetime.now(timezone.utc).isoformat()
-            imgs[str(attach_id)] = ent
-            set_json('image_descriptions', imgs)
-        except Exception:
-            pass
-        description = ent.get('description')
+        attach_id = str(attach_id)
+        description = _pending_value(('image_descriptions', attach_id))
+        if description is _MISSING:
+            with _read_cursor() as cur:
+                cur.execute("SELECT description FROM image_descriptions WHERE attach_id = ?", (attach_id,))
+                row = cur.fetchone()
+            if not row:
+                return None
+            description = row[0]
+        _touch_image(attach_id)
         if description:
             description = _decrypt_image_description(description)
         return description
@@ -332,65 +1910,55 @@ def get_image_description(attach_id) -> str | None:
         return None
 
 
+@_instrumented('set', 'image_descriptions')
 def save_image_description(attach_id, description: str) -> None:
     try:
-        imgs = load_image_descriptions()
         encrypted_description = _encrypt_image_description(description)
-        imgs[str(attach_id)] = {
-            'description': encrypted_description,
-            'last_used': datetime.now(timezone.utc).isoformat()
-        }
-        set_json('image_descriptions', imgs)
+        _queue_write(
+            ('image_descriptions', str(attach_id)),
+            "REPLACE INTO image_descriptions (attach_id, description, last_used) VALUES (?, ?, ?)",
+            (str(attach_id), encrypted_description, time.time()),
+            encrypted_description
+        )
     except Exception:
         raise
 
 
+@_instrumented('prune', 'image_descriptions')
 def prune_image_descriptions(age_hours: int = 24) -> list:
     try:
-        imgs = load_image_descriptions()
-        now = datetime.now(timezone.utc)
-        removed = []
-        for k, v in list(imgs.items()):
-            lu = v.get('last_used') if isinstance(v, dict) else None
-            if not lu:
-                removed.append(k)
-                del imgs[k]
-                continue
-            try:
-                last_used = datetime.fromisoformat(lu)
-                if last_used.tzinfo is None:
-                    last_used = last_used.replace(tzinfo=timezone.utc)
-            except Exception:
-                removed.append(k)
-                del imgs[k]
-                continue
-            if (now - last_used) > timedelta(hours=age_hours):
-                removed.append(k)
-                del imgs[k]
-        if removed:
-            set_json('image_descriptions', imgs)
-        return removed
+        flush_image_touches()
+        _flush_table('image_descriptions')
+        cutoff = time.time() - age_hours * 3600
+        with _writer_lock():
+            conn = _get_conn()
+            rows = conn.execute(
+                "DELETE FROM image_descriptions WHERE last_used < ? RETURNING attach_id",
+                (cutoff,)
+            ).fetchall()
+            conn.commit()
+        return [r[0] for r in rows]
     except Exception:
         return []
 
 
+@_instrumented('add', 'abuse_tracking')
 def add_abuse_tracking_record(user_id: int, content_hash: str, content_len: int, timestamp: float) -> None:
     try:
-        with _LOCK:
-            conn = _get_conn()
-            conn.execute(
-                "INSERT INTO abuse_tracking (user_id, content_hash, content_len, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, content_hash, content_len, timestamp)
-            )
-            conn.commit()
+        _queue_write(
+            ('abuse_tracking', None),
+            "INSERT INTO abuse_tracking (user_id, content_hash, content_len, timestamp) VALUES (?, ?, ?, ?)",
+            (user_id, content_hash, content_len, timestamp)
+        )
     except Exception:
         raise
 
 
+@_instrumented('get', 'abuse_tracking')
 def get_abuse_tracking_records(user_id: int, limit: int = 200) -> list:
     try:
-        with _LOCK:
-            cur = _get_conn().cursor()
+        _flush_table('abuse_tracking')
+        with _read_cursor('abuse') as cur:
             cur.execute(
                 "SELECT user_id, content_hash, content_len, timestamp FROM abuse_tracking WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
                 (user_id, limit)
@@ -409,10 +1977,11 @@ def get_abuse_tracking_records(user_id: int, limit: int = 200) -> list:
         return []
 
 
+@_instrumented('scan', 'abuse_tracking')
 def get_all_tracked_users() -> list:
     try:
-        with _LOCK:
-            cur = _get_conn().cursor()
+        _flush_table('abuse_tracking')
+        with _read_cursor('abuse') as cur:
             cur.execute("SELECT DISTINCT user_id FROM abuse_tracking")
             rows = cur.fetchall()
             return [row[0] for row in rows]
@@ -420,10 +1989,11 @@ def get_all_tracked_users() -> list:
         return []
 
 
+@_instrumented('count', 'abuse_tracking')
 def get_tracked_users_count() -> int:
     try:
-        with _LOCK:
-            cur = _get_conn().cursor()
+        _flush_table('abuse_tracking')
+        with _read_cursor('abuse') as cur:
             cur.execute("SELECT COUNT(DISTINCT user_id) FROM abuse_tracking")
             row = cur.fetchone()
             return row[0] if row else 0
@@ -431,48 +2001,378 @@ def get_tracked_users_count() -> int:
         return 0
 
 
+@_instrumented('clear', 'abuse_tracking')
 def clear_abuse_tracking_records(user_id: int) -> None:
     try:
-        with _LOCK:
-            conn = _get_conn()
-            conn.execute("DELETE FROM abuse_tracking WHERE user_id = ?", (user_id,))
-            conn.commit()
+        _queue_write(('abuse_tracking', None), "DELETE FROM abuse_tracking WHERE user_id = ?", (user_id,))
     except Exception:
         raise
 
 
+@_instrumented('scan', 'rpa_history')
 def load_rpa_history() -> dict:
-    return get_json('rpa_history', {}) or {}
+    try:
+        _flush_table('rpa_history')
+        with _read_cursor() as cur:
+            cur.execute("SELECT user_id, match FROM rpa_history ORDER BY id")
+            rows = cur.fetchall()
+    except Exception:
+        return {}
+    out = {}
+    for uid, match in rows:
+        try:
+            out.setdefault(uid, []).append(json.loads(match))
+        except Exception:
+            continue
+    return out
 
 
+@_instrumented('replace', 'rpa_history')
 def save_rpa_history(data: dict):
-    set_json('rpa_history', data or {})
-
-
+    rows = []
+    for uid, matches in (data or {}).items():
+        for m in (matches or [])[-_RPA_HISTORY_LIMIT:]:
+            rows.append((str(uid), json.dumps(m, ensure_ascii=False)))
+    flush()
+    with _writer_lock():
+        conn = _get_conn()
+        conn.execute("DELETE FROM rpa_history")
+        conn.executemany("INSERT INTO rpa_history (user_id, match) VALUES (?, ?)", rows)
+        conn.commit()
+
+
+@_instrumented('get', 'rpa_history')
 def get_rpa_user_history(user_id: int) -> list:
-    all_history = load_rpa_history()
-    return all_history.get(str(user_id), [])
+    try:
+        _flush_table('rpa_history')
+        with _read_cursor() as cur:
+            cur.execute(
+                "SELECT match FROM rpa_history WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (str(user_id), _RPA_HISTORY_LIMIT)
+            )
+            rows = cur.fetchall()
+    except Exception:
+        return []
+    out = []
+    for row in reversed(rows):
+        try:
+            out.append(json.loads(row[0]))
+        except Exception:
+            continue
+    return out
 
 
+@_instrumented('add', 'rpa_history')
 def append_rpa_match(user_id: int, match: dict) -> None:
-    all_history = load_rpa_history()
     key = str(user_id)
-    matches = all_history.get(key, [])
-    matches.append(match)
-    if len(matches) > 10:
-        matches = matches[-10:]
-    all_history[key] = matches
-    save_rpa_history(all_history)
+    _queue_write(
+        ('rpa_history', None),
+        "INSERT INTO rpa_history (user_id, match) VALUES (?, ?)",
+        (key, json.dumps(match, ensure_ascii=False))
+    )
+    _queue_write(
+        ('rpa_history', None),
+        "DELETE FROM rpa_history WHERE user_id = ? AND id NOT IN "
+        "(SELECT id FROM rpa_history WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+        (key, key, _RPA_HISTORY_LIMIT)
+    )
+
+
+@_instrumented('get', 'question_embeddings')
+def get_question_history(user_id, genre: str):
+    # returns (questions, matrix): one unit-length float32 row per question, oldest first
+    try:
+        _flush_table('question_embeddings')
+        with _read_cursor() as cur:
+            cur.execute(
+                "SELECT question, embedding FROM question_embeddings "
+                "WHERE user_id = ? AND genre = ? AND embedding IS NOT NULL ORDER BY id DESC LIMIT ?",
+                (str(user_id), str(genre), _QUESTION_HISTORY_LIMIT)
+            )
+            rows = cur.fetchall()[::-1]
+    except Exception:
+        rows = []
+    if rows:
+        # rows from an older embedding model cannot be compared with the current one
+        width = len(rows[-1][1])
+        rows = [r for r in rows if len(r[1]) == width]
+        _add_bytes(read=width * len(rows))
+        matrix = np.stack([unpack_embedding(r[1]) for r in rows])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1)
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    return [r[0] for r in rows], matrix
+
+
+@_instrumented('add', 'question_embeddings')
+def add_question(user_id, genre: str, question: str, embedding) -> None:
+    key, genre = str(user_id), str(genre)
+    blob = _pack_embedding(embedding)
+    _add_bytes(written=len(blob or b''))
+    _queue_write(
+        ('question_embeddings', None),
+        "INSERT INTO question_embeddings (user_id, genre, question, embedding) VALUES (?, ?, ?, ?)",
+        (key, genre, question, blob)
+    )
+    _queue_write(
+        ('question_embeddings', None),
+        "DELETE FROM question_embeddings WHERE user_id = ? AND genre = ? AND id NOT IN "
+        "(SELECT id FROM question_embeddings WHERE user_id = ? AND genre = ? ORDER BY id DESC LIMIT ?)",
+        (key, genre, key, genre, _QUESTION_HISTORY_LIMIT)
+    )
+
+
+@_instrumented('get', 'question_embeddings')
+def get_question_genre_counts(user_id) -> dict:
+    try:
+        _flush_table('question_embeddings')
+        with _read_cursor() as cur:
+            cur.execute(
+                "SELECT genre, COUNT(*) FROM question_embeddings WHERE user_id = ? GROUP BY genre",
+                (str(user_id),)
+            )
+            return dict(cur.fetchall())
+    except Exception:
+        return {}
+
+
+@_instrumented('count', 'question_embeddings')
+def get_question_users_count() -> int:
+    try:
+        _flush_table('question_embeddings')
+        with _read_cursor() as cur:
+            cur.execute("SELECT COUNT(DISTINCT user_id) FROM question_embeddings")
+            return cur.fetchone()[0]
+    except Exception:
+        return 0
+
+
+@_instrumented('get', 'user_memories')
+def get_user_memory_record(user_id):
+    # encrypted memories of one user, encryption is up to memory.py
+    try:
+        pending = _pending_value(('user_memories', str(user_id)))
+        if pending is not _MISSING:
+            return pending
+        with _read_cursor('memory') as cur:
+            cur.execute("SELECT value FROM user_memories WHERE user_id = ?", (str(user_id),))
+            row = cur.fetchone()
+        if not row:
+            return None
+        _add_bytes(read=len(row[0]))
+        return row[0]
+    except Exception:
+        return None
+
+
+@_instrumented('set', 'user_memories')
+def set_user_memory_record(user_id, data) -> None:
+    key = str(user_id)
+    if data is None:
+        _queue_write(('user_memories', key), "DELETE FROM user_memories WHERE user_id = ?", (key,), None)
+        return
+    _add_bytes(written=len(data))
+    _queue_write(
+        ('user_memories', key),
+        "REPLACE INTO user_memories (user_id, value) VALUES (?, ?)",
+        (key, data),
+        data
+    )
 
 
+@_instrumented('scan', 'user_memories')
+def load_user_memory_records() -> dict:
+    try:
+        _flush_table('user_memories')
+        with _read_cursor('memory') as cur:
+            cur.execute("SELECT user_id, value FROM user_memories")
+            rows = cur.fetchall()
+    except Exception:
+        return {}
+    _add_bytes(read=sum(len(r[1]) for r in rows))
+    return dict(rows)
+
+
+@_instrumented('count', 'user_memories')
+def get_user_memory_count() -> int:
+    try:
+        _flush_table('user_memories')
+        with _read_cursor('memory') as cur:
+            cur.execute("SELECT COUNT(*) FROM user_memories")
+            return cur.fetchone()[0]
+    except Exception:
+        return 0
+
+
+# a hit only moves last_used forward once this much time has passed, so repeated texts do not write on every lookup
+_EMBEDDING_TOUCH_SECONDS = 3600
+
+
+def _seal_embedding(model: str, text_hash: str, data: bytes, key: bytes) -> bytes:
+    # nonce + ciphertext, bound to its row so a stored vector cannot be moved to another text
+    nonce = os.urandom(12)
+    return nonce + AESGCM(key).encrypt(nonce, data, f"{model}\x00{text_hash}".encode('utf-8'))
+
+
+def _open_embedding(model: str, text_hash: str, data: bytes, key: bytes) -> bytes | None:
+    try:
+        return AESGCM(key).decrypt(data[:12], data[12:], f"{model}\x00{text_hash}".encode('utf-8'))
+    except Exception:
+        return None
+
+
+@_instrumented('get', 'embedding_cache')
+def get_cached_embeddings(model: str, text_hashes: list) -> dict:
+    # text hash -> float32 bytes for the hashes that are stored, embeddings are only stored when there is a memory key
+    found = {}
+    key = _get_image_key()
+    if not key:
+        return found
+    try:
+        wanted = []
+        for text_hash in dict.fromkeys(text_hashes):
+            pending = _pending_value(('embedding_cache', model, text_hash))
+            if pending is _MISSING:
+                wanted.append(text_hash)
+            elif pending is not None:
+                found[text_hash] = pending
+        rows = []
+        with _read_cursor('memory') as cur:
+            for lo in range(0, len(wanted), 500):
+                chunk = wanted[lo:lo + 500]
+                cur.execute(
+                    f"SELECT text_hash, embedding, last_used FROM embedding_cache "
+                    f"WHERE model = ? AND text_hash IN ({', '.join('?' * len(chunk))})",
+                    (model, *chunk)
+                )
+                rows += cur.fetchall()
+        now = time.time()
+        for text_hash, data, last_used in rows:
+            _add_bytes(read=len(data))
+            data = _open_embedding(model, text_hash, data, key)
+            if data is None:
+                continue
+            found[text_hash] = data
+            if now - last_used >= _EMBEDDING_TOUCH_SECONDS:
+                _queue_write(
+                    ('embedding_cache', model, text_hash, 'touch'),
+                    "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    (now, model, text_hash)
+                )
+    except Exception:
+        pass
+    return found
+
+
+@_instrumented('set', 'embedding_cache')
+def save_cached_embedding(model: str, text_hash: str, data: bytes) -> None:
+    key = _get_image_key()
+    if not key:
+        return
+    sealed = _seal_embedding(model, text_hash, data, key)
+    _add_bytes(written=len(sealed))
+    _queue_write(
+        ('embedding_cache', model, text_hash),
+        "REPLACE INTO embedding_cache (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+        (model, text_hash, sealed, time.time()),
+        data
+    )
+
+
+@_instrumented('prune', 'embedding_cache')
+def prune_embedding_cache(max_age_days: float = 30, max_rows: int = 0) -> int:
+    # drops embeddings unused for max_age_days, then the least recently used ones above max_rows (0 keeps all)
+    try:
+        _flush_table('embedding_cache')
+        with _writer_lock('memory'):
+            conn = _get_conn('memory')
+            removed = conn.execute(
+                "DELETE FROM embedding_cache WHERE last_used < ?", (time.time() - max_age_days * 86400,)
+            ).rowcount
+            if max_rows:
+                extra = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0] - max_rows
+                if extra > 0:
+                    removed += conn.execute(
+                        "DELETE FROM embedding_cache WHERE rowid IN "
+                        "(SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?)",
+                        (extra,)
+                    ).rowcount
+            conn.commit()
+        return removed
+    except Exception:
+        return 0
+
+
+@_instrumented('prune', 'abuse_tracking')
 def prune_old_abuse_tracking(days: int = 30) -> int:
     try:
         cutoff_timestamp = time.time() - (days * 24 * 3600)
-        with _LOCK:
-            conn = _get_conn()
+        flush('abuse')
+        with _writer_lock('abuse'):
+            conn = _get_conn('abuse')
             cur = conn.cursor()
             cur.execute("DELETE FROM abuse_tracking WHERE timestamp < ?", (cutoff_timestamp,))
             conn.commit()
             return cur.rowcount
     except Exception:
-        return 0
\ No newline at end of file
+        return 0
+
+
+async def arun(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IO_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+async def aread(fn, *args, **kwargs):
+    # for calls that only read, they may run alongside each other and alongside writes
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_READ_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+async def aget_many(keys, default=None, view: bool = False) -> dict:
+    return await aread(get_many, keys, default, view)
+
+
+async def aload_settings():
+    return await aread(load_settings)
+
+
+async def aview_settings():
+    return await aread(view_settings)
+
+
+async def asave_settings(settings: dict):
+    await arun(save_settings, settings)
+
+
+async def amark_banned_user_notified(user_id: int):
+    await arun(mark_banned_user_notified, user_id)
+
+
+async def aget_image_description(attach_id):
+    return await aread(get_image_description, attach_id)
+
+
+async def asave_image_description(attach_id, description: str) -> None:
+    await arun(save_image_description, attach_id, description)
+
+
+async def aget_context():
+    return await aread(get_context)
+
+
+async def aget_context_entry(user_id):
+    return await aread(get_context_entry, user_id)
+
+
+async def aincrement_daily_count(user_id, day: str) -> int:
+    return await arun(increment_daily_count, user_id, day)
+
+
+async def aget_freewill_attempt(channel_id):
+    return await aread(get_freewill_attempt, channel_id)
+
+
+async def aset_freewill_attempt(channel_id, message_id) -> None:
+    await arun(set_freewill_attempt, channel_id, message_id)
@@ -0,0 +1,83 @@
+import base64
+import io
+import os
+
+import pytest
+
+os.environ.setdefault("AI_NERD_AI_KEY", "test")
+os.environ.setdefault("AI_NERD_MEMORY_KEY_B64", base64.urlsafe_b64encode(os.urandom(32)).decode())
+
+import memory  # noqa: E402
+import storage  # noqa: E402
+import transfer  # noqa: E402
+
+
+@pytest.fixture
+def use_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory, "embed_text", lambda text: [1.0, 0.5, -0.25])
+
+    def use(name):
+        storage.use_backend(storage.SQLiteBackend(str(tmp_path / name)))
+        memory._MEMORIES_CACHE = None
+        memory._USER_MEMORIES_CACHE = None
+        memory._INDEXES.clear()
+
+    yield use
+    storage.close()
+
+
+def _export(decrypt: bool) -> list:
+    storage.flush()
+    out = io.StringIO()
+    transfer.export(out, decrypt=decrypt)
+    return out.getvalue().splitlines()
+
+
+def _save_memories():
+    memory.save_user_memory(1, "user one", "full one")
+    memory.save_memory("global one", "global full")
+    storage.flush()
+
+
+@pytest.mark.parametrize("encrypt", [False, True])
+def test_decrypted_memories_round_trip(use_db, encrypt):
+    use_db("source")
+    _save_memories()
+    lines = _export(decrypt=True)
+
+    use_db("target")
+    transfer.import_(lines, encrypt=encrypt)
+    assert memory.get_user_summaries(1) == ["user one"]
+    assert memory.get_user_memory_detail(1, 1) == "full one"
+    assert memory.get_all_summaries() == ["global one"]
+    assert memory.find_relevant_memories([1.0, 0.5, -0.25], user_id=1)[0]["summary"] == "user one"
+
+    # loading marks the imported legacy records dirty, the flush writes them back packed and encrypted
+    memory.load_memory_cache()
+    memory.flush_memory_cache()
+    storage.flush()
+    assert storage._is_sealed_memory_record(storage.get_user_memory_record("1"))
+    assert storage._is_sealed_memory_record(storage.get_blob(memory.MEMORIES_FILE))
+    memory._USER_MEMORIES_CACHE = None
+    memory._MEMORIES_CACHE = None
+    assert memory.get_user_summaries(1) == ["user one"]
+    assert memory.get_all_summaries() == ["global one"]
+
+
+def test_encrypted_memories_round_trip(use_db):
+    use_db("source")
+    _save_memories()
+    lines = _export(decrypt=False)
+
+    use_db("target")
+    transfer.import_(lines)
+    assert memory.get_user_summaries(1) == ["user one"]
+    assert memory.get_all_summaries() == ["global one"]
+
+
+def test_memory_record_accepts_text_cells():
+    key = base64.urlsafe_b64decode(os.environ["AI_NERD_MEMORY_KEY_B64"])
+    document = '{"summaries": [{"text": "plain", "embedding": ""}], "memories": ["full"]}'
+    assert storage._open_memory_record(document, key) == {
+        "summaries": [{"text": "plain", "embedding": b""}], "memories": ["full"]
+    }
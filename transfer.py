@@ -0,0 +1,366 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import zlib
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import storage
+from config import DATA_DIR
+
+
+# export format, one JSON object per line:
+#   {"type": "export", ...}                                   first line
+#   {"type": "table", "domain", "name", "columns", "plain"}   then one {"type": "row", "values"} per row
+#   {"type": "value", "domain", "table", "key", "codec", "size", "plain"}
+#                                                             then {"type": "chunk", "data": <base64>} until size bytes
+# kv documents and blobs are streamed through SQLite blob handles, so neither side holds a whole value in memory
+FORMAT_VERSION = 1
+_VALUE_TABLES = ('kv', 'blobs')
+_SKIP_TABLES = ('sqlite_sequence', 'migration_progress')
+_NONCE = 12
+_TAG = 16
+# encrypted columns of row tables, handled by --decrypt / --encrypt
+_ENCRYPTED_COLUMNS = {'image_descriptions': 'description', 'user_memories': 'value'}
+
+
+def _write(out, record: dict) -> None:
+    out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+    out.write('\n')
+
+
+def _encode_cell(value):
+    if isinstance(value, bytes):
+        return {'$b64': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def _decode_cell(value):
+    if isinstance(value, dict) and '$b64' in value:
+        return base64.b64decode(value['$b64'])
+    return value
+
+
+def _decrypt_cell(value, key: bytes):
+    if isinstance(value, bytes):
+        try:
+            if storage._is_sealed_memory_record(value):
+                return storage._memory_record_json(storage._open_memory_record(value, key)).decode('utf-8')
+            return storage._decrypt_record(value, key).decode('utf-8')
+        except Exception:
+            return _encode_cell(value)
+    return storage._decrypt_image_description(value) if isinstance(value, str) else value
+
+
+def _encrypt_cell(table: str, value, key: bytes):
+    # image descriptions are stored as text, user memory rows as bytes (plain JSON ones too when there is no key)
+    if not isinstance(value, str):
+        return value
+    if table == 'image_descriptions':
+        return storage._encrypt_image_description(value) if key else value
+    return storage._encrypt_record(value.encode('utf-8'), key) if key else value.encode('utf-8')
+
+
+def _read_blob(conn, table: str, rowid: int, chunk_bytes: int):
+    with conn.blobopen(table, 'value', rowid, readonly=True) as blob:
+        while True:
+            data = blob.read(chunk_bytes)
+            if not data:
+                return
+            yield data
+
+
+def _inflate(chunks, chunk_bytes: int):
+    d = zlib.decompressobj()
+    for data in chunks:
+        while data:
+            out = d.decompress(data, chunk_bytes)
+            if out:
+                yield out
+            data = d.unconsumed_tail
+    tail = d.flush()
+    if tail:
+        yield tail
+
+
+def _b64decode_stream(chunks):
+    buf = b''
+    for data in chunks:
+        buf += data
+        n = len(buf) // 4 * 4
+        if n:
+            yield base64.urlsafe_b64decode(buf[:n])
+            buf = buf[n:]
+    if buf:
+        yield base64.urlsafe_b64decode(buf)
+
+
+def _b64encode_stream(chunks):
+    buf = b''
+    for data in chunks:
+        buf += data
+        n = len(buf) // 3 * 3
+        if n:
+            yield base64.urlsafe_b64encode(buf[:n])
+            buf = buf[n:]
+    if buf:
+        yield base64.urlsafe_b64encode(buf)
+
+
+def _decrypt_stream(chunks, key: bytes):
+    # legacy memory record layout (storage._encrypt_record): urlsafe base64 of nonce + ciphertext + tag
+    head = b''
+    held = b''
+    decryptor = None
+    for data in _b64decode_stream(chunks):
+        if decryptor is None:
+            head += data
+            if len(head) < _NONCE:
+                continue
+            data = head[_NONCE:]
+            decryptor = Cipher(algorithms.AES(key), modes.GCM(head[:_NONCE])).decryptor()
+        held += data
+        if len(held) > _TAG:
+            out = decryptor.update(held[:-_TAG])
+            held = held[-_TAG:]
+            if out:
+                yield out
+    if decryptor is None or len(held) < _TAG:
+        raise ValueError("Invalid encrypted data")
+    tail = decryptor.finalize_with_tag(held)
+    if tail:
+        yield tail
+
+
+def _encrypt_stream(chunks, key: bytes):
+    nonce = os.urandom(_NONCE)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+
+    def raw():
+        yield nonce
+        for data in chunks:
+            yield encryptor.update(data)
+        yield encryptor.finalize() + encryptor.tag
+
+    return _b64encode_stream(raw())
+
+
+def _encrypted_size(size: int) -> int:
+    return 4 * ((size + _NONCE + _TAG + 2) // 3)
+
+
+def _export_value(out, conn, domain: str, table: str, rowid: int, key: str, codec, chunk_bytes: int, decrypt_key):
+    def stored():
+        chunks = _read_blob(conn, table, rowid, chunk_bytes)
+        return _inflate(chunks, chunk_bytes) if codec == 'zlib' else chunks
+
+    plain = False
+    document = None
+    if decrypt_key:
+        head = stored()
+        sealed = storage._is_sealed_memory_record(next(head, b''))
+        head.close()
+        try:
+            if sealed:
+                # packed memory records are decoded whole and exported as the legacy JSON document, an --encrypt
+                # import stores that as a legacy record which memory.py reads and packs again on its next change
+                document = storage._memory_record_json(storage._open_memory_record(b''.join(stored()), decrypt_key))
+                size = len(document)
+            else:
+                # first pass only checks the tag, so a value is never exported half-decrypted
+                size = sum(len(c) for c in _decrypt_stream(stored(), decrypt_key))
+            plain = True
+        except Exception:
+            pass
+    if document is not None:
+        chunks = (document[lo:lo + chunk_bytes] for lo in range(0, len(document), chunk_bytes))
+        codec = None
+    elif plain:
+        chunks = _decrypt_stream(stored(), decrypt_key)
+        codec = None
+    else:
+        chunks = _read_blob(conn, table, rowid, chunk_bytes)
+        with conn.blobopen(table, 'value', rowid, readonly=True) as blob:
+            size = len(blob)
+    _write(out, {'type': 'value', 'domain': domain, 'table': table, 'key': key, 'codec': codec, 'size': size, 'plain': plain})
+    for data in chunks:
+        _write(out, {'type': 'chunk', 'data': base64.b64encode(data).decode('ascii')})
+    return size
+
+
+def export(out, chunk_rows: int = 5000, chunk_bytes: int = 1048576, decrypt: bool = False) -> dict:
+    decrypt_key = storage._get_image_key() if decrypt else None
+    if decrypt and not decrypt_key:
+        raise RuntimeError("MEMORY_KEY is not set!")
+    _write(out, {'type': 'export', 'version': FORMAT_VERSION, 'created_at': time.time(), 'decrypted': bool(decrypt_key)})
+    counts = {}
+    for domain in storage._DATABASES:
+        conn = storage._get_conn(domain)
+        # one read transaction per file keeps its export a consistent snapshot
+        conn.execute("BEGIN")
+        try:
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+            for table in tables:
+                if table in _SKIP_TABLES or table.startswith('sqlite_'):
+                    continue
+                n = 0
+                if table in _VALUE_TABLES:
+                    keys = conn.execute(f"SELECT rowid, key, codec, value IS NULL FROM {table} ORDER BY key").fetchall()
+                    for rowid, key, codec, is_null in keys:
+                        if is_null:
+                            _write(out, {'type': 'value', 'domain': domain, 'table': table, 'key': key, 'codec': None, 'size': None})
+                        else:
+                            _export_value(out, conn, domain, table, rowid, key, codec, chunk_bytes, decrypt_key)
+                        n += 1
+                else:
+                    cur = conn.execute(f"SELECT * FROM {table}")
+                    columns = [c[0] for c in cur.description]
+                    plain = [_ENCRYPTED_COLUMNS[table]] if decrypt_key and table in _ENCRYPTED_COLUMNS else []
+                    plain_idx = [columns.index(c) for c in plain]
+                    _write(out, {'type': 'table', 'domain': domain, 'name': table, 'columns': columns, 'plain': plain})
+                    while True:
+                        rows = cur.fetchmany(chunk_rows)
+                        if not rows:
+                            break
+                        for row in rows:
+                            values = [_decrypt_cell(v, decrypt_key) if i in plain_idx else _encode_cell(v) for i, v in enumerate(row)]
+                            _write(out, {'type': 'row', 'values': values})
+                        n += len(rows)
+                counts[f"{domain}.{table}"] = n
+        finally:
+            conn.rollback()
+    return counts
+
+
+def _import_value(conn, record: dict, lines, encrypt_key):
+    table, size, codec = record['table'], record['size'], record.get('codec')
+    if size is None:
+        conn.execute(f"REPLACE INTO {table} (key, value, codec) VALUES (?, NULL, NULL)", (record['key'],))
+        conn.commit()
+        return
+
+    def chunks(left):
+        while left > 0:
+            chunk = json.loads(next(lines))
+            if chunk.get('type') != 'chunk':
+                raise ValueError(f"expected {left} more bytes for {table} {record['key']!r}")
+            data = base64.b64decode(chunk['data'])
+            left -= len(data)
+            yield data
+        if left < 0:
+            raise ValueError(f"{table} {record['key']!r} is longer than its declared size")
+
+    data = chunks(size)
+    if record.get('plain') and encrypt_key:
+        data = _encrypt_stream(data, encrypt_key)
+        size = _encrypted_size(size)
+    conn.execute(f"REPLACE INTO {table} (key, value, codec) VALUES (?, zeroblob(?), ?)", (record['key'], size, codec))
+    rowid = conn.execute(f"SELECT rowid FROM {table} WHERE key = ?", (record['key'],)).fetchone()[0]
+    with conn.blobopen(table, 'value', rowid) as blob:
+        for part in data:
+            blob.write(part)
+    conn.commit()
+
+
+def import_(lines, chunk_rows: int = 5000, encrypt: bool = False) -> dict:
+    encrypt_key = storage._get_image_key() if encrypt else None
+    if encrypt and not encrypt_key:
+        raise RuntimeError("MEMORY_KEY is not set!")
+    lines = iter(lines)
+    header = json.loads(next(lines))
+    if header.get('type') != 'export' or header.get('version') != FORMAT_VERSION:
+        raise ValueError("not an AI Nerd export")
+
+    counts = {}
+    table = None
+    batch = []
+
+    def flush_rows():
+        if batch:
+            with storage._writer_lock(table['domain']):
+                conn = storage._get_conn(table['domain'])
+                conn.executemany(table['sql'], batch)
+                conn.commit()
+            batch.clear()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        kind = record.get('type')
+        if kind == 'row':
+            values = [_decode_cell(v) for v in record['values']]
+            for i in table['plain']:
+                values[i] = _encrypt_cell(table['table'], values[i], encrypt_key)
+            batch.append(values)
+            counts[table['name']] += 1
+            if len(batch) >= chunk_rows:
+                flush_rows()
+            continue
+        flush_rows()
+        if kind == 'table':
+            columns = record['columns']
+            table = {
+                'domain': record['domain'],
+                'table': record['name'],
+                'name': f"{record['domain']}.{record['name']}",
+                'sql': f"REPLACE INTO {record['name']} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                'plain': [columns.index(c) for c in record.get('plain') or []],
+            }
+            counts.setdefault(table['name'], 0)
+        elif kind == 'value':
+            with storage._writer_lock(record['domain']):
+                _import_value(storage._get_conn(record['domain']), record, lines, encrypt_key)
+            name = f"{record['domain']}.{record['table']}"
+            counts[name] = counts.get(name, 0) + 1
+        else:
+            raise ValueError(f"unexpected {kind!r} record")
+    flush_rows()
+    storage.invalidate_json()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream the storage databases to or from NDJSON")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="directory holding the database files")
+    parser.add_argument("--chunk-rows", type=int, default=5000, help="rows read or written per batch")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="write every table, kv document and blob as NDJSON")
+    exp.add_argument("output", nargs="?", default="-", help="file to write, '-' for stdout")
+    exp.add_argument("--chunk-bytes", type=int, default=1048576, help="bytes per chunk line for large values")
+    exp.add_argument("--decrypt", action="store_true",
+                     help="decrypt encrypted blobs and image descriptions with the current memory key")
+
+    imp = sub.add_parser("import", help="load an NDJSON export into the databases in --data-dir")
+    imp.add_argument("input", nargs="?", default="-", help="file to read, '-' for stdin")
+    imp.add_argument("--encrypt", action="store_true",
+                     help="encrypt values that were exported with --decrypt using the current memory key")
+
+    args = parser.parse_args()
+    storage.use_backend(storage.SQLiteBackend(args.data_dir))
+    try:
+        if args.command == "export":
+            out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+            try:
+                counts = export(out, args.chunk_rows, args.chunk_bytes, args.decrypt)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        else:
+            src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+            try:
+                counts = import_(src, args.chunk_rows, args.encrypt)
+            finally:
+                if src is not sys.stdin:
+                    src.close()
+    finally:
+        storage.close()
+    print(json.dumps(counts), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import base64
+import threading
+
+import numpy as np
+
+from config import MEMORY_ANN_MIN_SIZE, MEMORY_ANN_PROBES
+
+_TRAIN_POINTS_PER_LIST = 32
+_TRAIN_ITERATIONS = 8
+_ASSIGN_CHUNK = 2048
+_BUILD_CHUNK = 4096
+# approximate searches gather this many candidate rows at a time, small enough for the copy to stay in cache
+_GATHER_CHUNK = 128
+# list id of rows that are waiting to be assigned to the current centroids, they are scored by every search
+_UNASSIGNED = -2
+# text form of packed embeddings inside JSON documents, unprefixed strings are legacy base64 float32
+_TEXT_PREFIX = "q8:"
+
+
+def quantize(vec) -> tuple:
+    # symmetric int8 codes with one float32 scale per vector: vec ~= codes * scale
+    vec = np.asarray(vec, dtype=np.float32)
+    peak = np.abs(vec).max(axis=-1) if vec.size else np.zeros(vec.shape[:-1], dtype=np.float32)
+    scale = (peak / 127).astype(np.float32)
+    safe = np.where(scale > 0, scale, 1)
+    codes = np.rint(vec / (safe[..., None] if vec.ndim > 1 else safe)).astype(np.int8)
+    return codes, scale
+
+
+def pack_embedding(vec) -> bytes:
+    """float32 scale followed by the int8 codes, a quarter of the float32 size."""
+    codes, scale = quantize(np.asarray(vec, dtype=np.float32).ravel())
+    return np.float32(scale).tobytes() + codes.tobytes()
+
+
+def unpack_embedding(data: bytes) -> np.ndarray:
+    if len(data) < 4:
+        return np.zeros(0, dtype=np.float32)
+    scale = np.frombuffer(data, dtype=np.float32, count=1)[0]
+    return np.frombuffer(data, dtype=np.int8, offset=4).astype(np.float32) * scale
+
+
+def embedding_to_text(data: bytes) -> str:
+    return _TEXT_PREFIX + base64.urlsafe_b64encode(data).decode('ascii') if data else ""
+
+
+def embedding_from_text(text: str) -> bytes:
+    """Packed bytes of a text embedding, legacy float32 ones are quantized."""
+    if not text:
+        return b""
+    if text.startswith(_TEXT_PREFIX):
+        return base64.urlsafe_b64decode(text[len(_TEXT_PREFIX):].encode('ascii'))
+    raw = base64.urlsafe_b64decode(text.encode('ascii'))
+    return pack_embedding(np.frombuffer(raw, dtype=np.float32)) if raw else b""
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # positions of the k best scores in the same order as a stable sort by score: ties at the cut-off keep the lowest positions
+    k = min(int(k), len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+    idx = np.concatenate([above, ties])
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+
+class VectorIndex:
+    """Unit-length vectors kept in insertion order, scored as float32.
+
+    Rows are quantized the same way as stored embeddings (see `quantize`) and kept dequantized, so searches give the
+    same scores as the packed rows would while scoring with a plain float32 matrix product, which numpy runs several
+    times faster than an int8 dot product.
+
+    Appending and evicting the oldest row are O(1) (amortized), rows live in one buffer and only the live window
+    moves. Searches compare every row until the index holds `ann_min_size` rows, after that they go through an
+    inverted file index: rows are grouped around k-means centroids and only the `probes` groups closest to the query
+    are scored. Zero rows (entries without an embedding) always score 0 and are only returned by exact searches.
+
+    The centroids are trained on a background thread the first time a search finds the index large enough and again
+    once as many rows have been added as it held at the last training, searches stay exact until the first training
+    finishes.
+    """
+
+    def __init__(self, dim: int, ann_min_size: int = MEMORY_ANN_MIN_SIZE, probes: int = MEMORY_ANN_PROBES):
+        self.dim = int(dim)
+        self.ann_min_size = max(1, int(ann_min_size))
+        self.probes = max(1, int(probes))
+        self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._lists = np.zeros(0, dtype=np.int32)
+        self._start = 0
+        self._end = 0
+        self._centroids = None
+        self._trained_size = 0
+        self._since_training = 0
+        self._training = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows: list, dim: int, **kwargs) -> "VectorIndex":
+        # rows are unit vectors of size `dim` or None for a zero row
+        index = cls(dim, **kwargs)
+        n = len(rows)
+        size = n + max(64, n // 2)
+        index._vectors = np.zeros((size, index.dim), dtype=np.float32)
+        index._scales = np.zeros(size, dtype=np.float32)
+        index._lists = np.full(size, -1, dtype=np.int32)
+        for lo in range(0, n, _BUILD_CHUNK):
+            chunk = [np.zeros(index.dim, dtype=np.float32) if r is None else r for r in rows[lo:lo + _BUILD_CHUNK]]
+            if chunk:
+                codes, scales = quantize(np.stack(chunk))
+                index._vectors[lo:lo + len(chunk)] = codes * scales[:, None]
+                index._scales[lo:lo + len(chunk)] = scales
+        index._end = n
+        return index
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Float32 copy of the live rows."""
+        return self._vectors[self._start:self._end].copy()
+
+    @property
+    def nbytes(self) -> int:
+        return len(self) * (self.dim * 4 + 4)
+
+    def append(self, row) -> None:
+        with self._lock:
+            if self._end == len(self._vectors):
+                self._compact()
+            if row is None:
+                self._vectors[self._end], self._scales[self._end] = 0, 0
+            else:
+                codes, scale = quantize(row)
+                self._vectors[self._end], self._scales[self._end] = codes * scale, scale
+            self._lists[self._end] = self._assign(row)
+            self._end += 1
+            self._since_training += 1
+
+    def popleft(self) -> None:
+        with self._lock:
+            if self._end > self._start:
+                self._start += 1
+
+    def delete(self, pos: int) -> None:
+        # shifts whichever side of the row is shorter
+        with self._lock:
+            n = len(self)
+            if not 0 <= pos < n:
+                raise IndexError(pos)
+            i = self._start + pos
+            for arr in (self._vectors, self._scales, self._lists):
+                if pos < n // 2:
+                    arr[self._start + 1:i + 1] = arr[self._start:i].copy()
+                else:
+                    arr[i:self._end - 1] = arr[i + 1:self._end].copy()
+            if pos < n // 2:
+                self._start += 1
+            else:
+                self._end -= 1
+
+    def search(self, query, k: int, exact: bool = False) -> list:
+        """Returns up to k (position, score) pairs, best first. `query` must be a unit vector of size `dim` or None."""
+        n = len(self)
+        k = min(int(k), n)
+        if k <= 0:
+            return []
+        if query is None:
+            return [(i, 0.0) for i in range(k)]
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            candidates = None
+            if not exact and n >= self.ann_min_size:
+                untrained = self._centroids is None and not self._trained_size
+                if not self._training and (untrained or self._since_training >= max(self._trained_size, self.ann_min_size)):
+                    self._training = True
+                    threading.Thread(target=self._train, daemon=True, name="VectorIndexTraining").start()
+                if self._centroids is not None:
+                    centroid_scores = self._centroids @ query
+                    probes = min(self.probes, len(centroid_scores))
+                    # indexed by list id, -1 (zero rows) and _UNASSIGNED wrap around to the last two slots
+                    probed = np.zeros(len(centroid_scores) + 2, dtype=bool)
+                    probed[np.argpartition(-centroid_scores, probes - 1)[:probes]] = True
+                    probed[_UNASSIGNED] = True
+                    candidates = np.flatnonzero(probed[self._lists[self._start:self._end]])
+                    # gathered rows cost about twice as much to score as a contiguous scan of all of them
+                    if len(candidates) < k or len(candidates) > n // 2:
+                        candidates = None
+            if candidates is None:
+                candidates = np.arange(n)
+                scores = self._vectors[self._start:self._end] @ query
+            else:
+                scores = np.empty(len(candidates), dtype=np.float32)
+                for lo in range(0, len(candidates), _GATHER_CHUNK):
+                    slots = self._start + candidates[lo:lo + _GATHER_CHUNK]
+                    scores[lo:lo + len(slots)] = self._vectors[slots] @ query
+        return [(int(candidates[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    def train(self) -> None:
+        """Trains the centroids and assigns every row on the calling thread."""
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+        self._train()
+
+    def _compact(self) -> None:
+        # moves the live rows to the front of a buffer with room for half as many again, so every row is copied
+        # about twice over its lifetime no matter how often the window slides
+        n = len(self)
+        size = n + max(64, n // 2)
+        if size <= len(self._vectors):
+            vectors, scales, lists = self._vectors, self._scales, self._lists
+        else:
+            vectors = np.zeros((size, self.dim), dtype=np.float32)
+            scales = np.zeros(size, dtype=np.float32)
+            lists = np.full(size, -1, dtype=np.int32)
+        vectors[:n] = self._vectors[self._start:self._end].copy()
+        scales[:n] = self._scales[self._start:self._end].copy()
+        lists[:n] = self._lists[self._start:self._end].copy()
+        self._vectors, self._scales, self._lists = vectors, scales, lists
+        self._start, self._end = 0, n
+
+    def _assign(self, row) -> int:
+        if self._centroids is None or row is None or not row.any():
+            return -1
+        return int(np.argmax(self._centroids @ row))
+
+    def _train(self) -> None:
+        # spherical k-means with about sqrt(n) centroids on a sample of the rows, the rows are then assigned in small
+        # chunks so appends, deletes and searches only ever wait for one chunk
+        try:
+            with self._lock:
+                nonzero = np.flatnonzero(self._scales[self._start:self._end] > 0)
+                nlist = max(1, int(np.sqrt(len(nonzero))))
+                rng = np.random.default_rng(len(self))
+                sample_size = min(len(nonzero), nlist * _TRAIN_POINTS_PER_LIST)
+                sample = self._vectors[self._start + np.sort(rng.choice(nonzero, size=sample_size, replace=False))]
+                trained_size = len(self)
+            if not len(sample):
+                # every row is zero, wait for as many new rows as a real training would before trying again
+                with self._lock:
+                    self._trained_size = trained_size
+                    self._since_training = 0
+                return
+
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+            for _ in range(_TRAIN_ITERATIONS):
+                assign = np.argmax(sample @ centroids.T, axis=1)
+                onehot = np.zeros((len(centroids), len(sample)), dtype=np.float32)
+                onehot[assign, np.arange(len(sample))] = 1
+                sums = onehot @ sample
+                norms = np.linalg.norm(sums, axis=1)
+                filled = norms > 0
+                centroids[filled] = sums[filled] / norms[filled, None]
+
+            with self._lock:
+                self._centroids = centroids
+                self._lists[self._start:self._end] = _UNASSIGNED
+                self._trained_size = trained_size
+                self._since_training = 0
+            while True:
+                with self._lock:
+                    lists = self._lists[self._start:self._end]
+                    todo = np.flatnonzero(lists == _UNASSIGNED)[:_ASSIGN_CHUNK]
+                    if not len(todo):
+                        break
+                    slots = self._start + todo
+                    assign = np.argmax(self._vectors[slots] @ centroids.T, axis=1).astype(np.int32)
+                    assign[self._scales[slots] == 0] = -1
+                    lists[todo] = assign
+        finally:
+            self._training = False
+
+
+__all__ = [
+    "VectorIndex", "top_k", "quantize", "pack_embedding", "unpack_embedding", "embedding_to_text", "embedding_from_text"
+]